@@ -0,0 +1,104 @@
+"""
+Compare hashing inference task results serially with the hashing pool.
+
+Images are hashed by the imhash extension, so build it first by `pip install .`
+
+Usage:
+    python benchmarks/hash_benchmark.py --task-type SD_FT_LORA --num-files 64 --mode thread --max-workers 4
+
+By default random images are generated as the validation set.
+Use --dir to hash the png (or json for LLM) files of an existing result dir instead.
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import time
+from typing import List
+
+import anyio
+
+from crynux_server.models import TaskType
+from crynux_server.task.hashing import (HashEngine, get_gpt_resp_hash,
+                                        get_image_hash)
+
+
+def make_files(dirname: str, task_type: TaskType, num_files: int, size: int) -> List[str]:
+    files = []
+    for i in range(num_files):
+        if task_type == TaskType.LLM:
+            filename = os.path.join(dirname, f"{i}.json")
+            with open(filename, mode="w", encoding="utf-8") as f:
+                f.write('{"text": "%s"}' % os.urandom(size).hex())
+        else:
+            from PIL import Image
+
+            filename = os.path.join(dirname, f"{i}.png")
+            img = Image.frombytes("RGB", (size, size), os.urandom(size * size * 3))
+            img.save(filename)
+        files.append(filename)
+    return files
+
+
+def list_files(dirname: str, task_type: TaskType) -> List[str]:
+    pattern = r"[0-9]+\.json" if task_type == TaskType.LLM else r"[0-9]+\.png"
+    files = [f for f in os.listdir(dirname) if re.match(pattern, f)]
+    files.sort(key=lambda f: int(f.split(".")[0]))
+    return [os.path.join(dirname, f) for f in files]
+
+
+def hash_serial(task_type: TaskType, files: List[str]):
+    if task_type == TaskType.LLM:
+        return [get_gpt_resp_hash(f) for f in files]
+    return [get_image_hash(f) for f in files]
+
+
+async def hash_pool(engine: HashEngine, task_type: TaskType, files: List[str]):
+    return await engine.hash_files(task_type, files)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--task-type", choices=["SD", "LLM", "SD_FT_LORA"], default="SD_FT_LORA")
+    parser.add_argument("--dir", default="")
+    parser.add_argument("--num-files", type=int, default=64)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    task_type = TaskType[args.task_type]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.dir:
+            files = list_files(args.dir, task_type)
+        else:
+            files = make_files(tmp_dir, task_type, args.num_files, args.size)
+        print(f"hash {len(files)} files of task type {task_type.name}")
+
+        serial_times = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            expected = hash_serial(task_type, files)
+            serial_times.append(time.perf_counter() - start)
+
+        engine = HashEngine(mode=args.mode, max_workers=args.max_workers)
+        pool_times = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            hashes = anyio.run(hash_pool, engine, task_type, files)
+            pool_times.append(time.perf_counter() - start)
+            assert hashes == expected, "hashes of pool are different from serial"
+
+    serial_time = min(serial_times)
+    pool_time = min(pool_times)
+    print(f"serial: {serial_time:.3f}s")
+    print(f"{args.mode} pool ({args.max_workers} workers): {pool_time:.3f}s")
+    print(f"speedup: {serial_time / pool_time:.2f}x")
+    print(engine.stats.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
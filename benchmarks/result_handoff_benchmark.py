@@ -0,0 +1,140 @@
+"""
+Compare handing off task results through the disk with a memory backed dir (result_shm).
+
+The worker side writes the result images, then the node hashes them and reads them in
+chunks as the upload does. A 9-image 1024x1024 task is used by default.
+
+Images are hashed by the imhash extension when it is built (`pip install .`),
+otherwise sha256 is used and reported.
+
+Usage:
+    python benchmarks/result_handoff_benchmark.py --num-images 9 --size 1024 --drop-cache
+
+--drop-cache evicts the disk results from the page cache after writing, like results
+that have been evicted while waiting for validation. It has no effect on the memory backed dir.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import imhash
+
+from crynux_server.relay.upload import read_chunk
+from crynux_server.task.hashing import get_image_hash
+
+# imhash is a namespace package of the source dir when it is not built
+if not hasattr(imhash, "getPHash"):
+    get_image_hash = None
+hash_name = "imhash" if get_image_hash is not None else "sha256"
+
+
+def write_images(dirname: str, images: List) -> List[str]:
+    files = []
+    for i, img in enumerate(images):
+        filename = os.path.join(dirname, f"{i}.png")
+        img.save(filename)
+        files.append(filename)
+    return files
+
+
+# Evict the files from the page cache, it only works for files on the disk
+def drop_page_cache(files: List[str]):
+    for filename in files:
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def hash_files(files: List[str]) -> List[bytes]:
+    if get_image_hash is not None:
+        return [get_image_hash(f) for f in files]
+    res = []
+    for f in files:
+        with open(f, mode="rb") as fp:
+            res.append(hashlib.sha256(fp.read()).digest())
+    return res
+
+
+def read_for_upload(files: List[str], chunk_size: int) -> int:
+    total = 0
+    for f in files:
+        size = os.path.getsize(f)
+        offset = 0
+        while offset < size:
+            total += len(read_chunk(f, offset, chunk_size))
+            offset += chunk_size
+    return total
+
+
+def timed(func: Callable, *args):
+    start = time.perf_counter()
+    res = func(*args)
+    return res, time.perf_counter() - start
+
+
+def bench(dirname: str, images: List, args) -> Dict[str, float]:
+    times: Dict[str, List[float]] = {"write": [], "hash": [], "upload_read": []}
+    for _ in range(args.rounds):
+        task_dir = tempfile.mkdtemp(dir=dirname)
+        try:
+            files, t = timed(write_images, task_dir, images)
+            times["write"].append(t)
+            # hashing and uploading happen after the results are evicted
+            if args.drop_cache:
+                drop_page_cache(files)
+            _, t = timed(hash_files, files)
+            times["hash"].append(t)
+            if args.drop_cache:
+                drop_page_cache(files)
+            _, t = timed(read_for_upload, files, args.chunk_size)
+            times["upload_read"].append(t)
+        finally:
+            shutil.rmtree(task_dir)
+    return {name: min(values) for name, values in times.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-images", type=int, default=9)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--disk-dir", default=tempfile.gettempdir())
+    parser.add_argument("--shm-dir", default="/dev/shm")
+    parser.add_argument("--chunk-size", type=int, default=1024 * 1024)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--drop-cache", action="store_true")
+    args = parser.parse_args()
+
+    from PIL import Image
+
+    images = [
+        Image.frombytes("RGB", (args.size, args.size), os.urandom(args.size * args.size * 3))
+        for _ in range(args.num_images)
+    ]
+    print(
+        f"{args.num_images} images of {args.size}x{args.size}, hash by {hash_name}, "
+        f"drop cache: {args.drop_cache}"
+    )
+
+    results = {
+        "disk": bench(args.disk_dir, images, args),
+        "shm": bench(args.shm_dir, images, args),
+    }
+    for name, times in results.items():
+        total = sum(times.values())
+        phases = ", ".join(f"{phase} {t * 1000:.1f}ms" for phase, t in times.items())
+        print(f"{name}: {phases}, total {total * 1000:.1f}ms")
+    disk_read = results["disk"]["hash"] + results["disk"]["upload_read"]
+    shm_read = results["shm"]["hash"] + results["shm"]["upload_read"]
+    print(f"hash + upload read speedup: {disk_read / shm_read:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
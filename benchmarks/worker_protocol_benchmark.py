@@ -0,0 +1,89 @@
+"""
+Compare the legacy json worker protocol with the msgpack worker protocol.
+
+Task input and task result messages are encoded and decoded by both protocols.
+Frame sizes are also reported after permessage-deflate (zlib), which is used
+when the worker offers the extension.
+
+Usage:
+    python benchmarks/worker_protocol_benchmark.py --num-messages 10000 --num-models 4
+"""
+
+import argparse
+import time
+import zlib
+from typing import Any, Dict, List
+
+from crynux_server import models
+from crynux_server.worker_manager.protocol import get_codec
+
+
+def make_messages(num_models: int) -> List[Dict[str, Any]]:
+    model_ids = ["base:crynux-ai/stable-diffusion-xl-base-1.0+fp16"] + [
+        f"lora:crynux-ai/lora-{i}" for i in range(num_models - 1)
+    ]
+    task_input = models.TaskInput(
+        task=models.InferenceTaskInput(
+            task_name="inference",
+            task_type=models.TaskType.SD,
+            task_id="0x" + "ab" * 32,
+            models=[models.ModelConfig.from_model_id(model_id) for model_id in model_ids],
+            task_args='{"prompt": "%s", "negative_prompt": "", "seed": 42}' % ("a cat " * 64),
+            output_dir="data/results/" + "ab" * 32,
+        )
+    )
+    task_result = {
+        "task_name": "inference",
+        "task_id_commitment": "0x" + "ab" * 32,
+        "result": {"status": "success"},
+    }
+    return [task_input.model_dump(mode="json"), task_result]
+
+
+def deflate_size(data: bytes | str) -> int:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+
+def bench(protocol: str, messages: List[Dict[str, Any]], num_messages: int, rounds: int):
+    codec = get_codec(protocol)
+    cpu_times = []
+    wall_times = []
+    for _ in range(rounds):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        for i in range(num_messages):
+            data = codec.encode(messages[i % len(messages)])
+            codec.decode(data)
+        cpu_times.append(time.process_time() - cpu_start)
+        wall_times.append(time.perf_counter() - wall_start)
+
+    frames = [codec.encode(msg) for msg in messages]
+    sizes = [len(f.encode("utf-8")) if isinstance(f, str) else len(f) for f in frames]
+    deflate_sizes = [deflate_size(f) for f in frames]
+
+    wall_time = min(wall_times)
+    cpu_time = min(cpu_times)
+    print(f"{protocol}:")
+    print(f"  messages/s: {num_messages / wall_time:.0f}")
+    print(f"  cpu per message: {cpu_time / num_messages * 1e6:.2f}us")
+    print(f"  frame sizes (input, result): {sizes}")
+    print(f"  deflated frame sizes (input, result): {deflate_sizes}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-messages", type=int, default=10000)
+    parser.add_argument("--num-models", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    messages = make_messages(args.num_models)
+    for protocol in ["json/1", "msgpack/1"]:
+        bench(protocol, messages, args.num_messages, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
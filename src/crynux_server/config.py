@@ -175,6 +175,8 @@ class TaskConfig(BaseModel):
     _script_dir: str = "worker"
     _output_dir: str = "tmp/results"
     _worker_pid_file: str = "tmp/crynux_worker.pid"
+    # on the same filesystem as output_dir, so that cached checkpoints can be hard linked
+    _checkpoint_cache_dir: str = "tmp/checkpoints"
 
     worker_patch_url: str
 
@@ -182,6 +184,22 @@ class TaskConfig(BaseModel):
 
     proxy: Optional[ProxyConfig] = None
 
+    worker_pool: Optional[WorkerPoolConfig] = None
+
+    worker_supervisor: Optional[WorkerSupervisorConfig] = None
+
+    stages: Optional[StagesConfig] = None
+
+    hash: Optional[HashConfig] = None
+
+    admission: Optional[AdmissionConfig] = None
+
+    result_gc: Optional[ResultGCConfig] = None
+
+    result_shm: Optional[ResultShmConfig] = None
+
+    checkpoint_cache: Optional[CheckpointCacheConfig] = None
+
     @computed_field
     @property
     def hf_cache_dir(self) -> str:
@@ -207,6 +225,11 @@ class TaskConfig(BaseModel):
     def worker_pid_file(self) -> str:
         return os.path.abspath(os.path.join(_data_dir, self._worker_pid_file))
 
+    @computed_field
+    @property
+    def checkpoint_cache_dir(self) -> str:
+        return os.path.abspath(os.path.join(_data_dir, self._checkpoint_cache_dir))
+
 
 class ModelConfig(BaseModel):
     id: str
@@ -227,6 +250,87 @@ class ProxyConfig(BaseModel):
     password: str = ""
 
 
+# Run a worker process for each GPU, the worker only sees its GPU through the gpu_env variable
+# Each item of gpus is the value of gpu_env, like "0" or "0,1"
+# Only one worker without setting gpu_env is started when gpus is empty
+class WorkerPoolConfig(BaseModel):
+    gpus: List[str] = []
+    gpu_env: str = "CUDA_VISIBLE_DEVICES"
+    # number of standby workers, standby worker i shares the GPUs of worker i,
+    # so the GPUs need memory for the models of both workers
+    standby: int = 0
+    # GPUs of standby workers, one standby worker is started for each item and standby is ignored
+    standby_gpus: List[str] = []
+
+
+# Restart exited worker processes after an exponential backoff from min_delay to max_delay seconds
+# A worker exits crash_loop_exits times in crash_loop_window seconds is in a crash loop and is not restarted
+# Tasks running on an exited worker are sent to other workers again at most max_requeue times
+# A worker which does not stop its cancelled task in cancel_timeout seconds is restarted
+# Legacy workers don't receive cancel messages, they are restarted too unless they finish the task in time
+# Tasks recovered from the task queue store are cancelled if their task runners don't send them
+# again in recover_grace seconds
+class WorkerSupervisorConfig(BaseModel):
+    interval: float = 1
+    min_delay: float = 1
+    max_delay: float = 60
+    crash_loop_exits: int = 5
+    crash_loop_window: float = 600
+    max_requeue: int = 1
+    cancel_timeout: float = 30
+    recover_grace: float = 600
+
+
+# Max number of tasks running concurrently in each stage of the inference task pipeline
+class StagesConfig(BaseModel):
+    fetch_inputs: int = 4
+    execute: int = 1
+    hash: int = 2
+    submit: int = 4
+    upload: int = 2
+
+
+# Result files are hashed in a pool of worker threads or processes
+class HashConfig(BaseModel):
+    mode: Literal["thread", "process"] = "thread"
+    max_workers: int = 4
+    # fraction of result files hashed by the worker which are hashed again to verify, at least one file
+    verify_worker_hashes: float = 0.25
+
+
+# Limit the tasks running on the node at the same time
+# Inference tasks which cannot finish in min_remaining_time seconds are aborted before execution
+class AdmissionConfig(BaseModel):
+    max_inference_tasks: int = 8
+    max_download_tasks: int = 2
+    min_remaining_time: float = 30
+
+
+# Remove result files in output_dir which are left behind by finished, crashed or unknown tasks
+# Results of finished tasks are kept for retention seconds, and the oldest results are removed
+# first when the output_dir is larger than max_size bytes
+# Results of unfinished tasks which are not running are kept for the task timeout and retention seconds
+class ResultGCConfig(BaseModel):
+    interval: float = 600
+    retention: float = 3600
+    max_size: int = 20 * 1024 * 1024 * 1024
+
+
+# Results of image and text tasks are written to dir on a memory backed filesystem,
+# so that hashing and uploading read the results from memory instead of the disk
+# Tasks write results to output_dir when dir holds more than max_size bytes
+# Fine-tune tasks always write to output_dir, because their checkpoints are large
+class ResultShmConfig(BaseModel):
+    dir: str = "/dev/shm/crynux_results"
+    max_size: int = 1024 * 1024 * 1024
+
+
+# Input checkpoints of fine-tune tasks are cached and reused by later tasks
+# Least recently used checkpoints are evicted when the cache is larger than max_size bytes
+class CheckpointCacheConfig(BaseModel):
+    max_size: int = 10 * 1024 * 1024 * 1024
+
+
 class Config(BaseSettings):
     log: LogConfig
 
@@ -234,6 +338,11 @@ class Config(BaseSettings):
 
     db: DBConfig
     relay_url: str
+    # Task results are uploaded to relay in chunks of this size, 0 means uploading in one request
+    relay_upload_chunk_size: int = 0
+    # Tasks of all runners are fetched from relay in batch, the first request waits for
+    # other requests this many seconds, 0 means fetching at once
+    relay_fetch_batch_window: float = 0
 
     task_config: TaskConfig
 
@@ -1,15 +1,18 @@
 from .base import Base, BaseMixin
 from .download_model import DownloadModel
 from .node import NodeState
-from .task import DownloadTaskState, InferenceTaskState
+from .task import DownloadTaskState, InferenceTaskState, InferenceTaskTimeline
+from .task_queue import TaskQueueEntry
 from .tx import TxState
 
 __all__ = [
     "Base",
     "BaseMixin",
     "InferenceTaskState",
+    "InferenceTaskTimeline",
     "DownloadTaskState",
     "NodeState",
     "TxState",
     "DownloadModel",
+    "TaskQueueEntry",
 ]
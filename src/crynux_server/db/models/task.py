@@ -40,6 +40,16 @@ class InferenceTaskState(Base, BaseMixin):
     )
 
 
+class InferenceTaskTimeline(Base, BaseMixin):
+    __tablename__ = "inference_task_timelines"
+
+    task_id_commitment: Mapped[str] = mapped_column(
+        sa.String(length=66), nullable=False, index=True, unique=True
+    )
+    # json object of mark name to timestamp
+    marks: Mapped[str] = mapped_column(sa.Text, nullable=False, index=False)
+
+
 class DownloadTaskState(Base, BaseMixin):
     __tablename__ = "download_task_states"
 
@@ -0,0 +1,28 @@
+from typing import Literal, Optional, get_args
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base, BaseMixin
+
+TaskQueueStatus = Literal["queued", "dispatched"]
+
+
+# Tasks in the worker task exchange, a task is deleted when it is done
+class TaskQueueEntry(Base, BaseMixin):
+    __tablename__ = "task_queue_entries"
+
+    task_id: Mapped[str] = mapped_column(
+        sa.String(255), nullable=False, index=True, unique=True
+    )
+    # json of TaskInput
+    task_input: Mapped[str] = mapped_column(sa.Text, nullable=False, index=False)
+    # json list of the task priority, see task_priority
+    priority: Mapped[str] = mapped_column(sa.Text, nullable=False, index=False)
+    status: Mapped[TaskQueueStatus] = mapped_column(
+        sa.Enum(*get_args(TaskQueueStatus)), nullable=False, index=False
+    )
+    queued_at: Mapped[float] = mapped_column(sa.Float, nullable=False, index=False)
+    dispatched_at: Mapped[Optional[float]] = mapped_column(
+        sa.Float, nullable=True, index=False, default=None
+    )
@@ -10,7 +10,8 @@ from .task import (ChainTask, DownloadTaskState, DownloadTaskStatus,
                    TaskAbortReason, TaskError, TaskType)
 from .tx import TxState, TxStatus
 from .worker import (DownloadTaskInput, ErrorResult, InferenceTaskInput,
-                     SuccessResult, TaskInput, TaskResult)
+                     LoadedModels, SuccessResult, TaskCancel, TaskInput,
+                     TaskProgress, TaskResult, WorkerResultFile)
 
 __all__ = [
     "EventType",
@@ -54,5 +55,9 @@ __all__ = [
     "SuccessResult",
     "ErrorResult",
     "TaskResult",
+    "TaskProgress",
+    "WorkerResultFile",
+    "TaskCancel",
+    "LoadedModels",
     "DownloadedModel",
 ]
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import IntEnum
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel
 
@@ -126,6 +126,8 @@ class InferenceTaskState(BaseModel):
     waiting_tx_hash: bytes = b""
     waiting_tx_method: str = ""
     checkpoint: Optional[str] = None
+    # timestamp of each step of the task, see crynux_server.task.timeline
+    timeline: Dict[str, float] = {}
 
 
 class DownloadTaskState(BaseModel):
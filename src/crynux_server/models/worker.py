@@ -1,4 +1,4 @@
-from typing import List, Literal
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel, Field
 
@@ -26,8 +26,19 @@ class TaskInput(BaseModel):
     task: DownloadTaskInput | InferenceTaskInput = Field(discriminator="task_name")
 
 
+# A result file hashed by the worker, the hash is the same as the node computes, see task.hashing
+class WorkerResultFile(BaseModel):
+    # path relative to the task dir
+    path: str
+    size: int
+    # hex of the result hash
+    hash: str
+
+
 class SuccessResult(BaseModel):
     status: Literal["success"]
+    # result files of the inference task in order, None if the worker doesn't hash results
+    files: Optional[List[WorkerResultFile]] = None
 
 
 class ErrorResult(BaseModel):
@@ -39,3 +50,27 @@ class TaskResult(BaseModel):
     task_name: Literal["inference", "download"]
     task_id_commitment: str
     result: SuccessResult | ErrorResult = Field(discriminator="status")
+
+
+# Sent to the worker to stop the running task, the worker replies the task result when it stops
+class TaskCancel(BaseModel):
+    type: Literal["cancel"]
+    task_id_commitment: str
+
+
+# Sent by the worker while executing the inference task
+class TaskProgress(BaseModel):
+    type: Literal["progress"]
+    task_id_commitment: str
+    # finished steps of all images in the task
+    step: int
+    total: int
+    # seconds since the worker started executing the task
+    elapsed: float
+    images_done: int = 0
+
+
+# Sent by the worker when the models loaded in its memory are changed
+class LoadedModels(BaseModel):
+    type: Literal["loaded_models"]
+    models: List[ModelConfig]
@@ -13,13 +13,18 @@ from tenacity import (AsyncRetrying, before_sleep_log, stop_after_attempt,
 from web3 import Web3
 
 from crynux_server import models
-from crynux_server.config import Config, wait_privkey
+from crynux_server.config import (AdmissionConfig, Config, ResultGCConfig,
+                                  ResultShmConfig, StagesConfig, wait_privkey)
 from crynux_server.contracts import Contracts, set_contracts
 from crynux_server.relay import Relay, WebRelay, set_relay
-from crynux_server.task import (DbDownloadTaskStateCache,
+from crynux_server.retry import RetryPolicy
+from crynux_server.task import (CheckpointCache, DbDownloadTaskStateCache,
                                 DbInferenceTaskStateCache,
                                 DownloadTaskStateCache,
-                                InferenceTaskStateCache, TaskSystem,
+                                InferenceTaskStateCache, StageScheduler,
+                                TaskSystem, make_checkpoint_cache,
+                                make_hash_engine, set_checkpoint_cache,
+                                set_hash_engine,
                                 set_download_task_state_cache,
                                 set_inference_task_state_cache,
                                 set_task_system)
@@ -59,8 +64,10 @@ async def _make_contracts(
     return contracts
 
 
-def _make_relay(privkey: str, relay_url: str) -> Relay:
-    relay = WebRelay(base_url=relay_url, privkey=privkey)
+def _make_relay(privkey: str, relay_url: str, upload_chunk_size: int) -> Relay:
+    relay = WebRelay(
+        base_url=relay_url, privkey=privkey, upload_chunk_size=upload_chunk_size
+    )
     set_relay(relay)
     return relay
 
@@ -79,8 +86,16 @@ def _make_task_system(
     retry: bool,
     contracts: Contracts,
     relay: Relay,
+    watcher: EventWatcher,
     inference_state_cache_cls: Type[InferenceTaskStateCache],
     download_state_cache_cls: Type[DownloadTaskStateCache],
+    stages_config: Optional[StagesConfig] = None,
+    checkpoint_cache: Optional[CheckpointCache] = None,
+    admission_config: Optional[AdmissionConfig] = None,
+    output_dir: Optional[str] = None,
+    result_gc_config: Optional[ResultGCConfig] = None,
+    result_shm_config: Optional[ResultShmConfig] = None,
+    fetch_batch_window: float = 0,
 ) -> TaskSystem:
     inference_state_cache = inference_state_cache_cls()
     set_inference_task_state_cache(inference_state_cache)
@@ -93,6 +108,14 @@ def _make_task_system(
         contracts=contracts,
         relay=relay,
         retry=retry,
+        watcher=watcher,
+        stage_scheduler=StageScheduler(stages_config),
+        checkpoint_cache=checkpoint_cache,
+        admission_config=admission_config,
+        output_dir=output_dir,
+        result_gc_config=result_gc_config,
+        result_shm_config=result_shm_config,
+        fetch_batch_window=fetch_batch_window,
     )
 
     set_task_system(system)
@@ -204,15 +227,40 @@ class NodeManager(object):
                     netstats_contract_address=self.config.ethereum.contract.netstats,
                 )
             if self._relay is None:
-                self._relay = _make_relay(self._privkey, self.config.relay_url)
+                self._relay = _make_relay(
+                    self._privkey,
+                    self.config.relay_url,
+                    self.config.relay_upload_chunk_size,
+                )
+
+        if self._watcher is None:
+            self._watcher = await _make_watcher(relay=self._relay)
 
         if self._task_system is None:
+            set_hash_engine(make_hash_engine(self.config.task_config.hash))
+            checkpoint_cache = make_checkpoint_cache(
+                self.config.task_config.checkpoint_cache_dir,
+                self.config.task_config.checkpoint_cache,
+            )
+            set_checkpoint_cache(checkpoint_cache)
+            # execute a task on each worker of the worker pool by default
+            stages_config = self.config.task_config.stages
+            if stages_config is None:
+                stages_config = StagesConfig(execute=self._worker_manager.num_workers)
             self._task_system = _make_task_system(
                 retry=self._retry,
                 contracts=self._contracts,
                 relay=self._relay,
+                watcher=self._watcher,
                 inference_state_cache_cls=self.inference_state_cache_cls,
-                download_state_cache_cls=self.download_state_cache_cls
+                download_state_cache_cls=self.download_state_cache_cls,
+                stages_config=stages_config,
+                checkpoint_cache=checkpoint_cache,
+                admission_config=self.config.task_config.admission,
+                output_dir=self.config.task_config.output_dir,
+                result_gc_config=self.config.task_config.result_gc,
+                result_shm_config=self.config.task_config.result_shm,
+                fetch_batch_window=self.config.relay_fetch_batch_window,
             )
 
         if self._node_state_manager is None:
@@ -223,9 +271,6 @@ class NodeManager(object):
                 relay=self._relay,
             )
 
-        if self._watcher is None:
-            self._watcher = await _make_watcher(relay=self._relay)
-
         _logger.info("Node manager components initializing complete.")
 
     async def _prefetch_models(self):
@@ -389,7 +434,7 @@ class NodeManager(object):
 
         async for attemp in AsyncRetrying(
             stop=stop_never if self._retry else stop_after_attempt(1),
-            wait=wait_fixed(self._retry_delay),
+            wait=RetryPolicy(max_delay=self._retry_delay).wait,
             reraise=True,
         ):
             with attemp:
@@ -459,7 +504,7 @@ class NodeManager(object):
 
         async for attemp in AsyncRetrying(
             stop=stop_never if self._retry else stop_after_attempt(1),
-            wait=wait_fixed(self._retry_delay),
+            wait=RetryPolicy(max_delay=self._retry_delay).wait,
             reraise=True,
         ):
             with attemp:
@@ -486,7 +531,7 @@ class NodeManager(object):
         remote_now = 0
         async for attemp in AsyncRetrying(
             stop=stop_after_attempt(3),
-            wait=wait_fixed(self._retry_delay),
+            wait=RetryPolicy(max_delay=self._retry_delay).wait,
             reraise=True,
         ):
             with attemp:
@@ -509,7 +554,7 @@ class NodeManager(object):
         assert self._relay is not None
         async for attemp in AsyncRetrying(
             stop=stop_never if self._retry else stop_after_attempt(1),
-            wait=wait_fixed(self._retry_delay),
+            wait=RetryPolicy(max_delay=self._retry_delay).wait,
             reraise=True,
         ):
             with attemp:
@@ -555,7 +600,7 @@ class NodeManager(object):
 
         async for attemp in AsyncRetrying(
             stop=stop_never if self._retry else stop_after_attempt(1),
-            wait=wait_fixed(self._retry_delay),
+            wait=RetryPolicy(max_delay=self._retry_delay).wait,
             reraise=True,
         ):
             with attemp:
@@ -579,6 +624,11 @@ class NodeManager(object):
         try:
             async with create_task_group() as tg:
                 self._tg = tg
+                # tasks pending before the restart are dispatched before the task runners are recovered
+                await self._worker_manager.recover_queue()
+                tg.start_soon(self._worker_manager.persist_queue)
+                # restart worker processes when they exit
+                tg.start_soon(self._worker_manager.supervise)
 
                 async with self._worker_manager.wait_connected(timeout=30):
                     version = self._worker_manager.version
@@ -639,7 +689,7 @@ class NodeManager(object):
                     )
                     async for attemp in AsyncRetrying(
                         stop=stop_never if self._retry else stop_after_attempt(1),
-                        wait=wait_fixed(self._retry_delay),
+                        wait=RetryPolicy(max_delay=self._retry_delay).wait,
                         reraise=True,
                     ):
                         with attemp:
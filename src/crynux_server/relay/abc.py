@@ -14,6 +14,8 @@ from crynux_server.models import (
     TaskError,
 )
 
+from .upload import UploadProgress
+
 
 class Relay(ABC):
     @property
@@ -33,11 +35,25 @@ class Relay(ABC):
     @abstractmethod
     async def get_task(self, task_id_commitment: bytes) -> RelayTask: ...
 
+    @abstractmethod
+    # returns the tasks that exist, in no particular order
+    async def get_tasks(self, task_id_commitments: List[bytes]) -> List[RelayTask]: ...
+
     @abstractmethod
     async def get_checkpoint(
         self, task_id_commitment: bytes, result_checkpoint_dir: str
     ): ...
 
+    # Hash of the task checkpoint archive, None if the relay does not report it
+    @abstractmethod
+    async def get_checkpoint_hash(self, task_id_commitment: bytes) -> Optional[str]: ...
+
+    # Download the task checkpoint archive without unpacking it
+    @abstractmethod
+    async def download_checkpoint(
+        self, task_id_commitment: bytes, checkpoint_file: str
+    ): ...
+
     @abstractmethod
     async def report_task_error(
         self, task_id_commitment: bytes, task_error: TaskError
@@ -57,6 +73,7 @@ class Relay(ABC):
         task_id_commitment: bytes,
         file_paths: List[str],
         checkpoint_dir: Optional[str] = None,
+        progress: Optional[UploadProgress] = None,
     ): ...
 
     @abstractmethod
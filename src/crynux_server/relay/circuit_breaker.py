@@ -0,0 +1,82 @@
+import logging
+import time
+from typing import Literal, Optional
+
+import httpx
+
+_logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(httpx.TransportError):
+    pass
+
+
+# Stop sending requests for reset_timeout seconds after failure_threshold consecutive failures,
+# then let one request through to probe whether the relay has recovered
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> Literal["closed", "open", "half_open"]:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_request(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            raise CircuitOpenError("circuit breaker is open")
+        if state == "half_open":
+            self._probing = True
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def release_probe(self):
+        self._probing = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._probing = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            if self._opened_at is None:
+                _logger.warning("Too many relay failures, circuit breaker is open")
+            self._opened_at = time.monotonic()
+
+
+class CircuitBreakerTransport(httpx.AsyncBaseTransport):
+    def __init__(
+        self, transport: httpx.AsyncBaseTransport, breaker: CircuitBreaker
+    ) -> None:
+        self._transport = transport
+        self.breaker = breaker
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.breaker.before_request()
+        try:
+            resp = await self._transport.handle_async_request(request)
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # cancelled, let the next request probe again
+            self.breaker.release_probe()
+            raise
+        if resp.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return resp
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
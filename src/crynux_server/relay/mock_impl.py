@@ -14,10 +14,12 @@ from crynux_server.models import InferenceTaskStatus, RelayTask, TaskType
 
 from .abc import Relay
 from .exceptions import RelayError
+from .upload import (UploadProgress, archive_checkpoint, make_upload_files,
+                     read_chunk)
 
 
 class MockRelay(Relay):
-    def __init__(self) -> None:
+    def __init__(self, upload_chunk_size: int = 1024 * 1024) -> None:
         super().__init__()
 
         self.tasks: Dict[bytes, RelayTask] = {}
@@ -27,6 +29,9 @@ class MockRelay(Relay):
         self.task_results: Dict[bytes, List[str]] = {}
         self.task_result_checkpoint: Dict[bytes, str] = {}
 
+        self.upload_chunk_size = upload_chunk_size
+        self.upload_offsets: Dict[bytes, List[int]] = {}
+
         self._conditions: Dict[bytes, Condition] = {}
 
         self._tempdir = mkdtemp()
@@ -81,10 +86,10 @@ class MockRelay(Relay):
 
             t = RelayTask(
                 sequence=1,
-                task_id_commitment=task_id_commitment,
-                creator=Web3.to_checksum_address("0x00000000000000000000"),
-                sampling_seed=bytes([0] * 32),
-                nonce=bytes([0] * 32),
+                task_id_commitment="0x" + task_id_commitment.hex(),
+                creator=Web3.to_checksum_address("0x0000000000000000000000000000000000000000"),
+                sampling_seed="0x" + "00" * 32,
+                nonce="0x" + "00" * 32,
                 task_args=task_args,
                 status=InferenceTaskStatus.Started,
                 task_type=TaskType.SD,
@@ -93,12 +98,12 @@ class MockRelay(Relay):
                 min_vram=4,
                 required_gpu="",
                 required_gpu_vram=0,
-                task_fee=Web3.to_wei(1, "wei"),
+                task_fee="1",
                 task_size=1,
                 model_ids=[model_id],
                 score="",
                 qos_score=1,
-                selected_node=Web3.to_checksum_address("0x00000000000000000000"),
+                selected_node=Web3.to_checksum_address("0x0000000000000000000000000000000000000000"),
                 create_time=datetime.now(),
                 start_time=datetime.now(),
                 score_ready_time=datetime.now(),
@@ -134,37 +139,102 @@ class MockRelay(Relay):
                     shutil.copytree, src_path, result_checkpoint_dir
                 )
 
+    async def get_checkpoint_hash(self, task_id_commitment: bytes) -> Optional[str]:
+        return None
+
+    async def download_checkpoint(
+        self, task_id_commitment: bytes, checkpoint_file: str
+    ):
+        with self.wrap_error("getCheckpoint"):
+            condition = self.get_condition(task_id_commitment)
+            async with condition:
+                while task_id_commitment not in self.task_input_checkpoint:
+                    await condition.wait()
+
+                src_path = self.task_input_checkpoint[task_id_commitment]
+                tmp_file = await to_thread.run_sync(
+                    shutil.make_archive, checkpoint_file + ".tmp", "zip", src_path
+                )
+                os.replace(tmp_file, checkpoint_file)
+
     async def get_task(self, task_id_commitment: bytes) -> RelayTask:
         with self.wrap_error("getTask"):
             return self.tasks[task_id_commitment]
 
+    async def get_tasks(self, task_id_commitments: List[bytes]) -> List[RelayTask]:
+        with self.wrap_error("getTasks"):
+            return [
+                self.tasks[task_id_commitment]
+                for task_id_commitment in task_id_commitments
+                if task_id_commitment in self.tasks
+            ]
+
+    # Copy task results in chunks like the chunked upload of WebRelay
+    # Copied bytes of each file are kept, so that a failed upload is resumed by the next call
     async def upload_task_result(
         self,
         task_id_commitment: bytes,
         file_paths: List[str],
         checkpoint_dir: Optional[str] = None,
+        progress: Optional[UploadProgress] = None,
     ):
         with self.wrap_error("uploadTaskResult"):
-            condition = self.get_condition(task_id_commitment)
-            async with condition:
-                self.task_results[task_id_commitment] = []
+            task_dir = os.path.join(self._tempdir, task_id_commitment.hex())
+            if not os.path.exists(task_dir):
+                os.makedirs(task_dir, exist_ok=True)
 
-                task_dir = os.path.join(self._tempdir, task_id_commitment.hex())
-                if not os.path.exists(task_dir):
-                    os.makedirs(task_dir, exist_ok=True)
-
-                for src_path in file_paths:
-                    filename = os.path.basename(src_path)
-                    dst_path = os.path.join(task_dir, filename)
+            checkpoint_file = None
+            if checkpoint_dir is not None:
+                checkpoint_file = await to_thread.run_sync(
+                    archive_checkpoint, checkpoint_dir
+                )
+            files = await to_thread.run_sync(
+                make_upload_files, file_paths, checkpoint_file
+            )
 
-                    await to_thread.run_sync(shutil.copyfile, src_path, dst_path)
-                    self.task_results[task_id_commitment].append(dst_path)
+            offsets = self.upload_offsets.get(task_id_commitment, None)
+            if offsets is None or len(offsets) != len(files):
+                offsets = [0] * len(files)
+                self.upload_offsets[task_id_commitment] = offsets
+
+            total_size = sum(f.size for f in files)
+            if progress is not None:
+                progress(sum(offsets), total_size)
+
+            def _write_chunk(dst_path: str, offset: int, chunk: bytes):
+                with open(dst_path, mode="r+b" if offset > 0 else "wb") as f:
+                    f.seek(offset)
+                    f.write(chunk)
+
+            for index, file in enumerate(files):
+                dst_path = os.path.join(task_dir, file.filename)
+                while offsets[index] < file.size:
+                    chunk = await to_thread.run_sync(
+                        read_chunk, file.path, offsets[index], self.upload_chunk_size
+                    )
+                    await to_thread.run_sync(
+                        _write_chunk, dst_path, offsets[index], chunk
+                    )
+                    offsets[index] += len(chunk)
+                    if progress is not None:
+                        progress(sum(offsets), total_size)
 
-                if checkpoint_dir is not None:
+            condition = self.get_condition(task_id_commitment)
+            async with condition:
+                self.task_results[task_id_commitment] = [
+                    os.path.join(task_dir, file.filename)
+                    for file in files
+                    if file.field == "files"
+                ]
+                if checkpoint_file is not None:
                     dst_path = os.path.join(task_dir, "result_checkpoint")
-
-                    await to_thread.run_sync(shutil.copytree, checkpoint_dir, dst_path)
+                    await to_thread.run_sync(
+                        shutil.unpack_archive,
+                        os.path.join(task_dir, "checkpoint.zip"),
+                        dst_path,
+                    )
                     self.task_result_checkpoint[task_id_commitment] = dst_path
+                del self.upload_offsets[task_id_commitment]
 
                 condition.notify()
 
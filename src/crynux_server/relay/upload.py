@@ -0,0 +1,57 @@
+import os
+import shutil
+from typing import Callable, List, Literal, Optional
+
+from pydantic import BaseModel
+
+# Called with uploaded bytes and total bytes of the task results
+UploadProgress = Callable[[int, int], None]
+
+
+class UploadFile(BaseModel):
+    field: Literal["files", "checkpoint"]
+    filename: str
+    path: str
+    size: int
+
+
+# Zip the checkpoint dir to checkpoint_dir.zip
+# The archive is kept between upload attempts, so that an interrupted upload can be resumed
+def archive_checkpoint(checkpoint_dir: str) -> str:
+    checkpoint_dir = checkpoint_dir.rstrip(os.sep)
+    checkpoint_file = checkpoint_dir + ".zip"
+    if not os.path.exists(checkpoint_file):
+        tmp_base = checkpoint_dir + ".tmp"
+        tmp_file = shutil.make_archive(tmp_base, "zip", checkpoint_dir)
+        os.replace(tmp_file, checkpoint_file)
+    return checkpoint_file
+
+
+def make_upload_files(
+    file_paths: List[str], checkpoint_file: Optional[str] = None
+) -> List[UploadFile]:
+    files = [
+        UploadFile(
+            field="files",
+            filename=os.path.basename(path),
+            path=path,
+            size=os.path.getsize(path),
+        )
+        for path in file_paths
+    ]
+    if checkpoint_file is not None:
+        files.append(
+            UploadFile(
+                field="checkpoint",
+                filename="checkpoint.zip",
+                path=checkpoint_file,
+                size=os.path.getsize(checkpoint_file),
+            )
+        )
+    return files
+
+
+def read_chunk(path: str, offset: int, size: int) -> bytes:
+    with open(path, mode="rb") as f:
+        f.seek(offset)
+        return f.read(size)
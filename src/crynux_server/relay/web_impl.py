@@ -1,14 +1,17 @@
+import hashlib
 import json
 import os
 import shutil
 import tempfile
 from contextlib import ExitStack
 from datetime import datetime
-from typing import Any, BinaryIO, Dict, List, Optional
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
 
 import httpx
-from anyio import open_file, to_thread, wrap_file
+from anyio import create_task_group, open_file, to_thread, wrap_file
 from hexbytes import HexBytes
+from tenacity import (AsyncRetrying, retry_if_exception, stop_after_attempt,
+                      wait_chain, wait_fixed)
 from web3 import Web3
 
 from crynux_server.models import (Event, EventType, TaskAbortReason, TaskError,
@@ -18,8 +21,11 @@ from crynux_server.models.task import RelayTask
 from crynux_server.utils import get_address_from_privkey
 
 from .abc import Relay
+from .circuit_breaker import CircuitBreaker, CircuitBreakerTransport
 from .exceptions import RelayError
 from .sign import Signer
+from .upload import (UploadFile, UploadProgress, archive_checkpoint,
+                     make_upload_files, read_chunk)
 
 
 def _process_resp(resp: httpx.Response, method: str):
@@ -43,12 +49,46 @@ def _process_resp(resp: httpx.Response, method: str):
         raise RelayError(resp.status_code, method, message) from e
 
 
+def _is_retryable_upload_error(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, RelayError):
+        return exc.status_code >= 500 or exc.status_code == 429
+    return False
+
+
 class WebRelay(Relay):
-    def __init__(self, base_url: str, privkey: str) -> None:
+    def __init__(
+        self,
+        base_url: str,
+        privkey: str,
+        upload_chunk_size: int = 0,
+        upload_chunk_retries: int = 5,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
         super().__init__()
-        self.client = httpx.AsyncClient(base_url=base_url, timeout=30)
+        # fail fast when the relay keeps failing, instead of waiting for timeout of every request
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker()
+        self.circuit_breaker = circuit_breaker
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=30,
+            transport=CircuitBreakerTransport(
+                httpx.AsyncHTTPTransport(), circuit_breaker
+            ),
+        )
         self.signer = Signer(privkey=privkey)
         self._node_address = get_address_from_privkey(privkey)
+        # whether the relay supports fetching tasks in batch
+        self._batch_get_tasks = True
+        # upload task results in chunks of upload_chunk_size bytes, 0 means uploading in one request
+        self._upload_chunk_size = upload_chunk_size
+        self._upload_chunk_retries = upload_chunk_retries
+        # whether the relay supports chunked upload
+        self._chunked_upload = True
+        # whether the relay reports the hash of task checkpoints
+        self._checkpoint_hash = True
 
     @property
     def node_address(self):
@@ -99,25 +139,50 @@ class WebRelay(Relay):
     async def get_checkpoint(
         self, task_id_commitment: bytes, result_checkpoint_dir: str
     ):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_file = os.path.join(tmp_dir, "checkpoint.zip")
+            await self.download_checkpoint(task_id_commitment, checkpoint_file)
+            await to_thread.run_sync(
+                shutil.unpack_archive, checkpoint_file, result_checkpoint_dir, "zip"
+            )
+
+    async def get_checkpoint_hash(self, task_id_commitment: bytes) -> Optional[str]:
+        if not self._checkpoint_hash:
+            return None
+
         task_id_commitment_hex = HexBytes(task_id_commitment).hex()
         input = {"task_id_commitment": task_id_commitment_hex}
         timestamp, signature = self.signer.sign(input)
 
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            checkpoint_file = os.path.join(tmp_dir, "checkpoint.zip")
-            async with await open_file(checkpoint_file, mode="wb") as f:
-                resp = await self.client.get(
-                    f"/v1/inference_tasks/{task_id_commitment_hex}/checkpoint",
-                    params={"timestamp": timestamp, "signature": signature},
-                )
+        resp = await self.client.head(
+            f"/v1/inference_tasks/{task_id_commitment_hex}/checkpoint",
+            params={"timestamp": timestamp, "signature": signature},
+        )
+        # relays which don't support it answer HEAD requests with 404, 405 or 501
+        if resp.status_code in (404, 405, 501):
+            self._checkpoint_hash = False
+            return None
+        resp = _process_resp(resp, "getCheckpointHash")
+        return resp.headers.get("X-Checkpoint-Hash", None)
+
+    async def download_checkpoint(self, task_id_commitment: bytes, checkpoint_file: str):
+        task_id_commitment_hex = HexBytes(task_id_commitment).hex()
+        input = {"task_id_commitment": task_id_commitment_hex}
+        timestamp, signature = self.signer.sign(input)
+
+        async with await open_file(checkpoint_file, mode="wb") as f:
+            async with self.client.stream(
+                "GET",
+                f"/v1/inference_tasks/{task_id_commitment_hex}/checkpoint",
+                params={"timestamp": timestamp, "signature": signature},
+                timeout=httpx.Timeout(30, read=300),
+            ) as resp:
+                if resp.status_code >= 400:
+                    await resp.aread()
                 resp = _process_resp(resp, "getCheckpoint")
-                async for chunk in resp.aiter_bytes(4096):
+                async for chunk in resp.aiter_bytes(65536):
                     await f.write(chunk)
 
-            await to_thread.run_sync(
-                shutil.unpack_archive, checkpoint_file, result_checkpoint_dir
-            )
-
     async def get_task(self, task_id_commitment: bytes) -> RelayTask:
         task_id_commitment_hex = HexBytes(task_id_commitment).hex()
         input = {"task_id_commitment": task_id_commitment_hex}
@@ -132,6 +197,48 @@ class WebRelay(Relay):
         data = content["data"]
         return RelayTask.model_validate(data)
 
+    async def get_tasks(self, task_id_commitments: List[bytes]) -> List[RelayTask]:
+        if len(task_id_commitments) == 0:
+            return []
+
+        if self._batch_get_tasks:
+            task_id_commitment_hexes = [
+                HexBytes(task_id_commitment).hex()
+                for task_id_commitment in task_id_commitments
+            ]
+            input = {"task_id_commitments": task_id_commitment_hexes}
+            timestamp, signature = self.signer.sign(input)
+
+            resp = await self.client.post(
+                "/v1/inference_tasks/batch",
+                json={
+                    "task_id_commitments": task_id_commitment_hexes,
+                    "timestamp": timestamp,
+                    "signature": signature,
+                },
+            )
+            if resp.status_code not in (404, 405):
+                resp = _process_resp(resp, "getTasks")
+                content = resp.json()
+                data = content["data"]
+                return [RelayTask.model_validate(d) for d in data]
+            # the relay is too old to support batch fetching, fall back to get_task
+            self._batch_get_tasks = False
+
+        tasks: List[RelayTask] = []
+
+        async def _get_task(task_id_commitment: bytes):
+            try:
+                tasks.append(await self.get_task(task_id_commitment))
+            except RelayError as e:
+                if e.status_code not in (400, 404):
+                    raise
+
+        async with create_task_group() as tg:
+            for task_id_commitment in task_id_commitments:
+                tg.start_soon(_get_task, task_id_commitment)
+        return tasks
+
     async def report_task_error(self, task_id_commitment: bytes, task_error: TaskError):
         task_id_commitment_hex = HexBytes(task_id_commitment).hex()
         input = {"task_id_commitment": task_id_commitment_hex, "task_error": task_error}
@@ -179,11 +286,12 @@ class WebRelay(Relay):
         )
         resp = _process_resp(resp, "abortTask")
 
-    async def upload_task_result(
+    async def _upload_task_result_once(
         self,
         task_id_commitment: bytes,
         file_paths: List[str],
         checkpoint_dir: Optional[str] = None,
+        progress: Optional[UploadProgress] = None,
     ):
         task_id_commitment_hex = HexBytes(task_id_commitment).hex()
         input = {"task_id_commitment": task_id_commitment_hex}
@@ -191,10 +299,12 @@ class WebRelay(Relay):
 
         with ExitStack() as stack:
             files = []
+            total_size = 0
             for file_path in file_paths:
                 filename = os.path.basename(file_path)
                 file_obj = stack.enter_context(open(file_path, "rb"))
                 files.append(("files", (filename, file_obj)))
+                total_size += os.path.getsize(file_path)
 
             if checkpoint_dir is not None:
                 tmp_dir = stack.enter_context(tempfile.TemporaryDirectory())
@@ -205,19 +315,163 @@ class WebRelay(Relay):
                 filename = os.path.basename(checkpoint_file)
                 file_obj = stack.enter_context(open(checkpoint_file, "rb"))
                 files.append(("checkpoint", (filename, file_obj)))
+                total_size += os.path.getsize(checkpoint_file)
 
-            # disable timeout because there may be many images or image size may be very large
+            if progress is not None:
+                progress(0, total_size)
+            # there may be many images or image size may be very large,
+            # so only limit the time of each write and read operation
             resp = await self.client.post(
                 f"/v1/inference_tasks/{task_id_commitment_hex}/results",
                 data={"timestamp": timestamp, "signature": signature},
                 files=files,
-                timeout=None,
+                timeout=httpx.Timeout(30, write=120, read=300),
             )
             resp = _process_resp(resp, "uploadTaskResult")
             content = resp.json()
             message = content["message"]
             if message != "success":
                 raise RelayError(resp.status_code, "uploadTaskResult", message)
+            if progress is not None:
+                progress(total_size, total_size)
+
+    # Create the upload session of task results, or resume the unfinished one
+    # Return the upload id and the uploaded bytes of each file,
+    # or None if the relay doesn't support chunked upload
+    async def _start_upload(
+        self, task_id_commitment_hex: str, files: List[UploadFile]
+    ) -> Optional[Tuple[str, List[int]]]:
+        files_input = [
+            {"field": f.field, "filename": f.filename, "size": f.size} for f in files
+        ]
+        input = {"task_id_commitment": task_id_commitment_hex, "files": files_input}
+        timestamp, signature = self.signer.sign(input)
+
+        resp = await self.client.post(
+            f"/v1/inference_tasks/{task_id_commitment_hex}/results/uploads",
+            json={"files": files_input, "timestamp": timestamp, "signature": signature},
+        )
+        if resp.status_code in (404, 405):
+            return None
+        resp = _process_resp(resp, "uploadTaskResult")
+        data = resp.json()["data"]
+        return data["upload_id"], data["offsets"]
+
+    async def _upload_chunk(
+        self,
+        task_id_commitment_hex: str,
+        upload_id: str,
+        index: int,
+        offset: int,
+        chunk: bytes,
+    ) -> int:
+        # the signature covers the chunk content by its hash
+        chunk_hash = "0x" + hashlib.sha256(chunk).hexdigest()
+        input = {
+            "task_id_commitment": task_id_commitment_hex,
+            "upload_id": upload_id,
+            "index": str(index),
+            "offset": str(offset),
+            "hash": chunk_hash,
+        }
+
+        # a chunk can be written to the same offset again, so it's safe to retry
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(self._upload_chunk_retries),
+            wait=wait_chain(*[wait_fixed(2**i) for i in range(4)]),
+            retry=retry_if_exception(_is_retryable_upload_error),
+            reraise=True,
+        ):
+            with attempt:
+                # sign in each attempt, so that the timestamp doesn't expire after retries
+                timestamp, signature = self.signer.sign(input)
+                resp = await self.client.put(
+                    f"/v1/inference_tasks/{task_id_commitment_hex}/results/uploads/{upload_id}/{index}",
+                    params={
+                        "offset": offset,
+                        "hash": chunk_hash,
+                        "timestamp": timestamp,
+                        "signature": signature,
+                    },
+                    content=chunk,
+                    timeout=httpx.Timeout(30, write=60),
+                )
+                resp = _process_resp(resp, "uploadTaskResult")
+                return resp.json()["data"]["offset"]
+        raise AssertionError("unreachable")
+
+    async def _complete_upload(self, task_id_commitment_hex: str, upload_id: str):
+        input = {"task_id_commitment": task_id_commitment_hex, "upload_id": upload_id}
+        timestamp, signature = self.signer.sign(input)
+
+        resp = await self.client.post(
+            f"/v1/inference_tasks/{task_id_commitment_hex}/results/uploads/{upload_id}/complete",
+            json={"timestamp": timestamp, "signature": signature},
+            timeout=httpx.Timeout(30, read=300),
+        )
+        resp = _process_resp(resp, "uploadTaskResult")
+        content = resp.json()
+        message = content["message"]
+        if message != "success":
+            raise RelayError(resp.status_code, "uploadTaskResult", message)
+
+    async def upload_task_result(
+        self,
+        task_id_commitment: bytes,
+        file_paths: List[str],
+        checkpoint_dir: Optional[str] = None,
+        progress: Optional[UploadProgress] = None,
+    ):
+        if self._upload_chunk_size <= 0 or not self._chunked_upload:
+            await self._upload_task_result_once(
+                task_id_commitment, file_paths, checkpoint_dir, progress
+            )
+            return
+
+        task_id_commitment_hex = HexBytes(task_id_commitment).hex()
+        checkpoint_file = None
+        if checkpoint_dir is not None:
+            checkpoint_file = await to_thread.run_sync(archive_checkpoint, checkpoint_dir)
+        files = await to_thread.run_sync(make_upload_files, file_paths, checkpoint_file)
+
+        res = await self._start_upload(task_id_commitment_hex, files)
+        if res is None:
+            # the relay is too old to support chunked upload
+            self._chunked_upload = False
+            await self._upload_task_result_once(
+                task_id_commitment, file_paths, checkpoint_dir, progress
+            )
+            return
+        upload_id, offsets = res
+
+        total_size = sum(f.size for f in files)
+        uploaded_size = sum(offsets)
+        if progress is not None:
+            progress(uploaded_size, total_size)
+
+        # resume from the uploaded offset of each file
+        for index, (file, offset) in enumerate(zip(files, offsets)):
+            while offset < file.size:
+                chunk = await to_thread.run_sync(
+                    read_chunk, file.path, offset, self._upload_chunk_size
+                )
+                new_offset = await self._upload_chunk(
+                    task_id_commitment_hex, upload_id, index, offset, chunk
+                )
+                if new_offset <= offset:
+                    raise RelayError(
+                        500,
+                        "uploadTaskResult",
+                        f"upload offset of file {index} does not advance from {offset}",
+                    )
+                uploaded_size += new_offset - offset
+                offset = new_offset
+                if progress is not None:
+                    progress(uploaded_size, total_size)
+
+        await self._complete_upload(task_id_commitment_hex, upload_id)
+        if checkpoint_file is not None:
+            await to_thread.run_sync(os.remove, checkpoint_file)
 
     async def get_result(self, task_id_commitment: bytes, index: int, dst: BinaryIO):
         task_id_commitment_hex = HexBytes(task_id_commitment).hex()
@@ -0,0 +1,136 @@
+import logging
+import random
+import time
+from typing import Callable, Literal, Optional
+
+import httpx
+from pydantic import BaseModel
+from tenacity import RetryCallState
+
+from crynux_server.relay.exceptions import RelayError
+from crynux_server.worker_manager.error import (TaskCancelled, TaskError,
+                                                TaskInvalid)
+
+__all__ = [
+    "ErrorClass",
+    "classify_error",
+    "RetryStats",
+    "RetryPolicy",
+]
+
+_logger = logging.getLogger(__name__)
+
+
+# transient: network errors and 5xx of relay, retry soon
+# rate_limited: relay responds 429, retry later
+# timeout: request or operation timeout, retry soon
+# worker: task failed or cancelled in the worker, retry soon
+# fatal: errors which are unlikely to recover by retrying soon, like 4xx of relay and invalid tasks
+ErrorClass = Literal["transient", "rate_limited", "timeout", "worker", "fatal"]
+
+
+def classify_error(exc: BaseException) -> ErrorClass:
+    if isinstance(exc, RelayError):
+        if exc.status_code == 429:
+            return "rate_limited"
+        if exc.status_code == 408:
+            return "timeout"
+        if 400 <= exc.status_code < 500:
+            return "fatal"
+        return "transient"
+    if isinstance(exc, (httpx.TimeoutException, TimeoutError)):
+        return "timeout"
+    if isinstance(exc, (httpx.TransportError, ConnectionError)):
+        return "transient"
+    if isinstance(exc, TaskInvalid):
+        return "fatal"
+    if isinstance(exc, (TaskError, TaskCancelled)):
+        return "worker"
+    return "transient"
+
+
+class RetryStats(BaseModel):
+    retries: int = 0
+    total_wait: float = 0
+    last_wait: float = 0
+    last_error: str = ""
+    last_error_class: Optional[ErrorClass] = None
+
+
+# Exponential backoff with jitter, used as the wait, stop and before_sleep of tenacity
+# Fatal errors wait max_delay, and the wait is cut to the remaining time before deadline,
+# but never shorter than base_delay. Retrying stops when the deadline has passed
+class RetryPolicy(object):
+    def __init__(
+        self,
+        base_delay: float = 1,
+        max_delay: float = 30,
+        multiplier: float = 2,
+        jitter: float = 0.5,
+        rate_limited_delay: float = 5,
+        deadline: Optional[Callable[[], Optional[float]]] = None,
+        stats: Optional[RetryStats] = None,
+    ) -> None:
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.rate_limited_delay = rate_limited_delay
+        self.deadline = deadline
+        if stats is None:
+            stats = RetryStats()
+        self.stats = stats
+
+    def get_delay(self, error_class: ErrorClass, attempt_number: int) -> float:
+        if error_class == "fatal":
+            delay = self.max_delay
+        else:
+            base_delay = self.base_delay
+            if error_class == "rate_limited":
+                base_delay = max(base_delay, self.rate_limited_delay)
+            delay = min(
+                base_delay * self.multiplier ** max(attempt_number - 1, 0),
+                self.max_delay,
+            )
+            # full jitter on part of the delay to spread retries of different tasks
+            delay = delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+        if self.deadline is not None:
+            deadline = self.deadline()
+            if deadline is not None:
+                delay = min(delay, max(deadline - time.time(), self.base_delay))
+        return delay
+
+    def deadline_passed(self) -> bool:
+        if self.deadline is None:
+            return False
+        deadline = self.deadline()
+        return deadline is not None and time.time() >= deadline
+
+    def stop(self, retry_state: RetryCallState) -> bool:
+        return self.deadline_passed()
+
+    def wait(self, retry_state: RetryCallState) -> float:
+        error_class: ErrorClass = "transient"
+        if retry_state.outcome is not None and retry_state.outcome.failed:
+            exc = retry_state.outcome.exception()
+            if exc is not None:
+                error_class = classify_error(exc)
+        return self.get_delay(error_class, retry_state.attempt_number)
+
+    def before_sleep(self, retry_state: RetryCallState):
+        wait = 0.0
+        if retry_state.next_action is not None:
+            wait = retry_state.next_action.sleep
+        self.stats.retries += 1
+        self.stats.total_wait += wait
+        self.stats.last_wait = wait
+        if retry_state.outcome is not None and retry_state.outcome.failed:
+            exc = retry_state.outcome.exception()
+            if exc is not None:
+                self.stats.last_error = str(exc)
+                self.stats.last_error_class = classify_error(exc)
+        _logger.debug(
+            f"retry {retry_state.fn} in {wait:.2f}s after attempt {retry_state.attempt_number}, "
+            f"error: {self.stats.last_error_class} {self.stats.last_error}"
+        )
@@ -19,7 +19,8 @@ from crynux_server import db, log, utils
 from crynux_server.config import get_config, with_proxy
 from crynux_server.node_manager import NodeManager, set_node_manager
 from crynux_server.server import Server, set_server
-from crynux_server.worker_manager import WorkerManager, set_worker_manager
+from crynux_server.worker_manager import (DbTaskQueueStore, WorkerManager,
+                                          set_worker_manager)
 
 _logger = logging.getLogger(__name__)
 
@@ -72,7 +73,9 @@ class CrynuxRunner(object):
             await db.init(self.config.db)
             _logger.info("DB init completed.")
 
-            worker_manager = WorkerManager(self.config)
+            worker_manager = WorkerManager(
+                self.config, queue_store=DbTaskQueueStore()
+            )
             set_worker_manager(worker_manager)
 
             _logger.info(f"Serving WebUI from: {os.path.abspath(self.config.web_dist)}")
@@ -40,6 +40,7 @@ class Server(object):
         host: str,
         port: int,
         access_log: bool = True,
+        websocket_ping_interval: Optional[float] = 20,
         *,
         task_status: TaskStatus[None] = TASK_STATUS_IGNORED,
     ):
@@ -51,6 +52,9 @@ class Server(object):
         if access_log:
             config.accesslog = "-"
         config.errorlog = "-"
+        # keep worker connections alive by ping frames
+        # permessage-deflate is enabled by hypercorn when the worker offers it
+        config.websocket_ping_interval = websocket_ping_interval
 
         try:
             async with create_task_group() as tg:
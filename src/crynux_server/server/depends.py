@@ -11,7 +11,8 @@ from crynux_server.node_manager import (
     get_manager_state_cache,
     get_node_state_manager,
 )
-from crynux_server.task import InferenceTaskStateCache, get_inference_task_state_cache
+from crynux_server.task import (InferenceTaskStateCache, TaskSystem,
+                                get_inference_task_state_cache, get_task_system)
 from crynux_server.worker_manager import WorkerManager, get_worker_manager
 
 from .system import get_system_info, SystemInfo
@@ -22,6 +23,7 @@ __all__ = [
     "NodeStateManagerDep",
     "TaskStateCacheDep",
     "WorkerManagerDep",
+    "TaskSystemDep",
     "SystemInfoDep",
 ]
 
@@ -52,6 +54,15 @@ async def _get_task_state_cache():
         raise
 
 
+async def _get_task_system():
+    try:
+        return get_task_system()
+    except AssertionError as e:
+        if "TaskSystem has not been set" in str(e):
+            return None
+        raise
+
+
 async def _get_worker_manager():
     return get_worker_manager()
 
@@ -72,6 +83,7 @@ NodeStateManagerDep = Annotated[
 TaskStateCacheDep = Annotated[
     Optional[InferenceTaskStateCache], Depends(_get_task_state_cache)
 ]
+TaskSystemDep = Annotated[Optional[TaskSystem], Depends(_get_task_system)]
 WorkerManagerDep = Annotated[WorkerManager, Depends(_get_worker_manager)]
 SystemInfoDep = Annotated[SystemInfo, Depends(_get_system_info)]
 AccountInfoDep = Annotated[AccountInfo, Depends(_get_account_info)]
@@ -1,13 +1,17 @@
 import time
-from datetime import datetime
-from typing import Literal
+from datetime import datetime, timedelta
+from typing import Dict, List, Literal, Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
 
 from crynux_server.models import NodeStatus, InferenceTaskStatus
+from crynux_server.task import (SpanStats, TaskSystemMetrics, TaskTimeline,
+                                get_span_stats, make_task_timeline)
+from crynux_server.worker_manager import TaskProgressInfo
 
-from ..depends import ManagerStateCacheDep, TaskStateCacheDep
+from ..depends import (ManagerStateCacheDep, TaskStateCacheDep, TaskSystemDep,
+                       WorkerManagerDep)
 
 router = APIRouter(prefix="/tasks")
 
@@ -69,3 +73,60 @@ async def get_task_stats(
         num_total = len(total_states)
 
     return TaskStats(status=status, num_today=num_today, num_total=num_total)
+
+
+@router.get("/metrics", response_model=Optional[TaskSystemMetrics])
+async def get_task_metrics(*, task_system: TaskSystemDep):
+    if task_system is None:
+        return None
+    return task_system.metrics()
+
+
+@router.get("/timeline/stats", response_model=Dict[str, SpanStats])
+async def get_task_timeline_stats(
+    *,
+    hours: Optional[float] = Query(default=None, gt=0),
+    task_state_cache: TaskStateCacheDep,
+):
+    if task_state_cache is None:
+        return {}
+    start = None
+    if hours is not None:
+        start = datetime.now() - timedelta(hours=hours)
+    states = await task_state_cache.find(start=start)
+    return get_span_stats(states)
+
+
+# Progress of tasks running on workers
+@router.get("/progress", response_model=List[TaskProgressInfo])
+async def get_tasks_progress(*, worker_manager: WorkerManagerDep):
+    return worker_manager.task_progress()
+
+
+@router.get("/{task_id_commitment}/progress", response_model=TaskProgressInfo)
+async def get_task_progress(*, task_id_commitment: str, worker_manager: WorkerManagerDep):
+    task_id = task_id_commitment.removeprefix("0x")
+    # task ids sent to workers may or may not have the 0x prefix
+    progress = worker_manager.get_task_progress(
+        "0x" + task_id
+    ) or worker_manager.get_task_progress(task_id)
+    if progress is None:
+        raise HTTPException(404, detail="Task is not running.")
+    return progress
+
+
+@router.get("/{task_id_commitment}/timeline", response_model=TaskTimeline)
+async def get_task_timeline(
+    *, task_id_commitment: str, task_state_cache: TaskStateCacheDep
+):
+    if task_state_cache is None:
+        raise HTTPException(400, detail="Task system has not been started.")
+    try:
+        task_id = bytes.fromhex(task_id_commitment.removeprefix("0x"))
+    except ValueError:
+        raise HTTPException(400, detail="Invalid task id commitment.")
+    try:
+        state = await task_state_cache.load(task_id)
+    except KeyError:
+        raise HTTPException(404, detail="Task not found.")
+    return make_task_timeline(state)
@@ -1,12 +1,18 @@
 import logging
+from typing import List, Optional
 
-from anyio import create_task_group, fail_after
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from anyio import Lock, create_task_group, sleep
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
 
-from crynux_server.models import TaskResult
-from crynux_server.worker_manager import (TaskDownloadError,
+from crynux_server.models import (LoadedModels, ModelConfig, TaskCancel,
+                                  TaskProgress, TaskResult)
+from crynux_server.worker_manager import (LatencyStats, TaskDownloadError,
                                           TaskExecutionError, TaskInvalid,
-                                          WorkerManager, is_task_invalid)
+                                          TaskQueueStats, WorkerDisconnected,
+                                          WorkerManager, WorkerSlotInfo,
+                                          is_task_invalid)
+from crynux_server.worker_manager.protocol import (Message, get_codec,
+                                                   negotiate_protocol)
 
 from ..depends import WorkerManagerDep
 
@@ -15,36 +21,93 @@ _logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/worker")
 
 
+# Send and receive messages in the protocol negotiated with the worker, see worker_manager.protocol
+class WorkerConnection(object):
+    def __init__(self, websocket: WebSocket, protocol: Optional[str] = None) -> None:
+        self.websocket = websocket
+        self.protocol = protocol
+        self.codec = get_codec(protocol)
+        # frames are sent by both the task producer and the keepalive of legacy workers
+        self._send_lock = Lock()
+
+    @property
+    def legacy(self) -> bool:
+        return self.protocol is None
+
+    async def send(self, msg: Message):
+        data = self.codec.encode(msg)
+        async with self._send_lock:
+            if isinstance(data, bytes):
+                await self.websocket.send_bytes(data)
+            else:
+                await self.websocket.send_text(data)
+
+    async def send_keepalive(self):
+        async with self._send_lock:
+            await self.websocket.send_text("")
+
+    async def receive(self) -> Message:
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        data = message.get("bytes", None)
+        if data is None:
+            data = message["text"]
+        return self.codec.decode(data)
+
+
+# Wait until a task is routed to the worker, so an idle connection costs nothing
 async def task_producer(
-    worker_id: int, websocket: WebSocket, worker_manager: WorkerManager
+    worker_id: int, conn: WorkerConnection, worker_manager: WorkerManager
 ):
     while True:
-        try:
-            with fail_after(1):
-                task_input, _ = await worker_manager.get_task(worker_id)
-                await websocket.send_json(task_input.model_dump())
-        except TimeoutError:
-            try:
-                await websocket.send_text("")
-                continue
-            except WebSocketDisconnect:
-                raise
+        task_input, task_future = await worker_manager.get_task(worker_id)
+        await conn.send(task_input.model_dump(mode="json"))
+        worker_manager.task_dispatched(task_future)
+
+
+# Ask the worker to stop its cancelled tasks, legacy workers don't get cancel messages
+async def cancel_producer(
+    worker_id: int, conn: WorkerConnection, worker_manager: WorkerManager
+):
+    async for task_id_commitment in worker_manager.cancel_requests(worker_id):
+        msg = TaskCancel(type="cancel", task_id_commitment=task_id_commitment)
+        await conn.send(msg.model_dump())
+
+
+# Legacy workers need keepalive frames, others are kept alive by ping frames
+async def legacy_keepalive(conn: WorkerConnection, interval: float = 1):
+    while True:
+        await sleep(interval)
+        await conn.send_keepalive()
 
 
 async def result_consumer(
-    worker_id: int, websocket: WebSocket, worker_manager: WorkerManager
+    worker_id: int, conn: WorkerConnection, worker_manager: WorkerManager
 ):
     while True:
-        raw_result = await websocket.receive_json()
+        raw_result = await conn.receive()
+        if raw_result.get("type", None) == "loaded_models":
+            loaded_models = LoadedModels.model_validate(raw_result)
+            await worker_manager.update_loaded_models(worker_id, loaded_models.models)
+            continue
+        if raw_result.get("type", None) == "progress":
+            progress = TaskProgress.model_validate(raw_result)
+            worker_manager.update_progress(worker_id, progress)
+            continue
         result = TaskResult.model_validate(raw_result)
+        if worker_manager.finish_cancelled(worker_id, result.task_id_commitment):
+            continue
         with worker_manager.task_future(worker_id, result.task_id_commitment) as fut:
+            if fut is None:
+                continue
             if fut.cancelled():
                 _logger.info(f"Task {result.task_id_commitment} has been cancelled before")
             elif fut.done():
                 _logger.info(f"Task {result.task_id_commitment} has been done before")
             else:
                 if result.result.status == "success":
-                    fut.set_result(None)
+                    fut.set_result(result.result.files)
                 elif result.result.status == "error":
                     err_msg = result.result.traceback
                     if result.task_name == "inference":
@@ -58,18 +121,83 @@ async def result_consumer(
                         fut.set_error(exc)
 
 
+@router.get("/slots", response_model=List[WorkerSlotInfo])
+async def get_worker_slots(*, worker_manager: WorkerManagerDep):
+    return worker_manager.workers()
+
+
+# Restart the worker process of the slot, also used to restart a worker in a crash loop
+@router.post("/slots/{slot}/restart", response_model=WorkerSlotInfo)
+async def restart_worker_slot(slot: int, *, worker_manager: WorkerManagerDep):
+    if slot not in [info.slot for info in worker_manager.workers()]:
+        raise HTTPException(404, f"No such worker slot {slot}")
+    try:
+        worker_manager.restart_worker(slot)
+    except RuntimeError as e:
+        raise HTTPException(500, str(e))
+    for info in worker_manager.workers():
+        if info.slot == slot:
+            return info
+
+
+@router.get("/dispatch/stats", response_model=Optional[LatencyStats])
+async def get_dispatch_stats(*, worker_manager: WorkerManagerDep):
+    return worker_manager.dispatch_stats()
+
+
+# Length and ages of queued and dispatched tasks, including tasks recovered after restarts
+@router.get("/queue/stats", response_model=TaskQueueStats)
+async def get_queue_stats(*, worker_manager: WorkerManagerDep):
+    return worker_manager.queue_stats()
+
+
+# Time from cancelling a running task to the worker being free
+@router.get("/cancel/stats", response_model=Optional[LatencyStats])
+async def get_cancel_stats(*, worker_manager: WorkerManagerDep):
+    return worker_manager.cancel_stats()
+
+
+# Workers of the worker pool connect with their slot index, see WorkerManager
 @router.websocket("/")
-async def worker(websocket: WebSocket, worker_manager: WorkerManagerDep):
+async def worker(
+    websocket: WebSocket, worker_manager: WorkerManagerDep, slot: int = 0
+):
     await websocket.accept()
     version_msg = await websocket.receive_json()
     version = version_msg["version"]
-    worker_id = await worker_manager.connect(version)
-    await websocket.send_json({"worker_id": worker_id})
-    _logger.info(f"worker {worker_id} connects")
+    # workers may report their loaded models when connecting
+    loaded_models = None
+    if "models" in version_msg:
+        loaded_models = [
+            ModelConfig.model_validate(model) for model in version_msg["models"]
+        ]
+    protocol = negotiate_protocol(version_msg.get("protocols", None))
+    # workers negotiating the protocol stop tasks on cancel messages
+    worker_id = await worker_manager.connect(
+        version,
+        slot=slot,
+        loaded_models=loaded_models,
+        cancellable=protocol is not None,
+    )
+    if protocol is None:
+        await websocket.send_json({"worker_id": worker_id})
+    else:
+        await websocket.send_json({"worker_id": worker_id, "protocol": protocol})
+    conn = WorkerConnection(websocket, protocol)
+    _logger.info(
+        f"worker {worker_id} of slot {slot} connects, protocol {protocol or 'legacy'}"
+    )
     try:
         async with create_task_group() as tg:
-            tg.start_soon(task_producer, worker_id, websocket, worker_manager)
-            tg.start_soon(result_consumer, worker_id, websocket, worker_manager)
+            tg.start_soon(task_producer, worker_id, conn, worker_manager)
+            tg.start_soon(result_consumer, worker_id, conn, worker_manager)
+            if conn.legacy:
+                tg.start_soon(legacy_keepalive, conn)
+            else:
+                tg.start_soon(cancel_producer, worker_id, conn, worker_manager)
+    except WorkerDisconnected:
+        _logger.info(f"worker {worker_id} is replaced by a new connection of slot {slot}")
+        await websocket.close()
     except WebSocketDisconnect:
         _logger.error(f"worker {worker_id} disconnects")
         pass
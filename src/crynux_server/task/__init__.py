@@ -7,10 +7,35 @@ from .state_cache import (DbDownloadTaskStateCache, DbInferenceTaskStateCache,
                           set_download_task_state_cache,
                           set_inference_task_state_cache)
 from .task_runner import InferenceTaskRunner, MockInferenceTaskRunner, InferenceTaskRunnerBase
-from .task_system import TaskSystem, get_task_system, set_task_system
+from .checkpoint_cache import (CheckpointCache, CheckpointCacheStats,
+                               get_checkpoint_cache, make_checkpoint_cache,
+                               set_checkpoint_cache)
+from .hashing import (HashEngine, HashStats, get_hash_engine,
+                      make_hash_engine, set_hash_engine)
+from .stages import StageScheduler
+from .timeline import (SpanStats, TaskTimeline, get_span_stats,
+                       make_task_timeline)
+from .task_system import (TaskSystem, TaskSystemMetrics, get_task_system,
+                          set_task_system)
 
 __all__ = [
     "TaskSystem",
+    "TaskSystemMetrics",
+    "StageScheduler",
+    "TaskTimeline",
+    "SpanStats",
+    "make_task_timeline",
+    "get_span_stats",
+    "CheckpointCache",
+    "CheckpointCacheStats",
+    "get_checkpoint_cache",
+    "set_checkpoint_cache",
+    "make_checkpoint_cache",
+    "HashEngine",
+    "HashStats",
+    "get_hash_engine",
+    "set_hash_engine",
+    "make_hash_engine",
     "get_task_system",
     "set_task_system",
     "InferenceTaskStateCache",
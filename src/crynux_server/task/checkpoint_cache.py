@@ -0,0 +1,242 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import stat
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from anyio import Lock, to_thread
+from pydantic import BaseModel
+
+from crynux_server.config import CheckpointCacheConfig
+
+from .gc import remove_dir
+
+_logger = logging.getLogger(__name__)
+
+
+# Download the checkpoint archive to the given file
+CheckpointDownloader = Callable[[str], Awaitable[None]]
+
+_checkpoint_hash_pattern = re.compile(r"[0-9a-fA-F]{16,128}")
+
+
+class CheckpointCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size: int = 0
+
+
+def hash_archive(filename: str) -> str:
+    h = hashlib.sha256()
+    with open(filename, mode="rb") as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _unpack_archive(checkpoint_file: str, dst_dir: str):
+    shutil.unpack_archive(checkpoint_file, dst_dir, "zip")
+    # cached files are shared with task dirs by hard links, make them read-only
+    # so that the cached checkpoint cannot be modified through a task dir
+    for root, _, files in os.walk(dst_dir):
+        for f in files:
+            os.chmod(os.path.join(root, f), stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+
+# Link files of the cached checkpoint into dst_dir, copy them when hard links are not supported
+def materialize(src_dir: str, dst_dir: str):
+    if os.path.exists(dst_dir):
+        remove_dir(dst_dir)
+    for root, _, files in os.walk(src_dir):
+        dst_root = os.path.join(dst_dir, os.path.relpath(root, src_dir))
+        os.makedirs(dst_root, exist_ok=True)
+        for f in files:
+            src = os.path.join(root, f)
+            dst = os.path.join(dst_root, f)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+
+
+def _dir_size(dirname: str) -> int:
+    size = 0
+    for root, _, files in os.walk(dirname):
+        for f in files:
+            try:
+                size += os.stat(os.path.join(root, f)).st_size
+            except FileNotFoundError:
+                continue
+    return size
+
+
+# Return (hash, size, last used time) of cached checkpoints, the least recently used first
+def _scan_entries(objects_dir: str) -> List[Tuple[str, int, float]]:
+    entries = []
+    for name in os.listdir(objects_dir):
+        path = os.path.join(objects_dir, name)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            continue
+        entries.append((name, _dir_size(path), mtime))
+    entries.sort(key=lambda entry: entry[2])
+    return entries
+
+
+# Unpacked input checkpoints of SD_FT_LORA tasks, keyed by the hash of the checkpoint archive
+# The hash reported by the relay is used to skip downloading, otherwise the archive is hashed
+# after downloading to skip unpacking. Least recently used checkpoints are evicted when
+# the cache is larger than max_size bytes
+class CheckpointCache(object):
+    def __init__(self, cache_dir: str, max_size: int = 10 * 1024 * 1024 * 1024) -> None:
+        self._cache_dir = cache_dir
+        self._objects_dir = os.path.join(cache_dir, "objects")
+        self._tmp_dir = os.path.join(cache_dir, "tmp")
+        self._max_size = max_size
+
+        self._locks: Dict[str, Lock] = {}
+        self._stats = CheckpointCacheStats()
+
+    @property
+    def stats(self) -> CheckpointCacheStats:
+        return self._stats.model_copy()
+
+    def _object_dir(self, checkpoint_hash: str) -> str:
+        return os.path.join(self._objects_dir, checkpoint_hash.lower())
+
+    def _lock(self, key: str) -> Lock:
+        if key not in self._locks:
+            self._locks[key] = Lock()
+        return self._locks[key]
+
+    def _touch(self, object_dir: str):
+        now = time.time()
+        os.utime(object_dir, (now, now))
+
+    async def _add(self, checkpoint_file: str, checkpoint_hash: str) -> str:
+        object_dir = self._object_dir(checkpoint_hash)
+        if os.path.exists(object_dir):
+            return object_dir
+
+        tmp_dir = os.path.join(self._tmp_dir, uuid.uuid4().hex)
+        try:
+            await to_thread.run_sync(_unpack_archive, checkpoint_file, tmp_dir)
+            os.replace(tmp_dir, object_dir)
+        finally:
+            if os.path.exists(tmp_dir):
+                await to_thread.run_sync(remove_dir, tmp_dir, True)
+        return object_dir
+
+    # Download the checkpoint archive and return its hash, which must match the hash
+    # reported by the relay so that a corrupted archive is never cached
+    async def _download(
+        self,
+        download: CheckpointDownloader,
+        checkpoint_file: str,
+        checkpoint_hash: Optional[str],
+    ) -> str:
+        await download(checkpoint_file)
+        archive_hash = await to_thread.run_sync(hash_archive, checkpoint_file)
+        if checkpoint_hash is not None and archive_hash != checkpoint_hash.lower():
+            raise ValueError(
+                f"Checkpoint hash mismatch, expected {checkpoint_hash}, got {archive_hash}"
+            )
+        return archive_hash
+
+    # Materialize the checkpoint into dst_dir, download it only when it is not cached
+    # Return whether the checkpoint is cached
+    async def get(
+        self,
+        dst_dir: str,
+        download: CheckpointDownloader,
+        checkpoint_hash: Optional[str] = None,
+    ) -> bool:
+        if checkpoint_hash is not None and not _checkpoint_hash_pattern.fullmatch(
+            checkpoint_hash
+        ):
+            _logger.warning(f"Ignore invalid checkpoint hash {checkpoint_hash}")
+            checkpoint_hash = None
+
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+        checkpoint_file = os.path.join(self._tmp_dir, uuid.uuid4().hex + ".zip")
+        try:
+            if checkpoint_hash is None:
+                # the archive is hashed after downloading, tasks downloading the same
+                # archive at the same time unpack it only once
+                checkpoint_hash = await self._download(download, checkpoint_file, None)
+                downloaded = True
+            else:
+                downloaded = False
+
+            # download the same checkpoint only once
+            async with self._lock(checkpoint_hash.lower()):
+                object_dir = self._object_dir(checkpoint_hash)
+                hit = os.path.exists(object_dir)
+                if not hit:
+                    if not downloaded:
+                        await self._download(download, checkpoint_file, checkpoint_hash)
+                    object_dir = await self._add(checkpoint_file, checkpoint_hash)
+                self._touch(object_dir)
+                await to_thread.run_sync(materialize, object_dir, dst_dir)
+        finally:
+            if os.path.exists(checkpoint_file):
+                os.remove(checkpoint_file)
+
+        if hit:
+            self._stats.hits += 1
+            _logger.debug(f"Checkpoint {checkpoint_hash} hits the cache")
+        else:
+            self._stats.misses += 1
+        await self.evict(keep=os.path.basename(object_dir))
+        return hit
+
+    # Remove the least recently used checkpoints until the cache is not larger than max_size
+    async def evict(self, keep: Optional[str] = None):
+        entries = await to_thread.run_sync(_scan_entries, self._objects_dir)
+        size = sum(entry[1] for entry in entries)
+        count = len(entries)
+        for name, entry_size, _ in entries:
+            if size <= self._max_size:
+                break
+            if name == keep or self._lock(name).locked():
+                continue
+            await to_thread.run_sync(
+                remove_dir, os.path.join(self._objects_dir, name), True
+            )
+            self._locks.pop(name, None)
+            size -= entry_size
+            count -= 1
+            self._stats.evictions += 1
+            _logger.debug(f"Evict checkpoint {name} from the cache")
+        self._stats.size = size
+        self._stats.entries = count
+
+
+_default_checkpoint_cache: Optional[CheckpointCache] = None
+
+
+def get_checkpoint_cache() -> Optional[CheckpointCache]:
+    return _default_checkpoint_cache
+
+
+def set_checkpoint_cache(cache: Optional[CheckpointCache]):
+    global _default_checkpoint_cache
+
+    _default_checkpoint_cache = cache
+
+
+def make_checkpoint_cache(
+    cache_dir: str, config: Optional[CheckpointCacheConfig] = None
+) -> CheckpointCache:
+    if config is None:
+        config = CheckpointCacheConfig()
+    return CheckpointCache(cache_dir=cache_dir, max_size=config.max_size)
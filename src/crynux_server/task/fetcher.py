@@ -0,0 +1,80 @@
+import logging
+from typing import Dict, Optional, Set
+
+from anyio import Event, sleep
+
+from crynux_server.models import RelayTask
+from crynux_server.relay.abc import Relay
+from crynux_server.relay.exceptions import RelayError
+
+_logger = logging.getLogger(__name__)
+
+
+class _TaskBatch(object):
+    def __init__(self) -> None:
+        self.task_id_commitments: Set[bytes] = set()
+        self.tasks: Dict[bytes, RelayTask] = {}
+        self.error: Optional[Exception] = None
+        # the request fetching the batch is cancelled, others fetch their tasks in a new batch
+        self.cancelled = False
+        self.done = Event()
+
+
+# Coalesce the get_task requests of all inference runners
+# The first request of a batch waits batch_window seconds for other requests,
+# then fetches all the tasks in the batch by one relay call
+# When batch_window is 0, the batch is fetched at once, with the requests made at the same time,
+# and requests made while fetching go to the next batch
+class RelayTaskFetcher(object):
+    def __init__(
+        self, relay: Relay, batch_window: float = 0, max_batch_size: int = 50
+    ) -> None:
+        self._relay = relay
+        self._batch_window = batch_window
+        self._max_batch_size = max_batch_size
+
+        self._batch: Optional[_TaskBatch] = None
+
+    async def _fetch_batch(self, batch: _TaskBatch):
+        fetched = False
+        try:
+            await sleep(self._batch_window)
+            # requests from now on go to the next batch
+            if self._batch is batch:
+                self._batch = None
+            tasks = await self._relay.get_tasks(list(batch.task_id_commitments))
+            _logger.debug(f"fetched {len(tasks)} tasks in batch from relay")
+            for task in tasks:
+                batch.tasks[task.task_id_commitment] = task
+            fetched = True
+        except Exception as e:
+            batch.error = e
+            raise
+        finally:
+            if self._batch is batch:
+                self._batch = None
+            if not fetched and batch.error is None:
+                batch.cancelled = True
+            batch.done.set()
+
+    async def get_task(self, task_id_commitment: bytes) -> RelayTask:
+        task_id_commitment = bytes(task_id_commitment)
+
+        while True:
+            batch = self._batch
+            if batch is None or len(batch.task_id_commitments) >= self._max_batch_size:
+                batch = _TaskBatch()
+                batch.task_id_commitments.add(task_id_commitment)
+                self._batch = batch
+                await self._fetch_batch(batch)
+            else:
+                batch.task_id_commitments.add(task_id_commitment)
+                await batch.done.wait()
+            if not batch.cancelled:
+                break
+
+        if batch.error is not None:
+            raise batch.error
+        if task_id_commitment not in batch.tasks:
+            raise RelayError(404, "getTask", "task not found")
+        return batch.tasks[task_id_commitment]
@@ -0,0 +1,206 @@
+import logging
+import os
+import shutil
+import stat
+import time
+from typing import Callable, List, Optional
+
+from anyio import sleep, to_thread
+from pydantic import BaseModel
+
+from crynux_server.config import ResultGCConfig
+from crynux_server.models import InferenceTaskStatus
+
+from .state_cache import InferenceTaskStateCache
+
+_logger = logging.getLogger(__name__)
+
+
+# Runners stop at these status, see InferenceTaskRunnerBase.should_stop
+terminal_status = [
+    InferenceTaskStatus.EndAborted,
+    InferenceTaskStatus.EndGroupRefund,
+    InferenceTaskStatus.EndGroupSuccess,
+    InferenceTaskStatus.EndInvalidated,
+    InferenceTaskStatus.EndSuccess,
+    InferenceTaskStatus.ErrorReported,
+]
+
+# Entries modified recently may still be written, like the results of the initial inference task
+_min_evict_age = 60
+
+
+class ResultEntry(BaseModel):
+    path: str
+    name: str
+    size: int
+    # latest modification time of the entry and the files in it
+    mtime: float
+
+
+class ResultGCStats(BaseModel):
+    runs: int = 0
+    removed: int = 0
+    freed_bytes: int = 0
+    # size of the output dir after the last run
+    total_bytes: int = 0
+    last_run_time: float = 0
+
+
+def _scan_entry(path: str) -> ResultEntry:
+    st = os.stat(path, follow_symlinks=False)
+    mtime = st.st_mtime
+    # only count the size of files
+    size = 0
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, _, files in os.walk(path):
+            for f in files:
+                try:
+                    st = os.stat(os.path.join(root, f), follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                size += st.st_size
+                mtime = max(mtime, st.st_mtime)
+    else:
+        size = st.st_size
+    return ResultEntry(path=path, name=os.path.basename(path), size=size, mtime=mtime)
+
+
+def scan_output_dir(output_dir: str) -> List[ResultEntry]:
+    if not os.path.isdir(output_dir):
+        return []
+    entries = []
+    for name in os.listdir(output_dir):
+        try:
+            entries.append(_scan_entry(os.path.join(output_dir, name)))
+        except FileNotFoundError:
+            continue
+    return entries
+
+
+# Files linked from the checkpoint cache are read-only, which can't be removed on Windows,
+# so the read-only bit of the failed path and its parent dir is cleared before trying again
+def remove_dir(path: str, ignore_errors: bool = False):
+    def onerror(func, failed_path, exc_info):
+        try:
+            for p in (failed_path, os.path.dirname(failed_path)):
+                if os.path.lexists(p):
+                    os.chmod(p, os.stat(p).st_mode | stat.S_IWRITE)
+            func(failed_path)
+        except Exception:
+            if not ignore_errors:
+                raise
+
+    shutil.rmtree(path, onerror=onerror)
+
+
+def remove_entry(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        remove_dir(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+# Result dir of each inference task is named by the hex of its task id commitment
+def parse_task_id_commitment(name: str) -> Optional[bytes]:
+    try:
+        res = bytes.fromhex(name.removeprefix("0x"))
+    except ValueError:
+        return None
+    if len(res) != 32:
+        return None
+    return res
+
+
+# Reconcile the output dir against the inference task states
+# Results of running tasks are kept, results of finished tasks and unknown files are removed
+# after retention, and the oldest of them are removed first when the output dir exceeds max_size
+# Results of unfinished tasks without runners are orphans, they are removed after the task timeout
+# and retention
+class ResultGC(object):
+    def __init__(
+        self,
+        output_dir: str,
+        state_cache: InferenceTaskStateCache,
+        is_running: Callable[[bytes], bool],
+        config: Optional[ResultGCConfig] = None,
+    ) -> None:
+        if config is None:
+            config = ResultGCConfig()
+        self._output_dir = output_dir
+        self._state_cache = state_cache
+        self._is_running = is_running
+        self._interval = config.interval
+        self._retention = config.retention
+        self._max_size = config.max_size
+
+        self._stats = ResultGCStats()
+
+    @property
+    def stats(self) -> ResultGCStats:
+        return self._stats.model_copy()
+
+    async def _is_removable(self, entry: ResultEntry, now: float) -> bool:
+        task_id_commitment = parse_task_id_commitment(entry.name)
+        if task_id_commitment is None:
+            return True
+        if self._is_running(task_id_commitment):
+            return False
+        if await self._state_cache.has(task_id_commitment):
+            state = await self._state_cache.load(task_id_commitment)
+            if state.status in terminal_status:
+                return True
+            # the task cannot be running after its timeout
+            return now - entry.mtime >= state.timeout + self._retention
+        return True
+
+    # Run once, return the freed bytes
+    async def collect(self) -> int:
+        now = time.time()
+        entries = await to_thread.run_sync(scan_output_dir, self._output_dir)
+        total_size = sum(entry.size for entry in entries)
+
+        candidates: List[ResultEntry] = []
+        for entry in entries:
+            if await self._is_removable(entry, now):
+                candidates.append(entry)
+        candidates.sort(key=lambda entry: entry.mtime)
+
+        removed: List[ResultEntry] = []
+        size = total_size
+        for entry in candidates:
+            age = now - entry.mtime
+            if age >= self._retention or (
+                size > self._max_size and age >= _min_evict_age
+            ):
+                removed.append(entry)
+                size -= entry.size
+
+        for entry in removed:
+            await to_thread.run_sync(remove_entry, entry.path)
+            _logger.debug(f"Remove task result {entry.path}, size {entry.size}")
+
+        freed = total_size - size
+        if size > self._max_size:
+            _logger.warning(
+                f"Task results size {size} exceeds the quota {self._max_size} "
+                "after removing all finished results"
+            )
+
+        self._stats.runs += 1
+        self._stats.removed += len(removed)
+        self._stats.freed_bytes += freed
+        self._stats.total_bytes = size
+        self._stats.last_run_time = now
+        if len(removed) > 0:
+            _logger.info(f"Remove {len(removed)} task results, free {freed} bytes")
+        return freed
+
+    async def run(self):
+        while True:
+            try:
+                await self.collect()
+            except Exception as e:
+                _logger.exception(e)
+                _logger.error("Failed to remove task results")
+            await sleep(self._interval)
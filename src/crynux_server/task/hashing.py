@@ -0,0 +1,334 @@
+import hashlib
+import logging
+import math
+import os
+import random
+import re
+import time
+from typing import Dict, List, Literal, Optional, Set, Tuple
+
+import imhash
+from anyio import (CapacityLimiter, create_task_group, sleep, to_process,
+                   to_thread)
+from pydantic import BaseModel
+
+from crynux_server.config import HashConfig
+from crynux_server.models import TaskType, WorkerResultFile
+
+_logger = logging.getLogger(__name__)
+
+
+HashMode = Literal["thread", "process"]
+
+
+def get_image_hash(filename: str) -> bytes:
+    return bytes.fromhex(imhash.getPHash(filename)[2:])  # type: ignore
+
+
+def get_gpt_resp_hash(filename: str) -> bytes:
+    with open(filename, mode="rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def _timed_hash(task_type: TaskType, filename: str):
+    start = time.perf_counter()
+    if task_type == TaskType.LLM:
+        res = get_gpt_resp_hash(filename)
+    else:
+        res = get_image_hash(filename)
+    return res, time.perf_counter() - start
+
+
+class HashStats(BaseModel):
+    mode: HashMode
+    max_workers: int
+    num_batches: int = 0
+    num_files: int = 0
+    # wall time of hashing all batches
+    total_time: float = 0
+    # sum of the time of hashing each file
+    total_file_time: float = 0
+    last_batch_time: float = 0
+    max_file_time: float = 0
+    # result files hashed by workers, and the files hashed again to verify them
+    num_worker_files: int = 0
+    num_verified_files: int = 0
+    # tasks whose worker hashes are different from the node's
+    num_worker_mismatches: int = 0
+
+
+# Hash the result files of inference tasks in worker threads or processes,
+# so that the event loop is not blocked when hashing
+class HashEngine(object):
+    def __init__(
+        self,
+        mode: HashMode = "thread",
+        max_workers: int = 4,
+        verify_worker_hashes: float = 0.25,
+    ) -> None:
+        assert max_workers > 0, "max_workers must be positive"
+        self._mode = mode
+        self._max_workers = max_workers
+        self.verify_worker_hashes = verify_worker_hashes
+        self._limiter: Optional[CapacityLimiter] = None
+        self._stats = HashStats(mode=mode, max_workers=max_workers)
+
+    @property
+    def stats(self) -> HashStats:
+        return self._stats.model_copy()
+
+    @property
+    def limiter(self) -> CapacityLimiter:
+        # CapacityLimiter can only be created in the event loop
+        if self._limiter is None:
+            self._limiter = CapacityLimiter(self._max_workers)
+        return self._limiter
+
+    async def _hash_file(self, task_type: TaskType, filename: str):
+        if self._mode == "process":
+            return await to_process.run_sync(
+                _timed_hash, task_type, filename, limiter=self.limiter
+            )
+        else:
+            return await to_thread.run_sync(
+                _timed_hash, task_type, filename, limiter=self.limiter
+            )
+
+    async def hash_file(self, task_type: TaskType, filename: str) -> bytes:
+        res, file_time = await self._hash_file(task_type, filename)
+        self._stats.num_files += 1
+        self._stats.total_file_time += file_time
+        self._stats.max_file_time = max(self._stats.max_file_time, file_time)
+        return res
+
+    # Return hashes in the same order as files
+    async def hash_files(self, task_type: TaskType, files: List[str]) -> List[bytes]:
+        hashes: List[bytes] = [b""] * len(files)
+        file_times: List[float] = [0] * len(files)
+
+        async def _hash(i: int):
+            hashes[i], file_times[i] = await self._hash_file(task_type, files[i])
+
+        start = time.perf_counter()
+        async with create_task_group() as tg:
+            for i in range(len(files)):
+                tg.start_soon(_hash, i)
+        batch_time = time.perf_counter() - start
+
+        self._stats.num_batches += 1
+        self._stats.num_files += len(files)
+        self._stats.total_time += batch_time
+        self._stats.total_file_time += sum(file_times)
+        self._stats.last_batch_time = batch_time
+        if len(file_times) > 0:
+            self._stats.max_file_time = max(self._stats.max_file_time, max(file_times))
+        _logger.debug(
+            f"hash {len(files)} files in {batch_time:.3f}s, "
+            f"serial time {sum(file_times):.3f}s"
+        )
+        return hashes
+
+    def record_worker_hashes(self, num_files: int, num_verified: int, matched: bool):
+        self._stats.num_worker_files += num_files
+        self._stats.num_verified_files += num_verified
+        if not matched:
+            self._stats.num_worker_mismatches += 1
+
+
+# Hash strings of workers may start with 0x like imhash.getPHash
+def parse_worker_hash(hash: str) -> bytes:
+    if hash.startswith("0x"):
+        hash = hash[2:]
+    return bytes.fromhex(hash)
+
+
+# Result file dir and result file name pattern of each task type
+def get_result_file_pattern(task_type: TaskType, task_dir: str) -> Tuple[str, str]:
+    if task_type == TaskType.LLM:
+        return task_dir, r"[0-9]+\.json"
+    elif task_type == TaskType.SD_FT_LORA:
+        return os.path.join(task_dir, "validation"), r"[0-9]+\.png"
+    else:
+        return task_dir, r"[0-9]+\.png"
+
+
+FileStat = Tuple[int, int]
+
+
+def _stat_file(filename: str) -> Optional[FileStat]:
+    try:
+        st = os.stat(filename)
+        return st.st_size, st.st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _list_result_files(dirname: str, pattern: str) -> Dict[str, Optional[FileStat]]:
+    if not os.path.isdir(dirname):
+        return {}
+    return {
+        os.path.join(dirname, f): _stat_file(os.path.join(dirname, f))
+        for f in os.listdir(dirname)
+        if re.match(pattern, f)
+    }
+
+
+# Hash result files while the worker is still producing them
+# A file is hashed when its size and mtime are unchanged between two polls,
+# and the hash is only used when the file is still unchanged after the task is finished
+class IncrementalHasher(object):
+    def __init__(
+        self,
+        engine: HashEngine,
+        task_type: TaskType,
+        task_dir: str,
+        poll_interval: float = 0.5,
+    ) -> None:
+        self._engine = engine
+        self._task_type = task_type
+        self._dirname, self._pattern = get_result_file_pattern(task_type, task_dir)
+        self._poll_interval = poll_interval
+
+        self._task_dir = task_dir
+        self._last_stats: Dict[str, FileStat] = {}
+        self._hashes: Dict[str, Tuple[FileStat, bytes]] = {}
+        self._hashing: Set[str] = set()
+        # result files hashed by the worker, set when the task is finished
+        self.worker_files: Optional[List[WorkerResultFile]] = None
+
+    @property
+    def hashed_files(self) -> List[str]:
+        return list(self._hashes.keys())
+
+    async def _hash(self, filename: str, stat: FileStat):
+        try:
+            res = await self._engine.hash_file(self._task_type, filename)
+            self._hashes[filename] = (stat, res)
+        except Exception as e:
+            # The file will be hashed again when the task is finished
+            _logger.debug(f"incremental hash of {filename} failed: {str(e)}")
+        finally:
+            self._hashing.discard(filename)
+
+    # Run until cancelled
+    async def watch(self):
+        async with create_task_group() as tg:
+            while True:
+                files = await to_thread.run_sync(
+                    _list_result_files, self._dirname, self._pattern
+                )
+                for filename, stat in files.items():
+                    if stat is None or stat[0] == 0:
+                        continue
+                    if filename in self._hashing:
+                        continue
+                    if filename in self._hashes and self._hashes[filename][0] == stat:
+                        continue
+                    if self._last_stats.get(filename) == stat:
+                        self._hashing.add(filename)
+                        tg.start_soon(self._hash, filename, stat)
+                    self._last_stats[filename] = stat
+                await sleep(self._poll_interval)
+
+    # Worker hashes of files in order,
+    # None if any file is not hashed by the worker or its size is changed
+    def _worker_hashes(
+        self, files: List[str], stats: List[Optional[FileStat]]
+    ) -> Optional[List[bytes]]:
+        if self.worker_files is None:
+            return None
+        worker_files = {
+            os.path.normpath(os.path.join(self._task_dir, f.path)): f
+            for f in self.worker_files
+        }
+        hashes = []
+        for filename, stat in zip(files, stats):
+            worker_file = worker_files.get(os.path.normpath(filename), None)
+            if worker_file is None or stat is None or stat[0] != worker_file.size:
+                return None
+            try:
+                hashes.append(parse_worker_hash(worker_file.hash))
+            except ValueError:
+                return None
+        return hashes
+
+    # Hash a sample of files to check the worker hashes
+    async def _verify_worker_hashes(
+        self, files: List[str], stats: List[Optional[FileStat]], worker_hashes: List[bytes]
+    ) -> bool:
+        rate = self._engine.verify_worker_hashes
+        num_samples = min(len(files), max(1, math.ceil(len(files) * rate)))
+        samples = random.sample(range(len(files)), num_samples)
+        rest = []
+        matched = True
+        for i in samples:
+            filename = files[i]
+            if filename in self._hashes and self._hashes[filename][0] == stats[i]:
+                matched = matched and self._hashes[filename][1] == worker_hashes[i]
+            else:
+                rest.append(i)
+        if matched and len(rest) > 0:
+            rest_hashes = await self._engine.hash_files(
+                self._task_type, [files[i] for i in rest]
+            )
+            matched = all(worker_hashes[i] == h for i, h in zip(rest, rest_hashes))
+        self._engine.record_worker_hashes(len(files), num_samples, matched)
+        return matched
+
+    # Return hashes of files in order
+    # Hashes of the worker are used when a sample of them are verified,
+    # otherwise files not hashed yet or changed after hashing are hashed now
+    async def finish(self, files: List[str]) -> List[bytes]:
+        stats = await to_thread.run_sync(lambda: [_stat_file(f) for f in files])
+        worker_hashes = self._worker_hashes(files, stats)
+        if worker_hashes is not None and len(files) > 0:
+            if await self._verify_worker_hashes(files, stats, worker_hashes):
+                return worker_hashes
+            _logger.warning(
+                f"Worker hashes of results in {self._task_dir} are different, hash all results"
+            )
+        hashes: List[Optional[bytes]] = [None] * len(files)
+        rest: List[int] = []
+        for i, (filename, stat) in enumerate(zip(files, stats)):
+            if filename in self._hashes and self._hashes[filename][0] == stat:
+                hashes[i] = self._hashes[filename][1]
+            else:
+                rest.append(i)
+        _logger.debug(
+            f"{len(files) - len(rest)} of {len(files)} files are hashed incrementally"
+        )
+        if len(rest) > 0:
+            rest_hashes = await self._engine.hash_files(
+                self._task_type, [files[i] for i in rest]
+            )
+            for i, h in zip(rest, rest_hashes):
+                hashes[i] = h
+        return [h for h in hashes if h is not None]
+
+
+_default_hash_engine: Optional[HashEngine] = None
+
+
+def get_hash_engine() -> HashEngine:
+    global _default_hash_engine
+
+    if _default_hash_engine is None:
+        _default_hash_engine = HashEngine()
+
+    return _default_hash_engine
+
+
+def set_hash_engine(engine: HashEngine):
+    global _default_hash_engine
+
+    _default_hash_engine = engine
+
+
+def make_hash_engine(config: Optional[HashConfig] = None) -> HashEngine:
+    if config is None:
+        config = HashConfig()
+    return HashEngine(
+        mode=config.mode,
+        max_workers=config.max_workers,
+        verify_worker_hashes=config.verify_worker_hashes,
+    )
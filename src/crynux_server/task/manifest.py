@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+from typing import List, Optional
+
+from pydantic import BaseModel, ValidationError
+
+from crynux_server.models import TaskType
+
+_logger = logging.getLogger(__name__)
+
+
+manifest_filename = "manifest.json"
+
+
+class ResultFile(BaseModel):
+    # path relative to the task dir
+    path: str
+    size: int
+    mtime_ns: int
+    # hex of the result hash, None if the file is not hashed yet
+    hash: Optional[str] = None
+
+
+# Result files of an inference task written after the worker finished
+# It is used to skip executing the task again when the node restarts before the task is submitted
+class ResultManifest(BaseModel):
+    task_id_commitment: str
+    task_type: TaskType
+    files: List[ResultFile]
+    checkpoint: Optional[str] = None
+    checkpoint_files: List[ResultFile] = []
+
+    @property
+    def hashed(self) -> bool:
+        return all(f.hash is not None for f in self.files)
+
+
+def _stat_result_file(task_dir: str, path: str, hash: Optional[bytes] = None) -> ResultFile:
+    st = os.stat(path)
+    return ResultFile(
+        path=os.path.relpath(path, task_dir),
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        hash=hash.hex() if hash is not None else None,
+    )
+
+
+def make_result_manifest(
+    task_id_commitment: bytes,
+    task_type: TaskType,
+    task_dir: str,
+    files: List[str],
+    checkpoint: Optional[str] = None,
+    hashes: Optional[List[bytes]] = None,
+) -> ResultManifest:
+    if hashes is not None:
+        assert len(hashes) == len(files), "The number of hashes and files are different"
+        result_files = [
+            _stat_result_file(task_dir, f, h) for f, h in zip(files, hashes)
+        ]
+    else:
+        result_files = [_stat_result_file(task_dir, f) for f in files]
+
+    checkpoint_files: List[ResultFile] = []
+    if checkpoint is not None:
+        for root, _, filenames in os.walk(checkpoint):
+            for filename in sorted(filenames):
+                checkpoint_files.append(
+                    _stat_result_file(task_dir, os.path.join(root, filename))
+                )
+        checkpoint = os.path.relpath(checkpoint, task_dir)
+
+    return ResultManifest(
+        task_id_commitment=bytes(task_id_commitment).hex(),
+        task_type=task_type,
+        files=result_files,
+        checkpoint=checkpoint,
+        checkpoint_files=checkpoint_files,
+    )
+
+
+# Write the manifest to a temp file and rename it, so that the manifest is never half written
+def write_result_manifest(task_dir: str, manifest: ResultManifest):
+    filename = os.path.join(task_dir, manifest_filename)
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, mode="w", encoding="utf-8") as f:
+        f.write(manifest.model_dump_json())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def remove_result_manifest(task_dir: str):
+    filename = os.path.join(task_dir, manifest_filename)
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def _check_result_file(task_dir: str, result_file: ResultFile) -> bool:
+    try:
+        st = os.stat(os.path.join(task_dir, result_file.path))
+    except FileNotFoundError:
+        return False
+    return st.st_size == result_file.size and st.st_mtime_ns == result_file.mtime_ns
+
+
+# Return the manifest if all result files in it are unchanged, otherwise return None
+def load_result_manifest(
+    task_dir: str, task_id_commitment: bytes
+) -> Optional[ResultManifest]:
+    filename = os.path.join(task_dir, manifest_filename)
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, mode="r", encoding="utf-8") as f:
+            manifest = ResultManifest.model_validate(json.load(f))
+    except (ValueError, ValidationError) as e:
+        _logger.warning(f"Invalid result manifest {filename}: {str(e)}")
+        return None
+
+    if manifest.task_id_commitment != bytes(task_id_commitment).hex():
+        return None
+    if len(manifest.files) == 0:
+        return None
+    for result_file in manifest.files + manifest.checkpoint_files:
+        if not _check_result_file(task_dir, result_file):
+            _logger.info(
+                f"Result file {result_file.path} of task {manifest.task_id_commitment} "
+                "is changed, ignore the result manifest"
+            )
+            return None
+    return manifest
+
+
+def get_manifest_files(task_dir: str, manifest: ResultManifest) -> List[str]:
+    return [os.path.join(task_dir, f.path) for f in manifest.files]
+
+
+def get_manifest_checkpoint(task_dir: str, manifest: ResultManifest) -> Optional[str]:
+    if manifest.checkpoint is None:
+        return None
+    return os.path.join(task_dir, manifest.checkpoint)
@@ -0,0 +1,112 @@
+import heapq
+import logging
+import math
+from contextlib import asynccontextmanager
+from typing import Dict, List, Literal, Optional, Tuple
+
+from anyio import Event
+from pydantic import BaseModel
+
+from crynux_server.config import StagesConfig
+from crynux_server.worker_manager import TaskPriority
+
+_logger = logging.getLogger(__name__)
+
+
+StageName = Literal["fetch_inputs", "execute", "hash", "submit", "upload"]
+
+stage_names: List[StageName] = ["fetch_inputs", "execute", "hash", "submit", "upload"]
+
+# tasks entering without a priority wait after all inference and download tasks
+_lowest_priority: TaskPriority = (2, math.inf, 0)
+
+
+class StageMetrics(BaseModel):
+    capacity: int
+    waiting: int
+    running: int
+
+
+# Bounded concurrency, waiting tasks enter by priority (see task_priority), then in FIFO order
+class Stage(object):
+    def __init__(self, name: str, capacity: int) -> None:
+        self.name = name
+        self._capacity = capacity
+        self._running = 0
+        self._waiters: List[Tuple[TaskPriority, int, Event]] = []
+        self._seq = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def metrics(self) -> StageMetrics:
+        return StageMetrics(
+            capacity=self.capacity, waiting=self.waiting, running=self.running
+        )
+
+    # The slot is handed over to the most urgent waiting task
+    def _release(self):
+        if len(self._waiters) > 0:
+            _, _, event = heapq.heappop(self._waiters)
+            event.set()
+        else:
+            self._running -= 1
+
+    async def _acquire(self, priority: TaskPriority):
+        if self._running < self._capacity and len(self._waiters) == 0:
+            self._running += 1
+            return
+        waiter = (priority, self._seq, Event())
+        self._seq += 1
+        heapq.heappush(self._waiters, waiter)
+        try:
+            await waiter[2].wait()
+        except BaseException:
+            if waiter[2].is_set():
+                # the slot is handed over before cancelled
+                self._release()
+            else:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            raise
+
+    @asynccontextmanager
+    async def enter(self, priority: Optional[TaskPriority] = None):
+        if priority is None:
+            priority = _lowest_priority
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+
+# Split the inference task pipeline into stages, and each stage has its own bounded concurrency,
+# so that a task can execute on the worker while the former task is still uploading its results
+class StageScheduler(object):
+    def __init__(self, config: Optional[StagesConfig] = None) -> None:
+        if config is None:
+            config = StagesConfig()
+        self._stages: Dict[StageName, Stage] = {
+            name: Stage(name, getattr(config, name)) for name in stage_names
+        }
+
+    @asynccontextmanager
+    async def stage(self, name: StageName, priority: Optional[TaskPriority] = None):
+        stage = self._stages[name]
+        if stage.running >= stage.capacity:
+            _logger.debug(f"stage {name} is full, waiting")
+        async with stage.enter(priority):
+            yield
+
+    def metrics(self) -> Dict[StageName, StageMetrics]:
+        return {name: stage.metrics() for name, stage in self._stages.items()}
@@ -1,7 +1,9 @@
+import json
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from crynux_server import db
 from crynux_server.db import models as db_models
@@ -11,6 +13,38 @@ from crynux_server.models import (DownloadTaskState, DownloadTaskStatus,
 from .abc import DownloadTaskStateCache, InferenceTaskStateCache
 
 
+async def _load_timelines(
+    sess: AsyncSession, task_id_commitments: List[str]
+) -> Dict[str, Dict[str, float]]:
+    if len(task_id_commitments) == 0:
+        return {}
+    q = sa.select(db_models.InferenceTaskTimeline).where(
+        db_models.InferenceTaskTimeline.task_id_commitment.in_(task_id_commitments)
+    )
+    timelines = (await sess.scalars(q)).all()
+    return {
+        timeline.task_id_commitment: json.loads(timeline.marks)
+        for timeline in timelines
+    }
+
+
+async def _dump_timeline(
+    sess: AsyncSession, task_id_commitment: str, marks: Dict[str, float]
+):
+    q = sa.select(db_models.InferenceTaskTimeline).where(
+        db_models.InferenceTaskTimeline.task_id_commitment == task_id_commitment
+    )
+    timeline = (await sess.scalars(q)).one_or_none()
+    if timeline is None:
+        if len(marks) > 0:
+            timeline = db_models.InferenceTaskTimeline(
+                task_id_commitment=task_id_commitment, marks=json.dumps(marks)
+            )
+            sess.add(timeline)
+    else:
+        timeline.marks = json.dumps(marks)
+
+
 class DbInferenceTaskStateCache(InferenceTaskStateCache):
     async def load(self, task_id_commitment: bytes) -> InferenceTaskState:
         async with db.session_scope() as sess:
@@ -21,6 +55,7 @@ class DbInferenceTaskStateCache(InferenceTaskStateCache):
             state = (await sess.scalars(q)).one_or_none()
             if state is not None:
                 files = state.files.split(",")
+                timelines = await _load_timelines(sess, [state.task_id_commitment])
                 return InferenceTaskState(
                     task_id_commitment=task_id_commitment,
                     timeout=state.timeout,
@@ -31,6 +66,7 @@ class DbInferenceTaskStateCache(InferenceTaskStateCache):
                     waiting_tx_hash=state.waiting_tx_hash,
                     waiting_tx_method=state.waiting_tx_method,
                     checkpoint=state.checkpoint,
+                    timeline=timelines.get(state.task_id_commitment, {}),
                 )
             else:
                 raise KeyError(
@@ -68,6 +104,7 @@ class DbInferenceTaskStateCache(InferenceTaskStateCache):
                 state.waiting_tx_hash = task_state.waiting_tx_hash
                 state.waiting_tx_method = task_state.waiting_tx_method
                 state.checkpoint = task_state.checkpoint
+            await _dump_timeline(sess, task_id_commitment.hex(), task_state.timeline)
             await sess.commit()
 
     async def has(self, task_id_commitment: bytes) -> bool:
@@ -95,6 +132,9 @@ class DbInferenceTaskStateCache(InferenceTaskStateCache):
                 q = q.where(db_models.InferenceTaskState.status.in_(status))
 
             states = (await sess.execute(q)).scalars().all()
+            timelines = await _load_timelines(
+                sess, [state.task_id_commitment for state in states]
+            )
             return [
                 InferenceTaskState(
                     task_id_commitment=bytes.fromhex(state.task_id_commitment[2:]),
@@ -106,6 +146,7 @@ class DbInferenceTaskStateCache(InferenceTaskStateCache):
                     waiting_tx_hash=state.waiting_tx_hash,
                     waiting_tx_method=state.waiting_tx_method,
                     checkpoint=state.checkpoint,
+                    timeline=timelines.get(state.task_id_commitment, {}),
                 )
                 for state in states
             ]
@@ -3,18 +3,19 @@ import logging
 import os.path
 import random
 import re
-import shutil
 import time
 from abc import ABC, abstractmethod
 from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Awaitable, Callable, List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
-from anyio import (create_memory_object_stream, create_task_group, fail_after,
+from anyio import (CancelScope, Event, WouldBlock, create_memory_object_stream,
+                   create_task_group, current_time, fail_after,
                    get_cancelled_exc_class, move_on_after, sleep, to_thread)
 from anyio.streams.memory import (MemoryObjectReceiveStream,
                                   MemoryObjectSendStream)
 from hexbytes import HexBytes
+from pydantic import BaseModel
 from tenacity import retry, stop_after_delay, wait_chain, wait_fixed
 from web3 import Web3
 
@@ -25,20 +26,56 @@ from crynux_server.download_model_cache import (DownloadModelCache,
                                                 get_download_model_cache)
 from crynux_server.relay import Relay, get_relay
 from crynux_server.relay.exceptions import RelayError
-from crynux_server.worker_manager import TaskInvalid
-
+from crynux_server.worker_manager import (TaskInvalid, TaskPriority,
+                                          get_worker_manager, task_priority)
+
+from .checkpoint_cache import CheckpointCache
+from .fetcher import RelayTaskFetcher
+from .gc import remove_dir, terminal_status
+from .manifest import (get_manifest_checkpoint, get_manifest_files,
+                       load_result_manifest, make_result_manifest,
+                       remove_result_manifest, write_result_manifest)
+from .stages import StageName, StageScheduler
 from .state_cache import (DownloadTaskStateCache, InferenceTaskStateCache,
                           get_download_task_state_cache,
                           get_inference_task_state_cache)
-from .utils import run_download_task, run_inference_task
+from .timeline import TimelineMark
+from .utils import (collect_inference_results,
+                    execute_inference_task_with_hasher, get_task_dir,
+                    hash_inference_results, run_download_task)
 
 _logger = logging.getLogger(__name__)
 
 
+# Predict the deadline miss of a task only after enough steps are done by the worker
+_min_progress_to_predict = 0.2
+
+
 OkCallback = Callable[[bool], Awaitable[None]]
 ErrCallback = Callable[[Exception], Awaitable[None]]
 
 
+# Task status carried by each task event from the relay
+_event_status: Dict[models.EventType, models.InferenceTaskStatus] = {
+    "TaskErrorReported": models.InferenceTaskStatus.ErrorReported,
+    "TaskScoreReady": models.InferenceTaskStatus.ScoreReady,
+    "TaskValidated": models.InferenceTaskStatus.Validated,
+    "TaskEndInvalidated": models.InferenceTaskStatus.EndInvalidated,
+    "TaskEndSuccess": models.InferenceTaskStatus.EndSuccess,
+    "TaskEndAborted": models.InferenceTaskStatus.EndAborted,
+    "TaskEndGroupRefund": models.InferenceTaskStatus.EndGroupRefund,
+    "TaskEndGroupSuccess": models.InferenceTaskStatus.EndGroupSuccess,
+}
+
+inference_task_event_types: List[models.EventType] = list(_event_status.keys())
+
+
+# Task input which is ready to be sent to the worker
+class PreparedTaskInput(BaseModel):
+    task: models.RelayTask
+    models: List[models.ModelConfig]
+
+
 # Manage the lifestyle of one task
 class InferenceTaskRunnerBase(ABC):
     @abstractmethod
@@ -57,6 +94,19 @@ class InferenceTaskRunnerBase(ABC):
         self.contracts = contracts
 
         self._state: Optional[models.InferenceTaskState] = None
+        # fee of the task from relay, known after the state is synced
+        self._task_fee = 0
+        # timeline marks before the state is loaded
+        self._pending_marks: Dict[str, float] = {}
+        # the timeout scope of run, moved earlier when the task is predicted to miss its deadline
+        self._deadline_scope: Optional[CancelScope] = None
+        # the scope of executing the task, cancelled when the task is ended
+        self._execute_scope: Optional[CancelScope] = None
+
+        # Task events pushed by the TaskSystem from the event watcher
+        self._event_sender, self._event_receiver = create_memory_object_stream(
+            20, item_type=models.Event
+        )
 
     @property
     def state(self) -> models.InferenceTaskState:
@@ -67,12 +117,37 @@ class InferenceTaskRunnerBase(ABC):
     def state(self, state: models.InferenceTaskState):
         assert self._state is None, "The task runner's state has already been set."
         self._state = state
+        if len(self._pending_marks) > 0:
+            self._state.timeline.update(self._pending_marks)
+            self._pending_marks.clear()
 
     @state.deleter
     def state(self):
         assert self._state is not None, "The task runner's state has not been set."
         self._state = None
 
+    # Record the timestamp of a step of the task in the task timeline
+    # The timeline is saved with the task state
+    def mark(self, name: TimelineMark):
+        now = time.time()
+        if self._state is None:
+            self._pending_marks[name] = now
+        else:
+            self._state.timeline[name] = now
+
+    # Timestamp of the task timeout, None if it is unknown yet
+    @property
+    def deadline(self) -> Optional[float]:
+        if self._state is None or self._state.timeout == 0:
+            return None
+        return self._state.timeout
+
+    # Priority of the task waiting in the admission and task stages
+    # The deadline and fee are known after the state is synced
+    @property
+    def priority(self) -> TaskPriority:
+        return task_priority("inference", self.deadline, self._task_fee)
+
     @asynccontextmanager
     async def state_context(self):
         try:
@@ -102,6 +177,7 @@ class InferenceTaskRunnerBase(ABC):
 
             # Get task info and update local record
             task = await self.get_task()
+            self._task_fee = task.task_fee
             start_timestamp = 0
             if task.start_time is not None:
                 start_timestamp = int(task.start_time.timestamp())
@@ -124,6 +200,27 @@ class InferenceTaskRunnerBase(ABC):
             if self._state is not None and need_dump:
                 await self.cache.dump(self.state)
 
+    # Receive a task event from the event watcher
+    # The event will be applied by task_status_producer
+    def process_event(self, event: models.Event):
+        try:
+            self._event_sender.send_nowait(event)
+        except WouldBlock:
+            # task_status_producer will poll the task status from relay instead
+            _logger.debug(
+                f"task {self.task_id_commitment.hex()} event buffer is full, drop event {event.type}"
+            )
+
+    # Update the local task status according to the task event
+    # Task status only moves forward, so stale events are ignored
+    async def apply_event(self, event: models.Event):
+        status = _event_status.get(event.type, None)
+        if status is None:
+            return
+        if status > self.state.status:
+            async with self.state_context():
+                self.state.status = status
+
     @abstractmethod
     async def cleanup(self): ...
 
@@ -141,14 +238,7 @@ class InferenceTaskRunnerBase(ABC):
 
     # Task in these status is already finished, therefore should stop the worker's process
     def should_stop(self):
-        return self.state.status in [
-            models.InferenceTaskStatus.EndAborted,
-            models.InferenceTaskStatus.EndGroupRefund,
-            models.InferenceTaskStatus.EndGroupSuccess,
-            models.InferenceTaskStatus.EndInvalidated,
-            models.InferenceTaskStatus.EndSuccess,
-            models.InferenceTaskStatus.ErrorReported,
-        ]
+        return self.state.status in terminal_status
 
     # Receive task status from task_status_producer
     # If task is started and not executed, execute it
@@ -173,10 +263,13 @@ class InferenceTaskRunnerBase(ABC):
                     status == models.InferenceTaskStatus.Validated
                     or status == models.InferenceTaskStatus.GroupValidated
                 ):
+                    self.mark("validated")
                     await self.upload_result()
 
     # Send task status when it changes
     # task_status_consumer will receive and handle the status
+    # Task status is updated by task events as soon as they arrive,
+    # and polled from relay when no event arrives in interval seconds
     async def task_status_producer(
         self,
         status_sender: MemoryObjectSendStream[models.InferenceTaskStatus],
@@ -186,10 +279,18 @@ class InferenceTaskRunnerBase(ABC):
             await status_sender.send(self.state.status)
             while not self.should_stop():
                 last_status = self.state.status
-                await self.sync_state()
+                event: Optional[models.Event] = None
+                with move_on_after(interval):
+                    event = await self._event_receiver.receive()
+                if event is not None:
+                    await self.apply_event(event)
+                else:
+                    await self.sync_state()
                 if last_status != self.state.status:
                     await status_sender.send(self.state.status)
-                await sleep(interval)
+        # the task is ended while executing, stop executing it
+        if self._execute_scope is not None:
+            self._execute_scope.cancel()
 
     async def run(self, interval: float = 1):
         try:
@@ -204,16 +305,50 @@ class InferenceTaskRunnerBase(ABC):
             status_sender, status_receiver = create_memory_object_stream(
                 10, item_type=models.InferenceTaskStatus
             )
-            with fail_after(delay, shield=False):
+            with fail_after(delay, shield=False) as scope:
+                self._deadline_scope = scope
                 async with create_task_group() as tg:
                     tg.start_soon(self.task_status_consumer, status_receiver)
                     tg.start_soon(self.task_status_producer, status_sender, interval)
         except TimeoutError:
-            # cancel task
-            if not self.should_stop():
-                await self.cancel_task()
-                async with self.state_context():
-                    self.state.status = models.InferenceTaskStatus.EndAborted
+            await self.abort()
+        finally:
+            self._deadline_scope = None
+            if self.should_stop():
+                with move_on_after(5, shield=True):
+                    await self.cleanup()
+
+    # Abort the task at once when the progress reported by the worker shows it cannot
+    # finish before the deadline, instead of waiting for the timeout
+    async def watch_progress(self, interval: float = 5):
+        worker_manager = get_worker_manager()
+        while True:
+            await sleep(interval)
+            progress = worker_manager.get_task_progress(self.task_id_commitment.hex())
+            if progress is None or not progress.deadline_miss:
+                continue
+            if progress.step < progress.total * _min_progress_to_predict:
+                continue
+            self.mark("deadline_miss_predicted")
+            _logger.warning(
+                f"Task {self.task_id_commitment.hex()} is predicted to miss its deadline, "
+                f"step {progress.step}/{progress.total}, eta {progress.eta:.1f}s"
+            )
+            if self._deadline_scope is not None:
+                self._deadline_scope.deadline = current_time()
+            return
+
+    # Abort the task on relay when it cannot finish before timeout
+    async def abort(self):
+        if not self.should_stop():
+            await self.cancel_task()
+            async with self.state_context():
+                self.state.status = models.InferenceTaskStatus.EndAborted
+
+    # Abort the task and clean it up, used when the task cannot finish in time
+    async def reject(self):
+        try:
+            await self.abort()
         finally:
             if self.should_stop():
                 with move_on_after(5, shield=True):
@@ -228,6 +363,9 @@ class InferenceTaskRunner(InferenceTaskRunnerBase):
         contracts: Optional[Contracts] = None,
         relay: Optional[Relay] = None,
         config: Optional[Config] = None,
+        task_fetcher: Optional[RelayTaskFetcher] = None,
+        stage_scheduler: Optional[StageScheduler] = None,
+        checkpoint_cache: Optional[CheckpointCache] = None,
     ) -> None:
         super().__init__(
             task_id_commitment=task_id_commitment,
@@ -241,9 +379,27 @@ class InferenceTaskRunner(InferenceTaskRunnerBase):
         if config is None:
             config = get_config()
         self.config = config
+        # fetch task in batch with other runners when provided
+        self.task_fetcher = task_fetcher
+        # limit the concurrency of each task stage with other runners when provided
+        self.stage_scheduler = stage_scheduler
+        # reuse input checkpoints downloaded by former tasks when provided
+        self.checkpoint_cache = checkpoint_cache
+
+        # task input prepared by prefetch or execute_task
+        self._prepared: Optional[PreparedTaskInput] = None
+        self._preparing: Optional[Event] = None
 
         self._cleaned = False
 
+    @asynccontextmanager
+    async def _stage(self, name: StageName):
+        if self.stage_scheduler is None:
+            yield
+        else:
+            async with self.stage_scheduler.stage(name, self.priority):
+                yield
+
     # Report task error(ParametersValidationFailed)
     async def _report_error(self):
         async with self.state_context():
@@ -262,10 +418,15 @@ class InferenceTaskRunner(InferenceTaskRunnerBase):
                 f"Report error of task {self.task_id_commitment.hex()} failed due to {e.message}"
             )
 
+    async def _fetch_task(self) -> models.RelayTask:
+        if self.task_fetcher is not None:
+            return await self.task_fetcher.get_task(self.task_id_commitment)
+        return await self.relay.get_task(self.task_id_commitment)
+
     # Get task info
     async def get_task(self):
         try:
-            task = await self.relay.get_task(self.task_id_commitment)
+            task = await self._fetch_task()
         except RelayError as e:
             _logger.error(
                 f"Get task {self.task_id_commitment.hex()} failed due to {e.message}"
@@ -298,14 +459,14 @@ class InferenceTaskRunner(InferenceTaskRunnerBase):
             _logger.debug(f"Cancel task {self.task_id_commitment.hex()} failed")
             raise
 
-    async def execute_task(self):
+    async def _prepare_input(self) -> PreparedTaskInput:
         @retry(
             stop=stop_after_delay(180),
             wait=wait_chain(*[wait_fixed(1) for _ in range(10)] + [wait_fixed(5)]),
             reraise=True,
         )
         async def get_task():
-            task = await self.relay.get_task(self.task_id_commitment)
+            task = await self._fetch_task()
             _logger.debug(f"get task {self.task_id_commitment.hex()} from relay")
             return task
 
@@ -315,23 +476,138 @@ class InferenceTaskRunner(InferenceTaskRunnerBase):
             reraise=True,
         )
         async def get_checkpoint(checkpoint_dir: str):
-            await self.relay.get_checkpoint(self.task_id_commitment, checkpoint_dir)
-            _logger.debug(f"get task {self.task_id_commitment.hex()} from relay")
+            if self.checkpoint_cache is None:
+                await self.relay.get_checkpoint(self.task_id_commitment, checkpoint_dir)
+            else:
+                checkpoint_hash = await self.relay.get_checkpoint_hash(
+                    self.task_id_commitment
+                )
+
+                async def download(checkpoint_file: str):
+                    await self.relay.download_checkpoint(
+                        self.task_id_commitment, checkpoint_file
+                    )
+
+                await self.checkpoint_cache.get(
+                    checkpoint_dir, download, checkpoint_hash=checkpoint_hash
+                )
+            _logger.debug(f"get task {self.task_id_commitment.hex()} checkpoint from relay")
+
+        task_dir = os.path.join(
+            self.config.task_config.output_dir, self.task_id_commitment.hex()
+        )
+        self.mark("get_task_start")
+        task = await get_task()
+        self.mark("get_task_end")
+        task_models = [
+            models.ModelConfig.from_model_id(model_id) for model_id in task.model_ids
+        ]
+        if task.task_type == models.TaskType.SD_FT_LORA:
+            args = json.loads(task.task_args)
+            checkpoint = args.get("checkpoint", None)
+            if checkpoint is not None:
+                checkpoint_dir = os.path.join(task_dir, "input_checkpoint")
+                self.mark("checkpoint_start")
+                await get_checkpoint(checkpoint_dir)
+                self.mark("checkpoint_end")
+                args["checkpoint"] = checkpoint_dir
+                task.task_args = json.dumps(args)
+
+        return PreparedTaskInput(task=task, models=task_models)
+
+    # Fetch task args and download the input checkpoint of the task
+    # Concurrent calls share the same preparation, and a failed preparation is retried by the next call
+    async def prepare(self) -> PreparedTaskInput:
+        while self._preparing is not None:
+            await self._preparing.wait()
+        if self._prepared is not None:
+            return self._prepared
+
+        self._preparing = Event()
+        try:
+            async with self._stage("fetch_inputs"):
+                self._prepared = await self._prepare_input()
+            return self._prepared
+        finally:
+            self._preparing.set()
+            self._preparing = None
+
+    # Prepare the task input speculatively before the task is executed
+    async def prefetch(self):
+        try:
+            await self.prepare()
+            _logger.debug(f"Task {self.task_id_commitment.hex()} input is prefetched")
+        except get_cancelled_exc_class():
+            raise
+        except Exception as e:
+            # execute_task will prepare the task input again
+            _logger.warning(
+                f"Prefetch task {self.task_id_commitment.hex()} input failed: {str(e)}"
+            )
+
+    # Load result files and hashes from the result manifest written before the node restarts
+    # Return None if the manifest does not exist or result files are changed
+    async def _recover_results(
+        self, task_dir: str
+    ) -> Optional[Tuple[List[str], List[bytes], Optional[str]]]:
+        manifest = await to_thread.run_sync(
+            load_result_manifest, task_dir, self.task_id_commitment
+        )
+        if manifest is None:
+            return None
+
+        files = get_manifest_files(task_dir, manifest)
+        checkpoint = get_manifest_checkpoint(task_dir, manifest)
+        if manifest.hashed:
+            hashes = [bytes.fromhex(f.hash) for f in manifest.files if f.hash is not None]
+        else:
+            async with self._stage("hash"):
+                hashes = await hash_inference_results(self.state.task_type, files)
+        return files, hashes, checkpoint
+
+    async def _write_manifest(
+        self,
+        task_dir: str,
+        files: List[str],
+        checkpoint: Optional[str],
+        hashes: Optional[List[bytes]] = None,
+    ):
+        def _write():
+            manifest = make_result_manifest(
+                self.task_id_commitment,
+                self.state.task_type,
+                task_dir,
+                files,
+                checkpoint,
+                hashes,
+            )
+            write_result_manifest(task_dir, manifest)
+
+        await to_thread.run_sync(_write)
 
+    async def execute_task(self):
         async def execute_task_in_worker():
-            task_dir = os.path.join(
-                self.config.task_config.output_dir, self.task_id_commitment.hex()
+            task_dir = await to_thread.run_sync(
+                get_task_dir,
+                self.config.task_config,
+                self.state.task_type,
+                self.task_id_commitment,
             )
-            task = await get_task()
+            # The task was executed before the node restarts, skip executing it again
+            recovered = await self._recover_results(task_dir)
+            if recovered is not None:
+                files, hashes, checkpoint = recovered
+                _logger.info(
+                    f"Task {self.task_id_commitment.hex()} results are recovered from the manifest"
+                )
+                async with self.state_context():
+                    self.state.files = files
+                    self.state.score = b"".join(hashes)
+                    self.state.checkpoint = checkpoint
+                return
 
-            if self.state.task_type == models.TaskType.SD_FT_LORA:
-                args = json.loads(task.task_args)
-                checkpoint = args.get("checkpoint", None)
-                if checkpoint is not None:
-                    checkpoint_dir = os.path.join(task_dir, "input_checkpoint")
-                    await get_checkpoint(checkpoint_dir)
-                    args["checkpoint"] = checkpoint_dir
-                    task.task_args = json.dumps(args)
+            prepared = await self.prepare()
+            task = prepared.task
 
             _logger.info(
                 f"task id: {self.task_id_commitment.hex()},"
@@ -341,19 +617,41 @@ class InferenceTaskRunner(InferenceTaskRunnerBase):
             _logger.info(f"Start executing task {self.task_id_commitment.hex()}")
             if not os.path.exists(task_dir):
                 os.makedirs(task_dir, exist_ok=True)
+            # results of the former execution are overwritten
+            remove_result_manifest(task_dir)
             try:
-                task_models = [
-                    models.ModelConfig.from_model_id(model_id)
-                    for model_id in task.model_ids
-                ]
-
-                files, hashes, checkpoint = await run_inference_task(
-                    task_id_commitment=self.task_id_commitment,
-                    task_type=self.state.task_type,
-                    models=task_models,
-                    task_args=task.task_args,
-                    task_dir=task_dir,
-                )
+                async with self._stage("execute"):
+                    self.mark("dispatched")
+                    try:
+                        async with create_task_group() as watch_tg:
+                            watch_tg.start_soon(self.watch_progress)
+                            hasher = await execute_inference_task_with_hasher(
+                                task_id_commitment=self.task_id_commitment,
+                                task_type=self.state.task_type,
+                                models=prepared.models,
+                                task_args=task.task_args,
+                                task_dir=task_dir,
+                                deadline=self.state.timeout,
+                                fee=task.task_fee,
+                            )
+                            watch_tg.cancel_scope.cancel()
+                    except get_cancelled_exc_class():
+                        # the task is ended or timeout, free the worker for the next task
+                        with CancelScope(shield=True):
+                            await get_worker_manager().cancel_task(
+                                self.task_id_commitment.hex()
+                            )
+                        raise
+                    self.mark("worker_finished")
+                async with self._stage("hash"):
+                    self.mark("hash_start")
+                    files, checkpoint = collect_inference_results(
+                        self.state.task_type, task_dir, hasher.worker_files
+                    )
+                    await self._write_manifest(task_dir, files, checkpoint)
+                    hashes = await hasher.finish(files)
+                    await self._write_manifest(task_dir, files, checkpoint, hashes)
+                    self.mark("hash_end")
                 _logger.info(f"Task {self.task_id_commitment.hex()} execution success")
                 async with self.state_context():
                     self.state.files = files
@@ -373,7 +671,7 @@ class InferenceTaskRunner(InferenceTaskRunnerBase):
 
         # Submit task score for validation
         async def submit_task_score():
-            for _ in range(4):
+            for i in range(4):
                 try:
                     await self.relay.submit_task_score(
                         task_id_commitment=self.task_id_commitment,
@@ -384,7 +682,10 @@ class InferenceTaskRunner(InferenceTaskRunnerBase):
                 except Exception as e:
                     if _illegal_task_state(e):
                         if self.state.status == models.InferenceTaskStatus.Started:
-                            await sleep(2)
+                            # There is no event for ParametersUploaded,
+                            # so refresh the task status from relay before retrying
+                            await sleep(0.5 * 2**i)
+                            await self.sync_state()
                             continue
                         elif (
                             self.state.status
@@ -396,30 +697,61 @@ class InferenceTaskRunner(InferenceTaskRunnerBase):
         _logger.debug(f"task {self.task_id_commitment} state: {self.state}")
 
         if len(self.state.files) == 0:
-            await execute_task_in_worker()
+            with CancelScope() as scope:
+                self._execute_scope = scope
+                await execute_task_in_worker()
+            self._execute_scope = None
+            if scope.cancel_called:
+                _logger.info(
+                    f"Task {self.task_id_commitment.hex()} is ended while executing"
+                )
+                return
 
-        await submit_task_score()
+        async with self._stage("submit"):
+            self.mark("submit_start")
+            await submit_task_score()
+            async with self.state_context():
+                self.mark("submit_end")
+
+    def _upload_progress(self, uploaded: int, total: int):
+        _logger.debug(
+            f"Task {self.task_id_commitment.hex()} uploaded {uploaded}/{total} bytes"
+        )
 
     # Upload full task result to relay
     async def upload_result(self) -> None:
-        _logger.info(f"Task {self.task_id_commitment.hex()} start uploading results")
-        await self.relay.upload_task_result(
-            self.task_id_commitment, self.state.files, self.state.checkpoint
-        )
+        async with self._stage("upload"):
+            _logger.info(f"Task {self.task_id_commitment.hex()} start uploading results")
+            self.mark("upload_start")
+            await self.relay.upload_task_result(
+                self.task_id_commitment,
+                self.state.files,
+                self.state.checkpoint,
+                progress=self._upload_progress,
+            )
+            async with self.state_context():
+                self.mark("upload_end")
         _logger.info(f"Task {self.task_id_commitment.hex()} success")
 
     # Clean up task files when task is finished
     async def cleanup(self):
         if not self._cleaned:
 
-            def delete_result_files(files: List[str]) -> None:
+            def delete_result_files(files: List[str], checkpoint: Optional[str]) -> None:
                 if len(files) > 0:
                     dirname = os.path.dirname(files[0])
                     if os.path.exists(dirname):
-                        shutil.rmtree(dirname)
+                        remove_dir(dirname)
+                # the checkpoint archive is kept for resuming the upload, see archive_checkpoint
+                if checkpoint is not None:
+                    checkpoint_file = checkpoint.rstrip(os.sep) + ".zip"
+                    if os.path.exists(checkpoint_file):
+                        os.remove(checkpoint_file)
 
             with fail_after(10, shield=True):
-                await to_thread.run_sync(delete_result_files, self.state.files)
+                await to_thread.run_sync(
+                    delete_result_files, self.state.files, self.state.checkpoint
+                )
 
             del self.state
             self._cleaned = True
@@ -445,24 +777,24 @@ class MockInferenceTaskRunner(InferenceTaskRunnerBase):
     async def get_task(self):
         return models.RelayTask(
             sequence=1,
-            task_id_commitment=self.task_id_commitment,
-            creator=Web3.to_checksum_address("0x00000000000000000000"),
-            sampling_seed=bytes([0] * 32),
-            nonce=bytes([0] * 32),
+            task_id_commitment="0x" + bytes(self.task_id_commitment).hex(),
+            creator=Web3.to_checksum_address("0x0000000000000000000000000000000000000000"),
+            sampling_seed="0x" + "00" * 32,
+            nonce="0x" + "00" * 32,
             task_args="",
             status=models.InferenceTaskStatus.Started,
             task_type=models.TaskType.SD,
             task_version="2.5.0",
-            timeout=300,
+            timeout=self._timeout,
             min_vram=4,
             required_gpu="",
             required_gpu_vram=0,
-            task_fee=Web3.to_wei(1, "wei"),
+            task_fee="1",
             task_size=1,
             model_ids=[""],
             score="",
             qos_score=1,
-            selected_node=Web3.to_checksum_address("0x00000000000000000000"),
+            selected_node=Web3.to_checksum_address("0x0000000000000000000000000000000000000000"),
             create_time=datetime.now(),
             start_time=datetime.now(),
             score_ready_time=datetime.now(),
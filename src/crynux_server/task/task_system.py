@@ -1,25 +1,56 @@
 import logging
-import asyncio
-from typing import Dict, Optional
+import time
+from collections import deque
+from typing import Deque, Dict, List, Literal, Optional, Tuple
 
-from anyio import create_task_group, get_cancelled_exc_class, sleep
+from anyio import Condition, create_task_group, get_cancelled_exc_class, sleep
 from anyio.abc import TaskGroup
-from tenacity import retry, stop_after_attempt, stop_never, wait_fixed
+from pydantic import BaseModel
+from tenacity import retry, stop_after_attempt, stop_never
 
+from crynux_server.config import AdmissionConfig, ResultGCConfig, ResultShmConfig
 from crynux_server.contracts import Contracts
-from crynux_server.models import InferenceTaskStatus, DownloadTaskStatus, TaskType, DownloadTaskState
+from crynux_server.models import InferenceTaskStatus, DownloadTaskStatus, TaskType, DownloadTaskState, Event
 from crynux_server.relay.abc import Relay
-
+from crynux_server.retry import RetryPolicy, RetryStats
+from crynux_server.watcher import EventWatcher
+from crynux_server.worker_manager import TaskPriority, task_priority
+
+from .checkpoint_cache import CheckpointCache, CheckpointCacheStats
+from .fetcher import RelayTaskFetcher
+from .gc import ResultGC, ResultGCStats
+from .hashing import HashStats, get_hash_engine
+from .stages import Stage, StageMetrics, StageName, StageScheduler
 from .state_cache import InferenceTaskStateCache, DownloadTaskStateCache
-from .task_runner import InferenceTaskRunner, DownloadTaskRunner
+from .task_runner import InferenceTaskRunner, DownloadTaskRunner, inference_task_event_types
 
 _logger = logging.getLogger(__name__)
 
 
 
+TaskName = Literal["inference", "download"]
+
+
 def _is_task_id_commitment_empty(task_id_commitment: bytes):
     return all(v == 0 for v in task_id_commitment)
 
+class AdmissionMetrics(StageMetrics):
+    rejected: int
+
+
+class TaskSystemMetrics(BaseModel):
+    inference_tasks: int
+    download_tasks: int
+    queued_tasks: int
+    admission: Dict[TaskName, AdmissionMetrics]
+    stages: Dict[StageName, StageMetrics]
+    retries: Dict[str, RetryStats]
+    hash: HashStats
+    result_gc: Optional[ResultGCStats] = None
+    result_shm_gc: Optional[ResultGCStats] = None
+    checkpoint_cache: Optional[CheckpointCacheStats] = None
+
+
 # Manage all tasks distributed to the node
 class TaskSystem(object):
     def __init__(
@@ -29,6 +60,16 @@ class TaskSystem(object):
         contracts: Contracts,
         relay: Relay,
         retry: bool = True,
+        watcher: Optional[EventWatcher] = None,
+        poll_interval: float = 1,
+        event_poll_interval: float = 30,
+        stage_scheduler: Optional[StageScheduler] = None,
+        checkpoint_cache: Optional[CheckpointCache] = None,
+        admission_config: Optional[AdmissionConfig] = None,
+        output_dir: Optional[str] = None,
+        result_gc_config: Optional[ResultGCConfig] = None,
+        result_shm_config: Optional[ResultShmConfig] = None,
+        fetch_batch_window: float = 0,
     ) -> None:
         self._inference_state_cache = inference_state_cache
         self._download_state_cache = download_state_cache
@@ -36,47 +77,214 @@ class TaskSystem(object):
         self._relay = relay
         self._retry = retry
 
+        # When task events are watched, runners only poll the relay as a fallback
+        self._watcher = watcher
+        if watcher is not None:
+            self._poll_interval = event_poll_interval
+        else:
+            self._poll_interval = poll_interval
+        self._event_filter_ids: List[int] = []
+
+        # Runners fetch their tasks from relay in batch
+        self._task_fetcher = RelayTaskFetcher(relay=relay, batch_window=fetch_batch_window)
+        # Runners share the bounded concurrency of each task stage
+        if stage_scheduler is None:
+            stage_scheduler = StageScheduler()
+        self._stage_scheduler = stage_scheduler
+        # Runners reuse input checkpoints of fine-tune tasks
+        self._checkpoint_cache = checkpoint_cache
+
+        # Limit the number of running tasks of each type,
+        # and reject inference tasks which cannot finish before timeout
+        if admission_config is None:
+            admission_config = AdmissionConfig()
+        self._min_remaining_time = admission_config.min_remaining_time
+        self._admission: Dict[TaskName, Stage] = {
+            "inference": Stage("inference", admission_config.max_inference_tasks),
+            "download": Stage("download", admission_config.max_download_tasks),
+        }
+        self._rejected_tasks: Dict[TaskName, int] = {"inference": 0, "download": 0}
+
+        # Retry stats of running tasks, keyed by task id
+        self._retry_stats: Dict[str, RetryStats] = {}
+
+        # Remove results left behind in the output dir in background
+        self._result_gc: Optional[ResultGC] = None
+        if output_dir is not None:
+            self._result_gc = ResultGC(
+                output_dir=output_dir,
+                state_cache=inference_state_cache,
+                is_running=lambda task_id_commitment: task_id_commitment
+                in self._inference_runners,
+                config=result_gc_config,
+            )
+        # results in the shared memory dir are removed in the same way, bounded by its own size
+        self._result_shm_gc: Optional[ResultGC] = None
+        if result_shm_config is not None:
+            if result_gc_config is None:
+                result_gc_config = ResultGCConfig()
+            self._result_shm_gc = ResultGC(
+                output_dir=result_shm_config.dir,
+                state_cache=inference_state_cache,
+                is_running=lambda task_id_commitment: task_id_commitment
+                in self._inference_runners,
+                config=result_gc_config.model_copy(
+                    update={"max_size": result_shm_config.max_size}
+                ),
+            )
+
         self._tg: Optional[TaskGroup] = None
 
         self._inference_runners: Dict[bytes, InferenceTaskRunner] = {}
         self._download_runners: Dict[str, DownloadTaskRunner] = {}
 
-        self._task_queue = asyncio.Queue()
+        # Created tasks waiting to be started by the task system, with their task_priority
+        # Tasks wait by priority in the admission and the task stages, see Stage
+        # Priority of inference tasks is None when it comes from the task state
+        self._task_queue: Deque[
+            Tuple[TaskName, bytes | str, Optional[TaskPriority]]
+        ] = deque()
+        self._task_queue_condition = Condition()
+
+    async def _put_task(
+        self,
+        task_name: TaskName,
+        task_id: bytes | str,
+        priority: Optional[TaskPriority] = None,
+    ):
+        async with self._task_queue_condition:
+            self._task_queue.append((task_name, task_id, priority))
+            self._task_queue_condition.notify(1)
+
+    async def _get_task(self) -> Tuple[TaskName, bytes | str, Optional[TaskPriority]]:
+        async with self._task_queue_condition:
+            while len(self._task_queue) == 0:
+                await self._task_queue_condition.wait()
+            return self._task_queue.popleft()
+
+    # Check whether the inference task can finish before timeout, abort it if not
+    # Return False if the task is rejected
+    async def _admit_inference_task(self, runner: InferenceTaskRunner) -> bool:
+        try:
+            await runner.sync_state()
+        except get_cancelled_exc_class():
+            raise
+        except Exception as e:
+            # runner will sync the task state again when running
+            _logger.debug(f"Sync inference task {runner.task_id_commitment.hex()} state error: {str(e)}")
+            return True
+
+        # executed tasks are always admitted
+        if runner.should_stop() or len(runner.state.files) > 0:
+            return True
+        remaining_time = runner.state.timeout - time.time()
+        if remaining_time < self._min_remaining_time:
+            _logger.warning(
+                f"Inference task {runner.task_id_commitment.hex()} has only {remaining_time:.1f}s left, abort it"
+            )
+            self._rejected_tasks["inference"] += 1
+            await runner.reject()
+            return False
+        return True
 
     # Run inference task with the given task_id_commitment
-    async def _run_inference_task(self, task_id_commitment: bytes):
+    # Without the given priority, the task state is synced before admission, so that the task
+    # waits for admission by its deadline and fee
+    # Input of new tasks is prefetched after they are admitted, so that tasks waiting for
+    # admission don't call the relay
+    async def _run_inference_task(
+        self,
+        task_id_commitment: bytes,
+        priority: Optional[TaskPriority] = None,
+        prefetch: bool = False,
+    ):
         try:
             runner = self._inference_runners[task_id_commitment]
-
-            @retry(
-                stop=stop_never if self._retry else stop_after_attempt(1),
-                wait=wait_fixed(30),
-                reraise=True,
-            )
-            async def _run_task_with_retry():
+            if priority is None:
                 try:
-                    await runner.run()
+                    await runner.sync_state()
                 except get_cancelled_exc_class():
                     raise
                 except Exception as e:
-                    _logger.exception(e)
-                    _logger.error(f"Inference task {task_id_commitment.hex()} error: {str(e)}")
-                    raise
-
-            await _run_task_with_retry()
-
+                    # the task waits with an unknown deadline, and is synced again after admission
+                    _logger.debug(
+                        f"Sync inference task {task_id_commitment.hex()} state error: {str(e)}"
+                    )
+                priority = runner.priority
+            async with self._admission["inference"].enter(priority):
+                runner.mark("admitted")
+                if await self._admit_inference_task(runner):
+                    async with create_task_group() as tg:
+                        if prefetch and isinstance(runner, InferenceTaskRunner):
+                            # prepare the task input while the runner waits for the task to start
+                            tg.start_soon(runner.prefetch)
+                        await self._run_inference_runner(runner)
+                        tg.cancel_scope.cancel()
+        except get_cancelled_exc_class():
+            raise
+        except Exception as e:
+            # retrying is stopped, give up the task without affecting other tasks
+            _logger.exception(e)
+            _logger.error(
+                f"Inference task {task_id_commitment.hex()} failed after retrying, abort it"
+            )
+            try:
+                await self._inference_runners[task_id_commitment].reject()
+            except get_cancelled_exc_class():
+                raise
+            except Exception as e:
+                _logger.error(
+                    f"Abort inference task {task_id_commitment.hex()} error: {str(e)}"
+                )
         finally:
             # When task is finished, remove it from the task list
             del self._inference_runners[task_id_commitment]
 
+    async def _run_inference_runner(self, runner: InferenceTaskRunner):
+        task_id_commitment = runner.task_id_commitment
+        # retry soon on transient errors, and stop retrying after the task deadline
+        policy = RetryPolicy(
+            max_delay=30,
+            deadline=lambda: runner.deadline,
+            stats=self._retry_stats.setdefault(task_id_commitment.hex(), RetryStats()),
+        )
+
+        @retry(
+            stop=policy.stop if self._retry else stop_after_attempt(1),
+            wait=policy.wait,
+            before_sleep=policy.before_sleep,
+            reraise=True,
+        )
+        async def _run_task_with_retry():
+            try:
+                await runner.run(interval=self._poll_interval)
+            except get_cancelled_exc_class():
+                raise
+            except Exception as e:
+                _logger.exception(e)
+                _logger.error(f"Inference task {task_id_commitment.hex()} error: {str(e)}")
+                raise
+
+        try:
+            await _run_task_with_retry()
+        finally:
+            del self._retry_stats[task_id_commitment.hex()]
+
     # Run download task with the given task_id
-    async def _run_download_task(self, task_id: str):
+    async def _run_download_task(
+        self, task_id: str, priority: Optional[TaskPriority] = None
+    ):
         try:
             runner = self._download_runners[task_id]
+            policy = RetryPolicy(
+                max_delay=30,
+                stats=self._retry_stats.setdefault(task_id, RetryStats()),
+            )
 
             @retry(
                 stop=stop_never if self._retry else stop_after_attempt(1),
-                wait=wait_fixed(30),
+                wait=policy.wait,
+                before_sleep=policy.before_sleep,
                 reraise=True,
             )
             async def _run_task_with_retry():
@@ -89,12 +297,37 @@ class TaskSystem(object):
                     _logger.error(f"Download task {task_id} error: {str(e)}")
                     raise
 
-            await _run_task_with_retry()
+            async with self._admission["download"].enter(priority):
+                await _run_task_with_retry()
 
         finally:
             # When task is finished, remove it from the task list
             del self._download_runners[task_id]
-
+            self._retry_stats.pop(task_id, None)
+
+
+    # Dispatch task events from the watcher to the corresponding inference runner
+    async def _process_inference_task_event(self, event: Event):
+        task_id_commitment = getattr(event, "task_id_commitment", None)
+        if task_id_commitment is None:
+            return
+        runner = self._inference_runners.get(task_id_commitment, None)
+        if runner is not None:
+            runner.process_event(event)
+
+    def _watch_inference_task_events(self):
+        if self._watcher is not None:
+            for event_type in inference_task_event_types:
+                filter_id = self._watcher.add_event_filter(
+                    event_type, self._process_inference_task_event
+                )
+                self._event_filter_ids.append(filter_id)
+
+    def _unwatch_inference_task_events(self):
+        if self._watcher is not None:
+            for filter_id in self._event_filter_ids:
+                self._watcher.remove_event_filter(filter_id)
+        self._event_filter_ids.clear()
 
     async def _get_node_task(self):
         return await self._relay.node_get_current_task()
@@ -114,6 +347,10 @@ class TaskSystem(object):
                 task_id_commitment=state.task_id_commitment,
                 state_cache=self._inference_state_cache,
                 contracts=self._contracts,
+                relay=self._relay,
+                task_fetcher=self._task_fetcher,
+                stage_scheduler=self._stage_scheduler,
+                checkpoint_cache=self._checkpoint_cache,
             )
             runner.state = state
             self._inference_runners[state.task_id_commitment] = runner
@@ -125,7 +362,11 @@ class TaskSystem(object):
             runner = InferenceTaskRunner(
                 task_id_commitment=task_id_commitment,
                 state_cache=self._inference_state_cache,
-                contracts=self._contracts
+                contracts=self._contracts,
+                relay=self._relay,
+                task_fetcher=self._task_fetcher,
+                stage_scheduler=self._stage_scheduler,
+                checkpoint_cache=self._checkpoint_cache,
             )
             self._inference_runners[task_id_commitment] = runner
             tg.start_soon(self._run_inference_task, task_id_commitment)
@@ -149,15 +390,30 @@ class TaskSystem(object):
             _logger.debug(f"Rerun download task {state.task_id}")
 
     # Create inference task on node with the given task_id_commitment
-    async def create_inference_task(self, task_id_commitment: bytes):
+    # Inference tasks are run before download tasks, and the task with the earliest deadline runs first
+    async def create_inference_task(
+        self,
+        task_id_commitment: bytes,
+        deadline: Optional[float] = None,
+        fee: int = 0,
+    ):
         if not _is_task_id_commitment_empty(task_id_commitment) and task_id_commitment not in self._inference_runners:
             runner = InferenceTaskRunner(
                 task_id_commitment=task_id_commitment,
                 state_cache=self._inference_state_cache,
-                contracts=self._contracts
+                contracts=self._contracts,
+                relay=self._relay,
+                task_fetcher=self._task_fetcher,
+                stage_scheduler=self._stage_scheduler,
+                checkpoint_cache=self._checkpoint_cache,
             )
+            runner.mark("event_received")
             self._inference_runners[task_id_commitment] = runner
-            await self._task_queue.put(("inference", task_id_commitment))
+            runner.mark("queued")
+            priority = None
+            if deadline is not None:
+                priority = task_priority("inference", deadline, fee)
+            await self._put_task("inference", task_id_commitment, priority)
 
     # Create download task with the given task_id
     async def create_download_task(self, task_id: str, task_type: TaskType, model_id: str):
@@ -176,30 +432,39 @@ class TaskSystem(object):
                 relay=self._relay
             )
             self._download_runners[task_id] = runner
-            await self._task_queue.put(("download", task_id))
+            await self._put_task("download", task_id, task_priority("download"))
 
     async def start(self):
+        policy = RetryPolicy(max_delay=30)
+
         @retry(
             stop=stop_never if self._retry else stop_after_attempt(1),
-            wait=wait_fixed(30),
+            wait=policy.wait,
             reraise=True,
         )
         async def _start():
             assert self._tg is None, "The TaskSystem has already been started."
 
             try:
+                self._watch_inference_task_events()
                 async with create_task_group() as tg:
                     self._tg = tg
                     await self._recover_inference_task(tg)
                     await self._recover_download_task(tg)
+                    if self._result_gc is not None:
+                        tg.start_soon(self._result_gc.run)
+                    if self._result_shm_gc is not None:
+                        tg.start_soon(self._result_shm_gc.run)
                     while True:
-                        task_name, task_id = await self._task_queue.get()
+                        task_name, task_id, priority = await self._get_task()
                         if task_name == "inference":
                             assert isinstance(task_id, bytes)
-                            tg.start_soon(self._run_inference_task, task_id)
+                            tg.start_soon(
+                                self._run_inference_task, task_id, priority, True
+                            )
                         elif task_name == "download":
                             assert isinstance(task_id, str)
-                            tg.start_soon(self._run_download_task, task_id)
+                            tg.start_soon(self._run_download_task, task_id, priority)
 
             except get_cancelled_exc_class():
                 raise
@@ -208,10 +473,39 @@ class TaskSystem(object):
                 _logger.exception(e)
                 raise
             finally:
+                self._unwatch_inference_task_events()
                 self._tg = None
 
         await _start()
 
+    def metrics(self) -> TaskSystemMetrics:
+        return TaskSystemMetrics(
+            inference_tasks=len(self._inference_runners),
+            download_tasks=len(self._download_runners),
+            queued_tasks=len(self._task_queue),
+            admission={
+                name: AdmissionMetrics(
+                    **stage.metrics().model_dump(), rejected=self._rejected_tasks[name]
+                )
+                for name, stage in self._admission.items()
+            },
+            stages=self._stage_scheduler.metrics(),
+            hash=get_hash_engine().stats,
+            result_gc=self._result_gc.stats if self._result_gc is not None else None,
+            result_shm_gc=(
+                self._result_shm_gc.stats if self._result_shm_gc is not None else None
+            ),
+            checkpoint_cache=(
+                self._checkpoint_cache.stats
+                if self._checkpoint_cache is not None
+                else None
+            ),
+            retries={
+                task_id: stats.model_copy()
+                for task_id, stats in self._retry_stats.items()
+            },
+        )
+
     def stop(self):
         if self._tg is not None and not self._tg.cancel_scope.cancel_called:
             self._tg.cancel_scope.cancel()
@@ -0,0 +1,80 @@
+from typing import Dict, List, Literal, Tuple
+
+from pydantic import BaseModel
+
+from crynux_server.models import InferenceTaskState
+from crynux_server.worker_manager import LatencyStats, make_latency_stats
+
+TimelineMark = Literal[
+    "event_received",
+    "queued",
+    "admitted",
+    "get_task_start",
+    "get_task_end",
+    "checkpoint_start",
+    "checkpoint_end",
+    "dispatched",
+    "worker_finished",
+    "deadline_miss_predicted",
+    "hash_start",
+    "hash_end",
+    "submit_start",
+    "submit_end",
+    "validated",
+    "upload_start",
+    "upload_end",
+]
+
+# Each span of the task timeline is the time between two marks
+timeline_spans: Dict[str, Tuple[TimelineMark, TimelineMark]] = {
+    "queue_wait": ("queued", "admitted"),
+    "get_task": ("get_task_start", "get_task_end"),
+    "checkpoint_download": ("checkpoint_start", "checkpoint_end"),
+    "worker": ("dispatched", "worker_finished"),
+    "hash": ("hash_start", "hash_end"),
+    "submit_score": ("submit_start", "submit_end"),
+    "validation_wait": ("submit_end", "validated"),
+    "upload": ("upload_start", "upload_end"),
+    "total": ("event_received", "upload_end"),
+}
+
+
+class TaskTimeline(BaseModel):
+    task_id_commitment: str
+    marks: Dict[str, float]
+    # seconds of each span
+    spans: Dict[str, float]
+
+
+# Seconds of a span over recent tasks
+SpanStats = LatencyStats
+
+
+def get_timeline_spans(marks: Dict[str, float]) -> Dict[str, float]:
+    spans: Dict[str, float] = {}
+    for name, (start, end) in timeline_spans.items():
+        if start in marks and end in marks and marks[end] >= marks[start]:
+            spans[name] = marks[end] - marks[start]
+    return spans
+
+
+def make_task_timeline(state: InferenceTaskState) -> TaskTimeline:
+    return TaskTimeline(
+        task_id_commitment="0x" + bytes(state.task_id_commitment).hex(),
+        marks=state.timeline,
+        spans=get_timeline_spans(state.timeline),
+    )
+
+
+def get_span_stats(states: List[InferenceTaskState]) -> Dict[str, SpanStats]:
+    span_values: Dict[str, List[float]] = {}
+    for state in states:
+        for name, value in get_timeline_spans(state.timeline).items():
+            span_values.setdefault(name, []).append(value)
+
+    res: Dict[str, SpanStats] = {}
+    for name, values in span_values.items():
+        stats = make_latency_stats(values)
+        assert stats is not None
+        res[name] = stats
+    return res
@@ -1,35 +1,51 @@
-import hashlib
 import os
 import re
-from typing import List, Literal
+from typing import List, Optional
 
-import imhash
+from anyio import create_task_group
+
+from crynux_server.config import TaskConfig
 from crynux_server.models import (
     InferenceTaskInput,
     TaskInput,
     TaskType,
     ModelConfig,
     DownloadTaskInput,
+    WorkerResultFile,
 )
 from crynux_server.worker_manager import get_worker_manager
 
-
-def get_image_hash(filename: str) -> bytes:
-    return bytes.fromhex(imhash.getPHash(filename)[2:])  # type: ignore
+from .gc import scan_output_dir
+from .hashing import (IncrementalHasher, get_hash_engine,
+                      get_result_file_pattern)
 
 
-def get_gpt_resp_hash(filename: str) -> bytes:
-    with open(filename, mode="rb") as f:
-        return hashlib.sha256(f.read()).digest()
+# Dir of the task results, in the shared memory dir if it is enabled and not full, see ResultShmConfig
+# A task keeps the shared memory dir once it is created there, so that its results can be recovered
+def get_task_dir(
+    task_config: TaskConfig, task_type: TaskType, task_id_commitment: bytes
+) -> str:
+    name = task_id_commitment.hex()
+    shm_config = task_config.result_shm
+    if shm_config is not None and task_type != TaskType.SD_FT_LORA:
+        shm_task_dir = os.path.join(shm_config.dir, name)
+        if os.path.exists(shm_task_dir):
+            return shm_task_dir
+        used = sum(entry.size for entry in scan_output_dir(shm_config.dir))
+        if used < shm_config.max_size:
+            return shm_task_dir
+    return os.path.join(task_config.output_dir, name)
 
 
-async def run_inference_task(
+async def execute_inference_task(
     task_id_commitment: bytes,
     task_type: TaskType,
     models: List[ModelConfig],
     task_args: str,
     task_dir: str,
-):
+    deadline: Optional[float] = None,
+    fee: int = 0,
+) -> Optional[List[WorkerResultFile]]:
     worker_manager = get_worker_manager()
     task_input = TaskInput(
         task=InferenceTaskInput(
@@ -41,30 +57,111 @@ async def run_inference_task(
             output_dir=task_dir,
         )
     )
-    task_result = await worker_manager.send_task(task_input)
-    await task_result.get()
+    task_result = await worker_manager.send_task(
+        task_input, deadline=deadline, fee=fee
+    )
+    # result files hashed by the worker
+    return await task_result.get()
 
-    files: List[str] = []
-    hashes: List[bytes] = []
-    checkpoint: str | None = None
-    if task_type == TaskType.SD:
-        files = [f for f in os.listdir(task_dir) if re.match(r"[0-9]+\.png", f)]
-        files.sort(key=lambda f: int(f.split(".")[0]))
-        files = [os.path.join(task_dir, f) for f in files]
-        hashes = [get_image_hash(filename) for filename in files]
-    elif task_type == TaskType.LLM:
-        files = [f for f in os.listdir(task_dir) if re.match(r"[0-9]+\.json", f)]
-        files.sort(key=lambda f: int(f.split(".")[0]))
-        files = [os.path.join(task_dir, f) for f in files]
-        hashes = [get_gpt_resp_hash(filename) for filename in files]
-    elif task_type == TaskType.SD_FT_LORA:
-        img_dir = os.path.join(task_dir, "validation")
-        files = [f for f in os.listdir(img_dir) if re.match(r"[0-9]+\.png", f)]
+
+# Result files listed by the worker in order,
+# None if any of them is not a result file, or is missing or changed
+def _check_worker_files(
+    task_type: TaskType, task_dir: str, worker_files: List[WorkerResultFile]
+):
+    dirname, pattern = get_result_file_pattern(task_type, task_dir)
+    files = []
+    for worker_file in worker_files:
+        path = os.path.normpath(os.path.join(task_dir, worker_file.path))
+        basename = os.path.basename(path)
+        if os.path.dirname(path) != os.path.normpath(dirname) or not re.match(
+            pattern, basename
+        ):
+            return None
+        # the same path as scanning the result dir
+        filename = os.path.join(dirname, basename)
+        try:
+            size = os.stat(filename).st_size
+        except FileNotFoundError:
+            return None
+        if size != worker_file.size:
+            return None
+        files.append(filename)
+    return files
+
+
+# Collect result files of the inference task in order, and the result checkpoint dir
+# Result files listed by the worker are used when they are unchanged, otherwise the result dir is scanned
+def collect_inference_results(
+    task_type: TaskType,
+    task_dir: str,
+    worker_files: Optional[List[WorkerResultFile]] = None,
+):
+    files = None
+    if worker_files is not None and len(worker_files) > 0:
+        files = _check_worker_files(task_type, task_dir, worker_files)
+    if files is None:
+        dirname, pattern = get_result_file_pattern(task_type, task_dir)
+        files = [f for f in os.listdir(dirname) if re.match(pattern, f)]
         files.sort(key=lambda f: int(f.split(".")[0]))
-        files = [os.path.join(img_dir, f) for f in files]
-        hashes = [get_image_hash(filename) for filename in files]
+        files = [os.path.join(dirname, f) for f in files]
+    checkpoint: str | None = None
+    if task_type == TaskType.SD_FT_LORA:
         checkpoint = os.path.join(task_dir, "checkpoint")
+    return files, checkpoint
+
 
+async def hash_inference_results(task_type: TaskType, files: List[str]) -> List[bytes]:
+    hash_engine = get_hash_engine()
+    return await hash_engine.hash_files(task_type, files)
+
+
+# Execute the inference task, and hash result files as soon as they are written by the worker
+async def execute_inference_task_with_hasher(
+    task_id_commitment: bytes,
+    task_type: TaskType,
+    models: List[ModelConfig],
+    task_args: str,
+    task_dir: str,
+    deadline: Optional[float] = None,
+    fee: int = 0,
+) -> IncrementalHasher:
+    hasher = IncrementalHasher(get_hash_engine(), task_type, task_dir)
+    async with create_task_group() as tg:
+        tg.start_soon(hasher.watch)
+        try:
+            hasher.worker_files = await execute_inference_task(
+                task_id_commitment=task_id_commitment,
+                task_type=task_type,
+                models=models,
+                task_args=task_args,
+                task_dir=task_dir,
+                deadline=deadline,
+                fee=fee,
+            )
+        finally:
+            tg.cancel_scope.cancel()
+    return hasher
+
+
+async def run_inference_task(
+    task_id_commitment: bytes,
+    task_type: TaskType,
+    models: List[ModelConfig],
+    task_args: str,
+    task_dir: str,
+):
+    hasher = await execute_inference_task_with_hasher(
+        task_id_commitment=task_id_commitment,
+        task_type=task_type,
+        models=models,
+        task_args=task_args,
+        task_dir=task_dir,
+    )
+    files, checkpoint = collect_inference_results(
+        task_type, task_dir, hasher.worker_files
+    )
+    hashes = await hasher.finish(files)
     return files, hashes, checkpoint
 
 
@@ -1,10 +1,20 @@
+from .exchange import TaskPriority, TaskQueueStats, task_priority
 from .error import (TaskDownloadError, TaskCancelled, TaskError,
-                    TaskExecutionError, TaskInvalid, is_task_invalid)
-from .manager import WorkerManager, get_worker_manager, set_worker_manager
+                    TaskExecutionError, TaskInvalid, WorkerDisconnected,
+                    is_task_invalid)
+from .manager import (LatencyStats, TaskProgressInfo, WorkerManager,
+                      WorkerSlotInfo, get_worker_manager, make_latency_stats,
+                      set_worker_manager)
+from .queue_store import (DbTaskQueueStore, MemoryTaskQueueStore, QueuedTask,
+                          TaskQueueStore)
 from .task import TaskFuture
 
 __all__ = [
     "WorkerManager",
+    "WorkerSlotInfo",
+    "LatencyStats",
+    "make_latency_stats",
+    "TaskProgressInfo",
     "get_worker_manager",
     "set_worker_manager",
     "TaskFuture",
@@ -13,5 +23,13 @@ __all__ = [
     "TaskExecutionError",
     "TaskDownloadError",
     "TaskError",
+    "WorkerDisconnected",
     "is_task_invalid",
+    "TaskPriority",
+    "task_priority",
+    "TaskQueueStats",
+    "QueuedTask",
+    "TaskQueueStore",
+    "DbTaskQueueStore",
+    "MemoryTaskQueueStore",
 ]
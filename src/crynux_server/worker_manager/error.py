@@ -5,6 +5,11 @@ class TaskCancelled(Exception):
     pass
 
 
+# The worker is disconnected or replaced by a new connection of its slot while waiting for tasks
+class WorkerDisconnected(Exception):
+    pass
+
+
 class TaskError(Exception):
     error_type = "TaskError"
 
@@ -1,27 +1,360 @@
-from collections import deque
-from typing import Deque, Tuple
+import heapq
+import logging
+import math
+import time
+from typing import AbstractSet, Dict, List, Literal, Optional, Set, Tuple
+
+from anyio import Condition, Event, move_on_after, sleep
+from pydantic import BaseModel
 
-from anyio import Condition
 from crynux_server.models import TaskInput
 
+from .error import WorkerDisconnected
+from .queue_store import QueuedTask, TaskQueueStore
 from .task import TaskFuture
 
+_logger = logging.getLogger(__name__)
+
+TaskPriority = Tuple[int, float, int]
+
+
+# Priority of a task in the queue, the smaller the more urgent
+# Inference tasks go before download tasks, then the earliest deadline first, then the highest fee first
+def task_priority(
+    task_name: Literal["inference", "download"],
+    deadline: Optional[float] = None,
+    fee: int = 0,
+) -> TaskPriority:
+    kind = 0 if task_name == "inference" else 1
+    if deadline is None:
+        deadline = math.inf
+    return (kind, deadline, -fee)
+
+
+# How well the models loaded in a worker match the models of the task
+# Loading the base model costs the most, so a loaded base model counts more than other models
+def model_match_score(task_input: TaskInput, loaded_models: AbstractSet[str]) -> int:
+    if task_input.task.task_name != "inference":
+        return 0
+    score = 0
+    for model in task_input.task.models:
+        if model.to_model_id() in loaded_models:
+            score += 10 if model.type == "base" else 1
+    return score
+
+
+# Ages are seconds since the tasks are sent to the exchange, or sent to workers for dispatched tasks
+class TaskQueueStats(BaseModel):
+    queued: int
+    dispatched: int
+    # tasks recovered from the store after restarts
+    recovered: int
+    # recovered tasks which are not sent again by their task runners yet
+    unclaimed: int
+    oldest_queued_age: Optional[float] = None
+    mean_queued_age: Optional[float] = None
+    oldest_dispatched_age: Optional[float] = None
+
+
+def _retrieve_exception(fut):
+    if not fut.cancelled():
+        fut.exception()
+
 
 class TaskExchange(object):
-    def __init__(self) -> None:
+    def __init__(self, store: Optional[TaskQueueStore] = None) -> None:
         self._condition = Condition()
-        self._task_queue: Deque[Tuple[TaskInput, TaskFuture]] = deque()
+        self._task_queue: List[Tuple[TaskPriority, int, TaskInput, TaskFuture]] = []
+        # keep FIFO order of tasks with the same priority
+        self._seq = 0
+
+        # models loaded in each worker waiting for tasks
+        self._waiters: Dict[int, AbstractSet[str]] = {}
+        # number of tasks got by each worker
+        self._assigned: Dict[int, int] = {}
+        # removed workers which are still waiting for tasks
+        self._removed: Set[int] = set()
+
+        # tasks which are not done, they are saved to the store in background, see persist
+        self._store = store
+        self._tasks: Dict[str, QueuedTask] = {}
+        self._futures: Dict[str, TaskFuture] = {}
+        self._changed: Set[str] = set()
+        self._changed_event: Optional[Event] = None
+        # recovered tasks which are not sent again by their task runners, and when they are recovered
+        self._unclaimed: Dict[str, float] = {}
+        self._recovered = 0
+
+    def __len__(self) -> int:
+        return len(self._task_queue)
+
+    # A task recovered from the store is not sent again, the future of the recovered task is returned
+    async def send_task(
+        self, task_input: TaskInput, deadline: Optional[float] = None, fee: int = 0
+    ):
+        task_id = task_input.task.task_id
+        if task_id in self._unclaimed:
+            del self._unclaimed[task_id]
+            task_result = self._futures[task_id]
+            if task_result.done():
+                del self._futures[task_id]
+            return task_result
 
-    async def send_task(self, task_input: TaskInput):
         task_result = TaskFuture()
+        task_result.priority = task_priority(task_input.task.task_name, deadline, fee)
+        self._track(task_id, task_result)
+        await self.requeue(task_input, task_result)
+        return task_result
+
+    def _track(self, task_id: str, task_result: TaskFuture):
+        self._futures[task_id] = task_result
+        task_result.add_done_callback(lambda _: self._task_done(task_id, task_result))
+
+    def _task_done(self, task_id: str, task_result: TaskFuture):
+        # the task may be sent again with a new future
+        if self._futures.get(task_id, None) is not task_result:
+            return
+        self._tasks.pop(task_id, None)
+        self._mark_changed(task_id)
+        # keep the result for the task runner of the recovered task
+        if task_id not in self._unclaimed:
+            del self._futures[task_id]
+
+    def _mark_changed(self, task_id: str):
+        if self._store is None:
+            return
+        self._changed.add(task_id)
+        if self._changed_event is not None:
+            self._changed_event.set()
 
+    # Put the task back to the queue with its priority, when its worker exited before finishing it
+    async def requeue(self, task_input: TaskInput, task_result: TaskFuture):
+        task_id = task_input.task.task_id
+        task = self._tasks.get(task_id, None)
+        if task is None:
+            self._tasks[task_id] = QueuedTask(
+                task_input=task_input,
+                priority=task_result.priority,
+                queued_at=time.time(),
+            )
+        else:
+            task.priority = task_result.priority
+            task.status = "queued"
+            task.dispatched_at = None
+        self._mark_changed(task_id)
         async with self._condition:
-            self._task_queue.append((task_input, task_result))
-            self._condition.notify(1)
-        return task_result
+            heapq.heappush(
+                self._task_queue,
+                (task_result.priority, self._seq, task_input, task_result),
+            )
+            self._seq += 1
+            self._condition.notify_all()
+
+    # Remove the queued task and cancel it, return False if the task is not queued
+    async def remove_task(self, task_id: str) -> bool:
+        async with self._condition:
+            for i, (_, _, task_input, task_result) in enumerate(self._task_queue):
+                if task_input.task.task_id == task_id:
+                    self._task_queue.pop(i)
+                    heapq.heapify(self._task_queue)
+                    task_result.cancel()
+                    self._condition.notify_all()
+                    return True
+        return False
+
+    # Cancel all queued tasks, when no worker can execute them
+    async def cancel_tasks(self):
+        async with self._condition:
+            for _, _, _, task_result in self._task_queue:
+                task_result.cancel()
+            self._task_queue.clear()
+
+    # The waiting worker which loads the most models of the task,
+    # or the worker got the least tasks when no worker matches better
+    def _select_worker(self, task_input: TaskInput) -> int:
+        return max(
+            self._waiters,
+            key=lambda worker_id: (
+                model_match_score(task_input, self._waiters[worker_id]),
+                -self._assigned.get(worker_id, 0),
+                -worker_id,
+            ),
+        )
+
+    def _pop_task(self) -> Tuple[TaskInput, TaskFuture]:
+        _, _, task_input, task_result = heapq.heappop(self._task_queue)
+        task_id = task_input.task.task_id
+        task = self._tasks.get(task_id, None)
+        if task is not None:
+            task.status = "dispatched"
+            task.dispatched_at = time.time()
+            self._mark_changed(task_id)
+        return task_input, task_result
+
+    # Get the most urgent task
+    # When worker_id is provided, the task is routed to the waiting worker with the best model affinity
+    # Waiting workers are only woken up by new tasks or changes of workers, and
+    # WorkerDisconnected is raised when the worker is removed
+    async def get_task(
+        self,
+        worker_id: Optional[int] = None,
+        loaded_models: Optional[AbstractSet[str]] = None,
+    ) -> Tuple[TaskInput, TaskFuture]:
+        async with self._condition:
+            if worker_id is None:
+                while len(self._task_queue) == 0:
+                    await self._condition.wait()
+                return self._pop_task()
 
-    async def get_task(self) -> Tuple[TaskInput, TaskFuture]:
+            if loaded_models is None:
+                loaded_models = set()
+            self._waiters[worker_id] = loaded_models
+            try:
+                while True:
+                    if worker_id in self._removed:
+                        raise WorkerDisconnected(f"Worker {worker_id} is removed")
+                    if len(self._task_queue) > 0:
+                        task_input = self._task_queue[0][2]
+                        if self._select_worker(task_input) == worker_id:
+                            self._assigned[worker_id] = (
+                                self._assigned.get(worker_id, 0) + 1
+                            )
+                            return self._pop_task()
+                    await self._condition.wait()
+            finally:
+                self._removed.discard(worker_id)
+                del self._waiters[worker_id]
+                # the next task may be routed to other workers now
+                self._condition.notify_all()
+
+    # Route the next task again when models loaded in workers are changed
+    async def refresh(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+    async def remove_worker(self, worker_id: int):
+        async with self._condition:
+            self._assigned.pop(worker_id, None)
+            if worker_id in self._waiters:
+                self._removed.add(worker_id)
+                self._condition.notify_all()
+
+    # Queue the tasks which were not done before the restart, both queued and dispatched ones,
+    # in the order of their saved priorities. Task runners get the recovered futures by sending
+    # the tasks again. Tasks passing their deadlines are dropped, return the number of recovered tasks
+    async def recover(self) -> int:
+        if self._store is None:
+            return 0
+        tasks = await self._store.load()
+        now = time.time()
+        count = 0
         async with self._condition:
-            while len(self._task_queue) == 0:
-                await self._condition.wait()
-            return self._task_queue.popleft()
+            for task in tasks:
+                task_id = task.task_id
+                if task_id in self._futures:
+                    continue
+                if task.priority[1] < now:
+                    self._mark_changed(task_id)
+                    continue
+                task.status = "queued"
+                task.dispatched_at = None
+                task_result = TaskFuture()
+                task_result.priority = task.priority
+                # the result may never be got when the task runner is not recovered
+                task_result.add_done_callback(_retrieve_exception)
+                self._tasks[task_id] = task
+                self._unclaimed[task_id] = now
+                self._track(task_id, task_result)
+                self._mark_changed(task_id)
+                heapq.heappush(
+                    self._task_queue,
+                    (task.priority, self._seq, task.task_input, task_result),
+                )
+                self._seq += 1
+                count += 1
+            self._recovered += count
+            self._condition.notify_all()
+        return count
+
+    # Forget the recovered tasks which are not claimed in grace seconds or pass their deadlines,
+    # their task runners are finished or not recovered
+    # Return ids of these tasks which are not done yet, they should be cancelled by the caller
+    def drop_unclaimed(self, grace: float) -> List[str]:
+        now = time.time()
+        dropped = [
+            task_id
+            for task_id, recovered_at in self._unclaimed.items()
+            if now - recovered_at > grace or self._futures[task_id].priority[1] < now
+        ]
+        pending = []
+        for task_id in dropped:
+            del self._unclaimed[task_id]
+            task_result = self._futures[task_id]
+            if task_result.done():
+                del self._futures[task_id]
+            else:
+                pending.append(task_id)
+        return pending
+
+    # Save changed tasks to the store
+    async def flush(self):
+        if self._store is None or len(self._changed) == 0:
+            return
+        changed = self._changed
+        self._changed = set()
+        try:
+            await self._store.save(
+                {task_id: self._tasks.get(task_id, None) for task_id in changed}
+            )
+        except BaseException:
+            self._changed.update(changed)
+            raise
+
+    # Save changes of tasks in background, changes made while saving are saved in one batch
+    async def persist(self, retry_interval: float = 1):
+        if self._store is None:
+            return
+        try:
+            while True:
+                self._changed_event = Event()
+                if len(self._changed) == 0:
+                    await self._changed_event.wait()
+                try:
+                    await self.flush()
+                except Exception as e:
+                    _logger.exception(e)
+                    _logger.error("Failed to save the task queue, retrying")
+                    await sleep(retry_interval)
+        finally:
+            self._changed_event = None
+            with move_on_after(5, shield=True):
+                try:
+                    await self.flush()
+                except Exception as e:
+                    _logger.exception(e)
+
+    def stats(self) -> TaskQueueStats:
+        now = time.time()
+        queued_ages = [
+            now - task.queued_at
+            for task in self._tasks.values()
+            if task.status == "queued"
+        ]
+        dispatched_ages = [
+            now - task.dispatched_at
+            for task in self._tasks.values()
+            if task.status == "dispatched" and task.dispatched_at is not None
+        ]
+        return TaskQueueStats(
+            queued=len(queued_ages),
+            dispatched=len(dispatched_ages),
+            recovered=self._recovered,
+            unclaimed=len(self._unclaimed),
+            oldest_queued_age=max(queued_ages) if len(queued_ages) > 0 else None,
+            mean_queued_age=(
+                sum(queued_ages) / len(queued_ages) if len(queued_ages) > 0 else None
+            ),
+            oldest_dispatched_age=(
+                max(dispatched_ages) if len(dispatched_ages) > 0 else None
+            ),
+        )
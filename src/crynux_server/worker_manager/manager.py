@@ -1,63 +1,316 @@
 import json
 import logging
+import math
 import os
 import subprocess
+import time
+from collections import deque
 from contextlib import asynccontextmanager, contextmanager
-from typing import Dict, Optional
+from typing import Deque, Dict, Iterable, List, Optional, Set
 
 import psutil
-from anyio import Condition, fail_after, sleep
-
-from crynux_server.config import Config, get_config
-from crynux_server.models import TaskInput
-
-from .exchange import TaskExchange
+from anyio import (Condition, Event, create_memory_object_stream, fail_after,
+                   sleep)
+from anyio.streams.memory import (MemoryObjectReceiveStream,
+                                  MemoryObjectSendStream)
+from pydantic import BaseModel
+
+from crynux_server.config import Config, WorkerSupervisorConfig, get_config
+from crynux_server.models import ModelConfig, TaskInput, TaskProgress
+
+from .error import WorkerDisconnected
+from .exchange import TaskExchange, TaskQueueStats
+from .queue_store import TaskQueueStore
 from .task import TaskFuture
 from .utils import get_exe_head
 
 _logger = logging.getLogger(__name__)
 
 
+class WorkerSlotInfo(BaseModel):
+    slot: int
+    gpu: Optional[str] = None
+    worker_id: int
+    version: Optional[str] = None
+    pid: Optional[int] = None
+    alive: bool
+    standby: bool
+    restarts: int
+    last_exit_code: Optional[int] = None
+    # the worker exits too often and is not restarted any more
+    crash_loop: bool
+    running_tasks: List[str]
+    # cancelled tasks which are not stopped by the worker yet
+    cancelling_tasks: List[str] = []
+    loaded_models: List[str]
+    # whether models of the tasks are loaded in the worker when the tasks are routed to it
+    cache_hits: int
+    cache_misses: int
+
+
+# Progress of a running task reported by its worker
+class TaskProgressInfo(BaseModel):
+    task_id_commitment: str
+    slot: int
+    step: int
+    total: int
+    elapsed: float
+    images_done: int
+    # unix timestamp of the latest progress frame
+    updated_at: float
+    # steps per second
+    rate: float
+    # predicted seconds to finish the task, None before the first step is done
+    eta: Optional[float] = None
+    deadline: Optional[float] = None
+    # the task is predicted to finish after its deadline
+    deadline_miss: bool = False
+
+
+def make_task_progress_info(
+    slot: int, progress: TaskProgress, deadline: Optional[float] = None
+) -> TaskProgressInfo:
+    now = time.time()
+    rate = 0.0
+    eta = None
+    if progress.step > 0 and progress.elapsed > 0:
+        rate = progress.step / progress.elapsed
+        eta = max(progress.total - progress.step, 0) / rate
+    return TaskProgressInfo(
+        task_id_commitment=progress.task_id_commitment,
+        slot=slot,
+        step=progress.step,
+        total=progress.total,
+        elapsed=progress.elapsed,
+        images_done=progress.images_done,
+        updated_at=now,
+        rate=rate,
+        eta=eta,
+        deadline=deadline,
+        deadline_miss=eta is not None and deadline is not None and now + eta > deadline,
+    )
+
+
+# Latencies of recent tasks in seconds
+class LatencyStats(BaseModel):
+    count: int
+    mean: float
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+
+# Nearest-rank percentile of sorted values
+def _percentile(values: List[float], q: float) -> float:
+    index = max(math.ceil(q / 100 * len(values)) - 1, 0)
+    return values[index]
+
+
+# count is the number of all measured tasks, it defaults to the number of kept latencies
+def make_latency_stats(
+    latencies: Iterable[float], count: Optional[int] = None
+) -> Optional[LatencyStats]:
+    values = sorted(latencies)
+    if len(values) == 0:
+        return None
+    return LatencyStats(
+        count=count if count is not None else len(values),
+        mean=sum(values) / len(values),
+        p50=_percentile(values, 50),
+        p90=_percentile(values, 90),
+        p99=_percentile(values, 99),
+        max=values[-1],
+    )
+
+
+# A worker process and its connection state
+# Each slot runs on its own GPUs and executes one task at a time
+# A standby slot gets no tasks until it is promoted, see WorkerManager._promote_standby
+class WorkerSlot(object):
+    def __init__(
+        self, slot: int, gpu: Optional[str] = None, standby: bool = False
+    ) -> None:
+        self.slot = slot
+        self.gpu = gpu
+        self.standby = standby
+
+        self.process: Optional[subprocess.Popen] = None
+        self.restarts = 0
+        self.last_exit_code: Optional[int] = None
+        # monotonic time of recent exits of the worker process
+        self.exit_times: Deque[float] = deque()
+        self.next_restart: Optional[float] = None
+        self.crash_loop = False
+
+        self.worker_id = 0
+        self.version: Optional[str] = None
+        self.task_futures: Dict[str, TaskFuture] = {}
+        self.task_inputs: Dict[str, TaskInput] = {}
+        self.task_progress: Dict[str, TaskProgressInfo] = {}
+        # monotonic time when each task is cancelled, the worker is busy until it stops the task
+        self.cancelling: Dict[str, float] = {}
+        # the worker stops the task when receiving a cancel message, legacy workers don't
+        self.cancellable = False
+        self.cancel_sender: Optional[MemoryObjectSendStream[str]] = None
+        self.cancel_receiver: Optional[MemoryObjectReceiveStream[str]] = None
+        # set when the worker has no running task
+        self.idle: Optional[Event] = None
+
+        # ids of models loaded in the worker, see ModelConfig.to_model_id
+        self.loaded_models: Set[str] = set()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.worker_id > 0
+
+    @property
+    def busy(self) -> bool:
+        return len(self.task_futures) > 0 or len(self.cancelling) > 0
+
+    def info(self) -> WorkerSlotInfo:
+        return WorkerSlotInfo(
+            slot=self.slot,
+            gpu=self.gpu,
+            worker_id=self.worker_id,
+            version=self.version,
+            pid=self.process.pid if self.process is not None else None,
+            alive=self.process is not None and self.process.poll() is None,
+            standby=self.standby,
+            restarts=self.restarts,
+            last_exit_code=self.last_exit_code,
+            crash_loop=self.crash_loop,
+            running_tasks=list(self.task_futures.keys()),
+            cancelling_tasks=list(self.cancelling.keys()),
+            loaded_models=sorted(self.loaded_models),
+            cache_hits=self.cache_hits,
+            cache_misses=self.cache_misses,
+        )
+
+    def pop_task(self, task_id_commitment: str):
+        self.task_futures.pop(task_id_commitment, None)
+        self.task_inputs.pop(task_id_commitment, None)
+        self.task_progress.pop(task_id_commitment, None)
+
+    # The worker loads models of the inference task when executing it
+    def load_task_models(self, task_input: TaskInput):
+        if task_input.task.task_name != "inference":
+            return
+        model_ids = [model.to_model_id() for model in task_input.task.models]
+        for model_id in model_ids:
+            if model_id in self.loaded_models:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+        self.loaded_models.clear()
+        self.loaded_models.update(model_ids)
+
+
+def _kill_process_tree(pid: int):
+    try:
+        process = psutil.Process(pid)
+        for proc in process.children(recursive=True):
+            proc.kill()
+        process.kill()
+    except psutil.NoSuchProcess:
+        pass
+
+
 class WorkerManager(object):
-    def __init__(self, config: Optional[Config] = None) -> None:
+    def __init__(
+        self,
+        config: Optional[Config] = None,
+        queue_store: Optional[TaskQueueStore] = None,
+    ) -> None:
         if config is None:
             config = get_config()
         self.config = config
 
-        self._exchange = TaskExchange()
+        # queued tasks are kept in the queue store across restarts when it is provided
+        self._exchange = TaskExchange(queue_store)
 
         self._next_worker_id = 1
-        self._task_futures: Dict[str, TaskFuture] = {}
-        self._current_worker_id = 0
 
-        self._worker_process: Optional[subprocess.Popen] = None
+        # latencies of the recent dispatched tasks
+        self._dispatch_latencies: Deque[float] = deque(maxlen=1000)
+        self._dispatched = 0
+        # time from cancelling the running task to the worker being free
+        self._free_latencies: Deque[float] = deque(maxlen=1000)
+        self._cancelled = 0
 
-        self._version: Optional[str] = None
+        gpus: List[Optional[str]] = [None]
+        standby_gpus: List[Optional[str]] = []
+        self._gpu_env = "CUDA_VISIBLE_DEVICES"
+        if (
+            self.config.task_config is not None
+            and self.config.task_config.worker_pool is not None
+        ):
+            worker_pool = self.config.task_config.worker_pool
+            if len(worker_pool.gpus) > 0:
+                gpus = list(worker_pool.gpus)
+            if len(worker_pool.standby_gpus) > 0:
+                standby_gpus = list(worker_pool.standby_gpus)
+            else:
+                standby_gpus = gpus[: worker_pool.standby]
+            self._gpu_env = worker_pool.gpu_env
+        self._slots: Dict[int, WorkerSlot] = {
+            i: WorkerSlot(i, gpu) for i, gpu in enumerate(gpus)
+        }
+        # standby slots follow the active slots
+        for i, gpu in enumerate(standby_gpus):
+            slot = len(gpus) + i
+            self._slots[slot] = WorkerSlot(slot, gpu, standby=True)
+        self._workers: Dict[int, WorkerSlot] = {}
 
         self._connect_condition = Condition()
 
+        supervisor_config = None
+        if self.config.task_config is not None:
+            supervisor_config = getattr(self.config.task_config, "worker_supervisor", None)
+        if supervisor_config is None:
+            supervisor_config = WorkerSupervisorConfig()
+        self._supervisor_config = supervisor_config
+
+    # Number of workers executing tasks, standby workers are not counted
+    @property
+    def num_workers(self) -> int:
+        return sum(1 for slot in self._slots.values() if not slot.standby)
+
+    # Version of the connected workers, they are started from the same worker installation
     @property
     def version(self):
-        return self._version
+        for slot in sorted(self._slots):
+            if self._slots[slot].version is not None:
+                return self._slots[slot].version
+        return None
 
-    @contextmanager
-    def start(self):
+    def workers(self) -> List[WorkerSlotInfo]:
+        return [self._slots[slot].info() for slot in sorted(self._slots)]
+
+    def _pid_file(self, slot: int) -> str:
+        if self.config.task_config is not None:
+            worker_pid_file = self.config.task_config.worker_pid_file
+        else:
+            worker_pid_file = "crynux_worker.pid"
+        if slot == 0:
+            return worker_pid_file
+        base, ext = os.path.splitext(worker_pid_file)
+        return f"{base}.{slot}{ext}"
+
+    def _worker_envs(self, slot: WorkerSlot) -> Dict[str, str]:
         if self.config.task_config is not None:
-            script_dir = self.config.task_config.script_dir
             patch_url = self.config.task_config.worker_patch_url
             hf_cache_dir = self.config.task_config.hf_cache_dir
             external_cache_dir = self.config.task_config.external_cache_dir
             output_dir = self.config.task_config.output_dir
-            worker_pid_file = self.config.task_config.worker_pid_file
         else:
-            script_dir = ""
             patch_url = ""
             hf_cache_dir = ""
             external_cache_dir = ""
             output_dir = ""
-            worker_pid_file = "crynux_worker.pid"
 
-        args = get_exe_head(script_dir)
         envs = os.environ.copy()
         envs.update(
             {
@@ -65,7 +318,7 @@ class WorkerManager(object):
                 "cw_data_dir__models__huggingface": hf_cache_dir,
                 "cw_data_dir__models__external": external_cache_dir,
                 "cw_output_dir": output_dir,
-                "cw_pid_file": worker_pid_file
+                "cw_pid_file": self._pid_file(slot.slot)
             }
         )
         if (
@@ -81,90 +334,285 @@ class WorkerManager(object):
         ):
             envs["cw_proxy"] = self.config.task_config.proxy.model_dump_json()
 
+        # the worker tells its slot to the node when connecting
         node_url = f"ws://127.0.0.1:{self.config.server_port}/manager/v1/worker/"
+        if slot.slot > 0:
+            node_url += f"?slot={slot.slot}"
         envs["cw_node_url"] = node_url
 
+        if slot.gpu is not None:
+            envs[self._gpu_env] = slot.gpu
+
         log_config = {"dir": self.config.log.dir, "level": self.config.log.level}
         envs["cw_log"] = json.dumps(log_config)
+        return envs
+
+    def _start_worker(self, slot: WorkerSlot):
+        if self.config.task_config is not None:
+            script_dir = self.config.task_config.script_dir
+        else:
+            script_dir = ""
+        args = get_exe_head(script_dir)
+        envs = self._worker_envs(slot)
 
         # kill the old worker process if it is still alive
+        worker_pid_file = self._pid_file(slot.slot)
         if os.path.exists(worker_pid_file):
             with open(worker_pid_file, mode="r", encoding="utf-8") as f:
                 pid = int(f.read().strip())
             if psutil.pid_exists(pid):
-                process = psutil.Process(pid)
-                for proc in process.children(recursive=True):
-                    proc.kill()
-                process.kill()
+                _kill_process_tree(pid)
 
         p = subprocess.Popen(args=args, env=envs)
-        self._worker_process = p
-        
+        slot.process = p
+
         # Check if process is still alive immediately after start
         if p.poll() is not None:
             # Process has already terminated
-            raise RuntimeError(f"Worker process failed to start. Exit code: {p.returncode}")
-        
+            raise RuntimeError(
+                f"Worker process {slot.slot} failed to start. Exit code: {p.returncode}"
+            )
+
+    def _stop_worker(self, slot: WorkerSlot):
+        if slot.process is not None:
+            _kill_process_tree(slot.process.pid)
+            slot.process = None
+
+    @contextmanager
+    def start(self):
         try:
+            for slot in self._slots.values():
+                self._start_worker(slot)
             yield
         finally:
-            if self._worker_process is not None:
-                process = psutil.Process(self._worker_process.pid)
-                for proc in process.children(recursive=True):
-                    proc.kill()
-                process.kill()
-                self._worker_process = None
-
-    def is_worker_process_alive(self) -> bool:
+            for slot in self._slots.values():
+                self._stop_worker(slot)
+
+    # Restart the worker process of the slot, other workers keep running
+    # Tasks running on the worker are requeued when it disconnects
+    # Restarting a worker in a crash loop manually lets the supervisor restart it again
+    def restart_worker(self, slot: int):
+        worker_slot = self._slots[slot]
+        self._stop_worker(worker_slot)
+        worker_slot.restarts += 1
+        worker_slot.next_restart = None
+        if worker_slot.crash_loop:
+            worker_slot.crash_loop = False
+            worker_slot.exit_times.clear()
+        _logger.info(f"Restart worker process {slot}")
+        self._start_worker(worker_slot)
+
+    # Record the exit of the worker process and schedule its restart
+    def _on_worker_exit(self, slot: WorkerSlot, exit_code: int, now: float):
+        config = self._supervisor_config
+        slot.last_exit_code = exit_code
+        slot.exit_times.append(now)
+        while len(slot.exit_times) > 0 and now - slot.exit_times[0] > config.crash_loop_window:
+            slot.exit_times.popleft()
+        if len(slot.exit_times) >= config.crash_loop_exits:
+            slot.crash_loop = True
+            _logger.error(
+                f"Worker process {slot.slot} exited {len(slot.exit_times)} times in "
+                f"{config.crash_loop_window}s, last exit code {exit_code}, stop restarting it"
+            )
+            return
+        delay = min(
+            config.min_delay * 2 ** (len(slot.exit_times) - 1), config.max_delay
+        )
+        slot.next_restart = now + delay
+        _logger.warning(
+            f"Worker process {slot.slot} exited with code {exit_code}, restart it in {delay}s"
+        )
+
+    # Restart exited worker processes, and cancel queued tasks when all workers are in crash loops
+    async def check_workers(self):
+        now = time.monotonic()
+        for slot in self._slots.values():
+            if slot.process is None or slot.crash_loop:
+                continue
+            exit_code = slot.process.poll()
+            if exit_code is None:
+                continue
+            if slot.next_restart is None:
+                self._on_worker_exit(slot, exit_code, now)
+            if slot.next_restart is not None and now >= slot.next_restart:
+                try:
+                    self.restart_worker(slot.slot)
+                except RuntimeError as e:
+                    # the exit is recorded in the next check
+                    _logger.error(str(e))
+
+        # restart workers which don't stop their cancelled tasks in time
+        for slot in self._slots.values():
+            if any(
+                now - cancel_time > self._supervisor_config.cancel_timeout
+                for cancel_time in slot.cancelling.values()
+            ):
+                _logger.error(
+                    f"Worker {slot.slot} does not stop cancelled tasks in "
+                    f"{self._supervisor_config.cancel_timeout}s, restart it"
+                )
+                if slot.process is not None:
+                    try:
+                        self.restart_worker(slot.slot)
+                    except RuntimeError as e:
+                        _logger.error(str(e))
+                for task_id in list(slot.cancelling):
+                    self._worker_freed(slot, task_id)
+
+        started = [slot for slot in self._slots.values() if slot.process is not None]
+        if len(started) > 0 and all(slot.crash_loop for slot in started):
+            await self._exchange.cancel_tasks()
+
+        # recovered tasks whose task runners are finished or not recovered
+        for task_id in self._exchange.drop_unclaimed(self._supervisor_config.recover_grace):
+            _logger.info(f"Cancel recovered task {task_id} which is not claimed")
+            await self.cancel_task(task_id)
+
+    async def supervise(self):
+        while True:
+            await sleep(self._supervisor_config.interval)
+            await self.check_workers()
+
+    def is_worker_process_alive(self, slot: Optional[int] = None) -> bool:
         """
         Check if the worker process is still alive.
+        Check all worker processes if slot is None.
         Returns True if process is running, False otherwise.
         """
-        if self._worker_process is None:
-            return False
-        return self._worker_process.poll() is None
+        if slot is None:
+            slots = list(self._slots.values())
+        else:
+            slots = [self._slots[slot]]
+        return all(s.process is not None and s.process.poll() is None for s in slots)
 
-    def get_worker_process_exit_code(self) -> Optional[int]:
+    def get_worker_process_exit_code(self, slot: int = 0) -> Optional[int]:
         """
         Get the exit code of the worker process.
         Returns None if process is still running, otherwise returns the exit code.
         """
-        if self._worker_process is None:
+        process = self._slots[slot].process
+        if process is None:
             return None
-        return self._worker_process.poll()
-
-    async def connect(self, version: str) -> int:
+        return process.poll()
+
+    def _get_worker(self, worker_id: int) -> WorkerSlot:
+        assert worker_id in self._workers, f"Worker {worker_id} is disconnected"
+        return self._workers[worker_id]
+
+    async def connect(
+        self,
+        version: str,
+        slot: int = 0,
+        loaded_models: Optional[List[ModelConfig]] = None,
+        cancellable: bool = False,
+    ) -> int:
         worker_id = self._next_worker_id
         self._next_worker_id += 1
         async with self._connect_condition:
-            self._current_worker_id = worker_id
-            self._version = version
+            if slot not in self._slots:
+                # the worker is not started by the node
+                self._slots[slot] = WorkerSlot(slot)
+            worker_slot = self._slots[slot]
+            if worker_slot.connected:
+                self._workers.pop(worker_slot.worker_id, None)
+                await self._release_tasks(worker_slot)
+                await self._exchange.remove_worker(worker_slot.worker_id)
+            worker_slot.worker_id = worker_id
+            worker_slot.version = version
+            worker_slot.cancellable = cancellable
+            (
+                worker_slot.cancel_sender,
+                worker_slot.cancel_receiver,
+            ) = create_memory_object_stream(100, item_type=str)
+            worker_slot.loaded_models.clear()
+            if loaded_models is not None:
+                worker_slot.loaded_models.update(
+                    model.to_model_id() for model in loaded_models
+                )
+            self._workers[worker_id] = worker_slot
+            self._promote_standby()
             self._connect_condition.notify_all()
         return worker_id
 
-    async def disconnect(self, worker_id: int):
-        assert (
-            worker_id == self._current_worker_id
-        ), f"Worker {worker_id} is disconnected"
-        # cancel the worker's running task
-        for task_result in self._task_futures.values():
-            if not task_result.done():
+    # Swap a disconnected active slot with a connected standby slot on the same GPUs or on GPUs
+    # not used by any active slot, so that the standby worker gets tasks at once without waiting
+    # for the worker to restart. The disconnected slot becomes the standby slot when its worker
+    # connects again.
+    def _promote_standby(self):
+        for slot in self._slots.values():
+            if slot.standby or slot.connected:
+                continue
+            active_gpus = set(s.gpu for s in self._slots.values() if not s.standby)
+            for standby_slot in self._slots.values():
+                if (
+                    standby_slot.standby
+                    and standby_slot.connected
+                    and (
+                        standby_slot.gpu == slot.gpu
+                        or standby_slot.gpu not in active_gpus
+                    )
+                ):
+                    standby_slot.standby = False
+                    slot.standby = True
+                    _logger.info(
+                        f"Promote standby worker {standby_slot.slot} to replace worker {slot.slot}"
+                    )
+                    break
+
+    # Send running tasks of the disconnected worker to other workers if they are still before
+    # their deadlines, otherwise cancel them
+    async def _release_tasks(self, slot: WorkerSlot):
+        for task_id, task_result in list(slot.task_futures.items()):
+            if task_result.done():
+                continue
+            task_input = slot.task_inputs.get(task_id, None)
+            deadline = task_result.priority[1]
+            if (
+                task_input is not None
+                and task_result.requeues < self._supervisor_config.max_requeue
+                and deadline > time.time()
+            ):
+                task_result.requeues += 1
+                # the dispatch latency of the requeued task starts from now
+                task_result.send_time = time.monotonic()
+                await self._exchange.requeue(task_input, task_result)
+                _logger.info(f"Requeue task {task_id} of disconnected worker {slot.slot}")
+            else:
                 task_result.cancel()
-        self._task_futures.clear()
+        slot.task_futures.clear()
+        slot.task_inputs.clear()
+        slot.task_progress.clear()
+        # the worker is freed by disconnecting
+        for task_id in list(slot.cancelling):
+            self._worker_freed(slot, task_id)
+        if slot.idle is not None:
+            slot.idle.set()
+
+    async def disconnect(self, worker_id: int):
+        if worker_id not in self._workers:
+            # the slot has been taken by a new connection of the worker
+            return
+        worker_slot = self._workers[worker_id]
 
         async with self._connect_condition:
-            self._current_worker_id = 0
-            self._version = None
+            del self._workers[worker_id]
+            await self._exchange.remove_worker(worker_id)
+            worker_slot.worker_id = 0
+            worker_slot.version = None
+            self._promote_standby()
+            # requeue or cancel the worker's running task
+            await self._release_tasks(worker_slot)
             self._connect_condition.notify_all()
 
     async def is_connected(self) -> bool:
-        return self._current_worker_id > 0
+        return len(self._workers) > 0
 
     @asynccontextmanager
     async def wait_connected(self, timeout: Optional[float] = None):
         with fail_after(timeout):
             async with self._connect_condition:
-                while self._current_worker_id == 0:
+                while len(self._workers) == 0:
                     await self._connect_condition.wait()
                 yield
 
@@ -174,33 +622,166 @@ class WorkerManager(object):
             await self._connect_condition.wait()
             yield
 
-    async def send_task(self, input: TaskInput):
-        return await self._exchange.send_task(input)
-
+    # Tasks are sent to the worker by priority, see task_priority
+    async def send_task(
+        self, input: TaskInput, deadline: Optional[float] = None, fee: int = 0
+    ):
+        return await self._exchange.send_task(input, deadline=deadline, fee=fee)
+
+    # Dispatch the tasks which were not done before the restart again,
+    # they are claimed by the recovered task runners sending them
+    async def recover_queue(self):
+        count = await self._exchange.recover()
+        if count > 0:
+            _logger.info(f"Recover {count} tasks of the task queue")
+
+    # Save changes of the task queue to the queue store in background
+    async def persist_queue(self):
+        await self._exchange.persist()
+
+    def queue_stats(self) -> TaskQueueStats:
+        return self._exchange.stats()
+
+    def _on_task_done(self, slot: WorkerSlot, task_id_commitment: str):
+        slot.pop_task(task_id_commitment)
+        if not slot.busy and slot.idle is not None:
+            slot.idle.set()
+
+    # Each worker gets the next task only when it has finished its running task,
+    # so that tasks are routed to idle workers
+    # Raise WorkerDisconnected when the worker is disconnected while waiting
     async def get_task(self, worker_id: int):
         await sleep(0)
-        assert (
-            worker_id == self._current_worker_id
-        ), f"Worker {worker_id} is disconnected"
-        task_input, task_future = await self._exchange.get_task()
+        worker_slot = self._get_worker(worker_id)
+        # standby workers wait until they are promoted
+        if worker_slot.standby:
+            async with self._connect_condition:
+                while worker_slot.standby and worker_id in self._workers:
+                    await self._connect_condition.wait()
+            if worker_id not in self._workers:
+                raise WorkerDisconnected(f"Worker {worker_id} is disconnected")
+        while worker_slot.busy:
+            if worker_slot.idle is None or worker_slot.idle.is_set():
+                worker_slot.idle = Event()
+            await worker_slot.idle.wait()
+            if worker_id not in self._workers:
+                raise WorkerDisconnected(f"Worker {worker_id} is disconnected")
+
+        task_input, task_future = await self._exchange.get_task(
+            worker_id, worker_slot.loaded_models
+        )
+        worker_slot.load_task_models(task_input)
         task_id_commitment = task_input.task.task_id
-        self._task_futures[task_id_commitment] = task_future
+        worker_slot.task_futures[task_id_commitment] = task_future
+        worker_slot.task_inputs[task_id_commitment] = task_input
+        task_future.add_done_callback(
+            lambda _: self._on_task_done(worker_slot, task_id_commitment)
+        )
 
         return task_input, task_future
 
+    # Called after the task frame is sent to the worker
+    def task_dispatched(self, task_future: TaskFuture):
+        self._dispatch_latencies.append(time.monotonic() - task_future.send_time)
+        self._dispatched += 1
+
+    # Latency from sending the task to the exchange to sending the task frame to the worker
+    def dispatch_stats(self) -> Optional[LatencyStats]:
+        return make_latency_stats(self._dispatch_latencies, self._dispatched)
+
+    # Time from cancelling the running task to the worker being free for the next task
+    def cancel_stats(self) -> Optional[LatencyStats]:
+        return make_latency_stats(self._free_latencies, self._cancelled)
+
+    # Cancel the queued or running task
+    # The worker running the task is asked to stop it, and gets no new task until it stops.
+    # Legacy workers can't be asked, they are busy until they send the result of the task
+    async def cancel_task(self, task_id_commitment: str):
+        if await self._exchange.remove_task(task_id_commitment):
+            return
+        for slot in self._slots.values():
+            if task_id_commitment not in slot.task_futures:
+                continue
+            task_future = slot.task_futures[task_id_commitment]
+            if slot.connected:
+                slot.cancelling[task_id_commitment] = time.monotonic()
+                if slot.cancellable and slot.cancel_sender is not None:
+                    slot.cancel_sender.send_nowait(task_id_commitment)
+                _logger.info(f"Cancel task {task_id_commitment} on worker {slot.slot}")
+            task_future.cancel()
+            return
+
+    def _worker_freed(self, slot: WorkerSlot, task_id_commitment: str):
+        cancel_time = slot.cancelling.pop(task_id_commitment, None)
+        if cancel_time is not None:
+            self._free_latencies.append(time.monotonic() - cancel_time)
+            self._cancelled += 1
+        if not slot.busy and slot.idle is not None:
+            slot.idle.set()
+
+    # Called when the worker reports the result of a task,
+    # return True if the task is cancelled before and the worker stops it now
+    def finish_cancelled(self, worker_id: int, task_id_commitment: str) -> bool:
+        worker_slot = self._get_worker(worker_id)
+        if task_id_commitment not in worker_slot.cancelling:
+            return False
+        self._worker_freed(worker_slot, task_id_commitment)
+        _logger.info(f"Worker {worker_slot.slot} stops cancelled task {task_id_commitment}")
+        return True
+
+    def cancel_requests(self, worker_id: int) -> MemoryObjectReceiveStream[str]:
+        worker_slot = self._get_worker(worker_id)
+        assert worker_slot.cancel_receiver is not None
+        return worker_slot.cancel_receiver
+
+    # Progress frames of tasks which are not running on the worker are ignored
+    def update_progress(self, worker_id: int, progress: TaskProgress):
+        worker_slot = self._get_worker(worker_id)
+        task_future = worker_slot.task_futures.get(progress.task_id_commitment, None)
+        if task_future is None:
+            return
+        deadline = task_future.priority[1]
+        worker_slot.task_progress[progress.task_id_commitment] = make_task_progress_info(
+            worker_slot.slot,
+            progress,
+            deadline=deadline if math.isfinite(deadline) else None,
+        )
+
+    def get_task_progress(self, task_id_commitment: str) -> Optional[TaskProgressInfo]:
+        for slot in self._slots.values():
+            if task_id_commitment in slot.task_progress:
+                return slot.task_progress[task_id_commitment]
+        return None
+
+    def task_progress(self) -> List[TaskProgressInfo]:
+        res = []
+        for slot in sorted(self._slots):
+            res.extend(self._slots[slot].task_progress.values())
+        return res
+
+    # Models loaded in the worker reported by the worker
+    async def update_loaded_models(self, worker_id: int, models: List[ModelConfig]):
+        worker_slot = self._get_worker(worker_id)
+        worker_slot.loaded_models.clear()
+        worker_slot.loaded_models.update(model.to_model_id() for model in models)
+        await self._exchange.refresh()
+
+    # None is yielded for tasks not running on the worker, like cancelled or requeued ones
     @contextmanager
     def task_future(self, worker_id: int, task_id_commitment: str):
-        assert (
-            worker_id == self._current_worker_id
-        ), f"Worker {worker_id} is disconnected"
-        assert task_id_commitment in self._task_futures, f"No such task future {task_id_commitment}"
-
-        fut = self._task_futures[task_id_commitment]
+        worker_slot = self._get_worker(worker_id)
+        fut = worker_slot.task_futures.get(task_id_commitment, None)
+        if fut is None:
+            _logger.info(
+                f"Ignore the result of task {task_id_commitment} not running on worker {worker_slot.slot}"
+            )
+            yield None
+            return
         try:
             yield fut
         finally:
             if fut.done():
-                del self._task_futures[task_id_commitment]
+                worker_slot.pop_task(task_id_commitment)
 
 _default_worker_manager: Optional[WorkerManager] = None
 
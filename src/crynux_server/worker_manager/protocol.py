@@ -0,0 +1,76 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+import msgpack
+
+# Message frames between the node and workers
+#
+# The protocol is negotiated in the version message: the worker sends the protocols it supports
+# in "protocols" by preference, and the node replies the chosen one in "protocol".
+# Connections are kept alive by websocket ping/pong frames of the server, and the worker gets
+# cancel messages to stop its running task, see models.TaskCancel.
+# Workers which do not send "protocols" use the legacy protocol, which is json/1 with
+# empty text frames sent every second as keepalive.
+
+Message = Dict[str, Any]
+
+
+class WorkerCodec(ABC):
+    name: str
+    # whether messages are sent in binary frames or text frames
+    binary: bool
+
+    @abstractmethod
+    def encode(self, msg: Message) -> bytes | str: ...
+
+    @abstractmethod
+    def decode(self, data: bytes | str) -> Message: ...
+
+
+class JsonCodec(WorkerCodec):
+    name = "json/1"
+    binary = False
+
+    def encode(self, msg: Message) -> str:
+        return json.dumps(msg)
+
+    def decode(self, data: bytes | str) -> Message:
+        return json.loads(data)
+
+
+class MsgpackCodec(WorkerCodec):
+    name = "msgpack/1"
+    binary = True
+
+    def encode(self, msg: Message) -> bytes:
+        return msgpack.packb(msg, use_bin_type=True)  # type: ignore
+
+    def decode(self, data: bytes | str) -> Message:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return msgpack.unpackb(data, raw=False)
+
+
+_codecs: Dict[str, WorkerCodec] = {
+    codec.name: codec for codec in [MsgpackCodec(), JsonCodec()]
+}
+
+supported_protocols: List[str] = list(_codecs.keys())
+
+
+# Choose the first protocol offered by the worker which is supported by the node
+# Return None for legacy workers
+def negotiate_protocol(offered: Optional[List[str]]) -> Optional[str]:
+    if offered is None:
+        return None
+    for name in offered:
+        if name in _codecs:
+            return name
+    return None
+
+
+def get_codec(protocol: Optional[str]) -> WorkerCodec:
+    if protocol is None:
+        return _codecs["json/1"]
+    return _codecs[protocol]
@@ -0,0 +1,117 @@
+import json
+import math
+from abc import ABC, abstractmethod
+from typing import Dict, List, Literal, Optional, Tuple
+
+import sqlalchemy as sa
+from pydantic import BaseModel
+
+from crynux_server import db
+from crynux_server.db import models as db_models
+from crynux_server.models import TaskInput
+
+
+# A task in the task exchange which is not done yet
+class QueuedTask(BaseModel):
+    task_input: TaskInput
+    priority: Tuple[int, float, int]
+    status: Literal["queued", "dispatched"] = "queued"
+    # timestamp when the task is sent to the exchange
+    queued_at: float
+    # timestamp when the task is sent to a worker
+    dispatched_at: Optional[float] = None
+
+    @property
+    def task_id(self) -> str:
+        return self.task_input.task.task_id
+
+
+# Persistent queue of the task exchange, so that pending tasks are dispatched again after restarts
+class TaskQueueStore(ABC):
+    # Tasks which are not done, in the order they are sent
+    @abstractmethod
+    async def load(self) -> List[QueuedTask]: ...
+
+    # Save changes of tasks, None means the task is done and removed
+    @abstractmethod
+    async def save(self, tasks: Dict[str, Optional[QueuedTask]]): ...
+
+
+class MemoryTaskQueueStore(TaskQueueStore):
+    def __init__(self) -> None:
+        self._tasks: Dict[str, QueuedTask] = {}
+
+    async def load(self) -> List[QueuedTask]:
+        tasks = sorted(self._tasks.values(), key=lambda task: task.queued_at)
+        return [task.model_copy(deep=True) for task in tasks]
+
+    async def save(self, tasks: Dict[str, Optional[QueuedTask]]):
+        for task_id, task in tasks.items():
+            if task is None:
+                self._tasks.pop(task_id, None)
+            else:
+                self._tasks[task_id] = task.model_copy(deep=True)
+
+
+# infinite deadlines are saved as null in json
+def _dump_priority(priority: Tuple[int, float, int]) -> str:
+    kind, deadline, fee = priority
+    return json.dumps([kind, deadline if math.isfinite(deadline) else None, fee])
+
+
+def _load_priority(priority: str) -> Tuple[int, float, int]:
+    kind, deadline, fee = json.loads(priority)
+    return (kind, deadline if deadline is not None else math.inf, fee)
+
+
+class DbTaskQueueStore(TaskQueueStore):
+    async def load(self) -> List[QueuedTask]:
+        async with db.session_scope() as sess:
+            q = sa.select(db_models.TaskQueueEntry).order_by(
+                db_models.TaskQueueEntry.queued_at, db_models.TaskQueueEntry.id
+            )
+            entries = (await sess.scalars(q)).all()
+            return [
+                QueuedTask(
+                    task_input=TaskInput.model_validate_json(entry.task_input),
+                    priority=_load_priority(entry.priority),
+                    status=entry.status,
+                    queued_at=entry.queued_at,
+                    dispatched_at=entry.dispatched_at,
+                )
+                for entry in entries
+            ]
+
+    async def save(self, tasks: Dict[str, Optional[QueuedTask]]):
+        if len(tasks) == 0:
+            return
+        async with db.session_scope() as sess:
+            q = sa.select(db_models.TaskQueueEntry).where(
+                db_models.TaskQueueEntry.task_id.in_(list(tasks))
+            )
+            entries = {
+                entry.task_id: entry for entry in (await sess.scalars(q)).all()
+            }
+            for task_id, task in tasks.items():
+                entry = entries.get(task_id, None)
+                if task is None:
+                    if entry is not None:
+                        await sess.delete(entry)
+                elif entry is None:
+                    sess.add(
+                        db_models.TaskQueueEntry(
+                            task_id=task_id,
+                            task_input=task.task_input.model_dump_json(),
+                            priority=_dump_priority(task.priority),
+                            status=task.status,
+                            queued_at=task.queued_at,
+                            dispatched_at=task.dispatched_at,
+                        )
+                    )
+                else:
+                    entry.task_input = task.task_input.model_dump_json()
+                    entry.priority = _dump_priority(task.priority)
+                    entry.status = task.status
+                    entry.queued_at = task.queued_at
+                    entry.dispatched_at = task.dispatched_at
+            await sess.commit()
@@ -1,5 +1,7 @@
 import asyncio
-from typing import Any, Callable
+import math
+import time
+from typing import Any, Callable, Tuple
 
 from .error import TaskCancelled
 
@@ -7,6 +9,12 @@ class TaskFuture(object):
     def __init__(self) -> None:
         loop = asyncio.get_running_loop()
         self._future = loop.create_future()
+        # when the task is sent to the exchange, used to measure the dispatch latency
+        self.send_time = time.monotonic()
+        # set by the exchange, see task_priority
+        self.priority: Tuple[int, float, int] = (0, math.inf, 0)
+        # times the task is sent to the exchange again after its worker exited
+        self.requeues = 0
 
     def set_result(self, result):
         if not self._future.cancelled():
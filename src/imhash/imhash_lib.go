@@ -34,6 +34,15 @@ func imagePHash(file io.Reader) (string, error) {
 	return "0x" + hex.EncodeToString(bs), nil
 }
 
+func imageFilePHash(filename string) (string, error) {
+	file, err := os.Open(filename)
+	if err != nil {
+		return "", err
+	}
+	defer file.Close()
+	return imagePHash(file)
+}
+
 //export getPHash
 func getPHash(self *C.PyObject, args *C.PyObject) *C.PyObject {
 	var obj *C.PyObject
@@ -43,16 +52,14 @@ func getPHash(self *C.PyObject, args *C.PyObject) *C.PyObject {
 	pyFileBytes := C.PyUnicode_AsUTF8String(obj)
 	cFilename := C.PyBytes_AsString(pyFileBytes)
 	filename := C.GoString(cFilename)
-	file, err := os.Open(filename)
-	if err != nil {
-		cErrstr := C.CString(err.Error())
-		pyErrStr := C.PyUnicode_FromString(cErrstr)
-		C.PyErr_SetObject(C.PyExc_RuntimeError, pyErrStr)
-		C.free(unsafe.Pointer(cErrstr))
-		return nil
-	}
-	defer file.Close()
-	hash, err := imagePHash(file)
+	C.Py_DecRef(pyFileBytes)
+
+	// Release the GIL when decoding and hashing the image,
+	// so images can be hashed by multiple python threads in parallel
+	tstate := C.PyEval_SaveThread()
+	hash, err := imageFilePHash(filename)
+	C.PyEval_RestoreThread(tstate)
+
 	if err != nil {
 		cErrstr := C.CString(err.Error())
 		pyErrStr := C.PyUnicode_FromString(cErrstr)
@@ -64,7 +71,6 @@ func getPHash(self *C.PyObject, args *C.PyObject) *C.PyObject {
 	ret := C.PyUnicode_FromString(cRetstr)
 
 	C.free(unsafe.Pointer(cRetstr))
-	C.Py_DecRef(pyFileBytes)
 
 	return ret
 }
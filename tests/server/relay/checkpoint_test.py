@@ -0,0 +1,37 @@
+import httpx
+import pytest
+from eth_account import Account
+
+from crynux_server.relay import WebRelay
+
+
+def make_relay(handler) -> WebRelay:
+    relay = WebRelay(base_url="http://relay", privkey=Account.create().key.hex())
+    relay.client = httpx.AsyncClient(
+        base_url="http://relay", transport=httpx.MockTransport(handler)
+    )
+    return relay
+
+
+async def test_checkpoint_hash():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.method == "HEAD"
+        return httpx.Response(200, headers={"X-Checkpoint-Hash": "ab" * 32})
+
+    relay = make_relay(handler)
+    assert await relay.get_checkpoint_hash(b"\x01" * 32) == "ab" * 32
+
+
+@pytest.mark.parametrize("status_code", [404, 405, 501])
+async def test_checkpoint_hash_unsupported(status_code: int):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(status_code)
+
+    # the checkpoint is downloaded and hashed instead, and the relay is not asked again
+    relay = make_relay(handler)
+    assert await relay.get_checkpoint_hash(b"\x01" * 32) is None
+    assert await relay.get_checkpoint_hash(b"\x02" * 32) is None
+    assert len(requests) == 1
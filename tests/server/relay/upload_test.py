@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+from typing import List
+
+import httpx
+import pytest
+from eth_account import Account
+from web3 import Web3
+
+from crynux_server.relay import RelayError, WebRelay
+from crynux_server.relay.sign import sort_dict
+
+
+def recover_signer(input, timestamp: str, signature: str) -> str:
+    input_bytes = json.dumps(
+        sort_dict(input), ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+    data_hash = Web3.keccak(input_bytes + timestamp.encode("utf-8"))
+    sig = bytearray(bytes.fromhex(signature[2:]))
+    sig[-1] += 27
+    return Account._recover_hash(data_hash, signature=bytes(sig))
+
+
+# A fake relay which supports chunked upload, and drops the connection of some chunks
+class FakeUploadRelay(object):
+    def __init__(self, fail_times: int, stuck: bool = False, address: str = "") -> None:
+        self.fail_times = fail_times
+        # the address of the node, which signs the chunks
+        self.address = address
+        # the offset of uploaded chunks is not advanced
+        self.stuck = stuck
+        self.files: List[bytearray] = []
+        self.sizes: List[int] = []
+        self.completed = False
+        self.put_count = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path.endswith("/results/uploads"):
+            files = json.loads(request.content)["files"]
+            if len(self.files) == 0:
+                self.files = [bytearray() for _ in files]
+                self.sizes = [f["size"] for f in files]
+            offsets = [len(f) for f in self.files]
+            return httpx.Response(
+                200, json={"message": "success", "data": {"upload_id": "1", "offsets": offsets}}
+            )
+        elif path.endswith("/complete"):
+            assert [len(f) for f in self.files] == self.sizes
+            self.completed = True
+            return httpx.Response(200, json={"message": "success", "data": None})
+        elif request.method == "PUT":
+            self.put_count += 1
+            index = int(path.split("/")[-1])
+            params = request.url.params
+            offset = int(params["offset"])
+            assert params["hash"] == "0x" + hashlib.sha256(request.content).hexdigest()
+            input = {
+                "task_id_commitment": path.split("/")[3],
+                "upload_id": path.split("/")[-2],
+                "index": str(index),
+                "offset": str(offset),
+                "hash": params["hash"],
+            }
+            assert recover_signer(input, params["timestamp"], params["signature"]) == self.address
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise httpx.WriteError("connection dropped")
+            data = self.files[index]
+            if self.stuck:
+                return httpx.Response(
+                    200, json={"message": "success", "data": {"offset": offset}}
+                )
+            data[offset:] = request.content
+            return httpx.Response(
+                200, json={"message": "success", "data": {"offset": len(data)}}
+            )
+        return httpx.Response(404)
+
+
+def make_files(tmp_path, sizes: List[int]) -> List[str]:
+    files = []
+    for i, size in enumerate(sizes):
+        filename = os.path.join(tmp_path, f"{i}.png")
+        with open(filename, mode="wb") as f:
+            f.write(os.urandom(size))
+        files.append(filename)
+    return files
+
+
+def make_relay(handler, chunk_size: int) -> WebRelay:
+    account = Account.create()
+    if isinstance(handler, FakeUploadRelay):
+        handler.address = account.address
+    relay = WebRelay(
+        base_url="http://relay",
+        privkey=account.key.hex(),
+        upload_chunk_size=chunk_size,
+    )
+    relay.client = httpx.AsyncClient(
+        base_url="http://relay", transport=httpx.MockTransport(handler)
+    )
+    return relay
+
+
+async def test_chunked_upload_with_retry(tmp_path):
+    files = make_files(tmp_path, [2500, 1000])
+    fake = FakeUploadRelay(fail_times=1)
+    relay = make_relay(fake, chunk_size=1000)
+    relay._upload_chunk_retries = 2
+
+    progresses = []
+    await relay.upload_task_result(
+        b"\x01" * 32, files, progress=lambda u, t: progresses.append((u, t))
+    )
+
+    assert fake.completed
+    for filename, data in zip(files, fake.files):
+        with open(filename, mode="rb") as f:
+            assert f.read() == bytes(data)
+    # 4 chunks and a retried one
+    assert fake.put_count == 5
+    assert progresses[0] == (0, 3500)
+    assert progresses[-1] == (3500, 3500)
+    await relay.close()
+
+
+async def test_chunked_upload_resume(tmp_path):
+    files = make_files(tmp_path, [2500])
+    fake = FakeUploadRelay(fail_times=0)
+    relay = make_relay(fake, chunk_size=1000)
+
+    # upload the first 2 chunks before the connection is lost
+    fake.files = [bytearray(open(files[0], "rb").read()[:2000])]
+    fake.sizes = [2500]
+
+    progresses = []
+    await relay.upload_task_result(
+        b"\x01" * 32, files, progress=lambda u, t: progresses.append((u, t))
+    )
+
+    assert fake.completed
+    assert fake.put_count == 1
+    assert progresses == [(2000, 2500), (2500, 2500)]
+    with open(files[0], mode="rb") as f:
+        assert f.read() == bytes(fake.files[0])
+    await relay.close()
+
+
+async def test_chunked_upload_stuck_offset(tmp_path):
+    files = make_files(tmp_path, [2500])
+    fake = FakeUploadRelay(fail_times=0, stuck=True)
+    relay = make_relay(fake, chunk_size=1000)
+
+    with pytest.raises(RelayError):
+        await relay.upload_task_result(b"\x01" * 32, files)
+    assert fake.put_count == 1
+    assert not fake.completed
+    await relay.close()
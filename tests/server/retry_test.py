@@ -0,0 +1,108 @@
+import time
+
+import httpx
+import pytest
+from tenacity import AsyncRetrying, stop_after_attempt
+
+from crynux_server.relay.circuit_breaker import (CircuitBreaker,
+                                                 CircuitBreakerTransport,
+                                                 CircuitOpenError)
+from crynux_server.relay.exceptions import RelayError
+from crynux_server.retry import RetryPolicy, classify_error
+from crynux_server.worker_manager import TaskExecutionError, TaskInvalid
+
+
+def test_classify_error():
+    assert classify_error(RelayError(502, "getTask", "bad gateway")) == "transient"
+    assert classify_error(RelayError(429, "getTask", "too many requests")) == "rate_limited"
+    assert classify_error(RelayError(400, "getTask", "bad request")) == "fatal"
+    assert classify_error(httpx.ReadTimeout("timeout")) == "timeout"
+    assert classify_error(httpx.ConnectError("refused")) == "transient"
+    assert classify_error(TaskExecutionError("oom")) == "worker"
+    assert classify_error(TaskInvalid("invalid args")) == "fatal"
+
+
+def test_retry_delay():
+    policy = RetryPolicy(base_delay=1, max_delay=30, jitter=0)
+    assert policy.get_delay("transient", 1) == 1
+    assert policy.get_delay("transient", 3) == 4
+    assert policy.get_delay("transient", 10) == 30
+    assert policy.get_delay("rate_limited", 1) == 5
+    assert policy.get_delay("fatal", 1) == 30
+
+    policy = RetryPolicy(jitter=0.5)
+    for _ in range(10):
+        assert 4 <= policy.get_delay("transient", 4) <= 8
+
+    # never wait beyond the deadline
+    deadline = time.time() + 2
+    policy = RetryPolicy(jitter=0, deadline=lambda: deadline)
+    assert policy.get_delay("fatal", 1) <= 2
+    assert not policy.deadline_passed()
+
+    # wait at least base_delay after the deadline, and stop retrying
+    deadline = time.time() - 10
+    assert policy.get_delay("transient", 3) == 1
+    assert policy.deadline_passed()
+
+
+async def test_retry_stats():
+    policy = RetryPolicy(base_delay=0.01, jitter=0)
+    calls = 0
+
+    with pytest.raises(RelayError):
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(3),
+            wait=policy.wait,
+            before_sleep=policy.before_sleep,
+            reraise=True,
+        ):
+            with attempt:
+                calls += 1
+                raise RelayError(503, "getTask", "unavailable")
+
+    assert calls == 3
+    assert policy.stats.retries == 2
+    assert policy.stats.total_wait == pytest.approx(0.03)
+    assert policy.stats.last_error_class == "transient"
+
+
+async def test_circuit_breaker():
+    responses = [500, 500, 200]
+
+    def handler(request: httpx.Request):
+        return httpx.Response(responses.pop(0))
+
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    client = httpx.AsyncClient(
+        base_url="http://relay",
+        transport=CircuitBreakerTransport(httpx.MockTransport(handler), breaker),
+    )
+    async with client:
+        assert (await client.get("/")).status_code == 500
+        assert (await client.get("/")).status_code == 500
+        assert breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            await client.get("/")
+
+        time.sleep(0.1)
+        assert breaker.state == "half_open"
+        assert (await client.get("/")).status_code == 200
+        assert breaker.state == "closed"
+
+
+async def test_retry_stop_after_deadline():
+    deadline = time.time() + 0.1
+    policy = RetryPolicy(base_delay=0.05, jitter=0, deadline=lambda: deadline)
+    calls = 0
+
+    with pytest.raises(RelayError):
+        async for attempt in AsyncRetrying(
+            stop=policy.stop, wait=policy.wait, reraise=True
+        ):
+            with attempt:
+                calls += 1
+                raise RelayError(500, "getTask", "relay is down")
+
+    # no busy loop after the deadline
+    assert 2 <= calls <= 4
@@ -0,0 +1,173 @@
+import secrets
+from datetime import datetime
+
+from typing import List, Optional
+
+from anyio import Event, create_task_group, fail_after, sleep
+
+from crynux_server import models
+from crynux_server.config import AdmissionConfig
+from crynux_server.task import (MemoryDownloadTaskStateCache,
+                                MemoryInferenceTaskStateCache,
+                                MockInferenceTaskRunner, TaskSystem)
+
+
+class CancelMockInferenceTaskRunner(MockInferenceTaskRunner):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cancelled = False
+
+    async def cancel_task(self):
+        self.cancelled = True
+
+
+class FailMockInferenceTaskRunner(CancelMockInferenceTaskRunner):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.start_time = datetime.now()
+
+    async def get_task(self):
+        task = await super().get_task()
+        task.start_time = self.start_time
+        return task
+
+    async def execute_task(self):
+        raise RuntimeError("execute task error")
+
+
+class EndMockInferenceTaskRunner(MockInferenceTaskRunner):
+    async def get_task(self):
+        task = await super().get_task()
+        if self._state is not None and len(self.state.files) > 0:
+            task.status = models.InferenceTaskStatus.EndSuccess
+        return task
+
+
+class OrderMockInferenceTaskRunner(MockInferenceTaskRunner):
+    def __init__(self, *args, order: List[int], release: Optional[Event] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.order = order
+        self.release = release
+
+    async def run(self, interval: float = 1):
+        self.order.append(self._timeout)
+        if self.release is not None:
+            await self.release.wait()
+
+
+def make_task_system(
+    inference_state_cache,
+    retry: bool = False,
+    admission_config: AdmissionConfig = AdmissionConfig(
+        max_inference_tasks=1, min_remaining_time=30
+    ),
+) -> TaskSystem:
+    return TaskSystem(
+        inference_state_cache=inference_state_cache,
+        download_state_cache=MemoryDownloadTaskStateCache(),
+        contracts=object(),  # type: ignore
+        relay=object(),  # type: ignore
+        retry=retry,
+        poll_interval=0.1,
+        admission_config=admission_config,
+    )
+
+
+async def test_reject_task_without_enough_time():
+    cache = MemoryInferenceTaskStateCache()
+    system = make_task_system(cache)
+
+    task_id_commitment = secrets.token_bytes(32)
+    runner = CancelMockInferenceTaskRunner(
+        task_id_commitment=task_id_commitment,
+        state_cache=cache,
+        contracts=object(),  # type: ignore
+        timeout=10,
+    )
+    system._inference_runners[task_id_commitment] = runner  # type: ignore
+    await system._run_inference_task(task_id_commitment)
+
+    assert runner.cancelled
+    state = await cache.load(task_id_commitment)
+    assert state.status == models.InferenceTaskStatus.EndAborted
+
+    metrics = system.metrics()
+    assert metrics.admission["inference"].rejected == 1
+    assert metrics.admission["inference"].running == 0
+    assert metrics.inference_tasks == 0
+
+
+async def test_task_fails_after_deadline():
+    cache = MemoryInferenceTaskStateCache()
+    system = make_task_system(
+        cache,
+        retry=True,
+        admission_config=AdmissionConfig(max_inference_tasks=2, min_remaining_time=0),
+    )
+
+    failed_id = secrets.token_bytes(32)
+    failed = FailMockInferenceTaskRunner(
+        task_id_commitment=failed_id,
+        state_cache=cache,
+        contracts=object(),  # type: ignore
+        timeout=1,
+    )
+    done_id = secrets.token_bytes(32)
+    done = EndMockInferenceTaskRunner(
+        task_id_commitment=done_id,
+        state_cache=cache,
+        contracts=object(),  # type: ignore
+    )
+    system._inference_runners[failed_id] = failed  # type: ignore
+    system._inference_runners[done_id] = done  # type: ignore
+
+    # the failed task stops retrying after its deadline, and is aborted alone
+    with fail_after(10):
+        async with create_task_group() as tg:
+            tg.start_soon(system._run_inference_task, failed_id)
+            tg.start_soon(system._run_inference_task, done_id)
+
+    assert failed.cancelled
+    state = await cache.load(failed_id)
+    assert state.status == models.InferenceTaskStatus.EndAborted
+    state = await cache.load(done_id)
+    assert state.status == models.InferenceTaskStatus.EndSuccess
+    assert system.metrics().inference_tasks == 0
+
+
+async def test_admit_task_by_deadline():
+    cache = MemoryInferenceTaskStateCache()
+    system = make_task_system(
+        cache,
+        admission_config=AdmissionConfig(max_inference_tasks=1, min_remaining_time=0),
+    )
+
+    order: List[int] = []
+    release = Event()
+
+    async def run_task(timeout: int, release: Optional[Event] = None):
+        task_id_commitment = secrets.token_bytes(32)
+        runner = OrderMockInferenceTaskRunner(
+            task_id_commitment=task_id_commitment,
+            state_cache=cache,
+            contracts=object(),  # type: ignore
+            timeout=timeout,
+            order=order,
+            release=release,
+        )
+        system._inference_runners[task_id_commitment] = runner  # type: ignore
+        await system._run_inference_task(task_id_commitment)
+
+    with fail_after(5):
+        async with create_task_group() as tg:
+            tg.start_soon(run_task, 900, release)
+            await sleep(0.1)
+            # the later created task with the earlier deadline is admitted first
+            tg.start_soon(run_task, 600)
+            await sleep(0.1)
+            tg.start_soon(run_task, 300)
+            await sleep(0.1)
+            assert system.metrics().admission["inference"].waiting == 2
+            release.set()
+
+    assert order == [900, 300, 600]
@@ -0,0 +1,114 @@
+import os
+import shutil
+
+import pytest
+from anyio import create_task_group
+
+from crynux_server.task.checkpoint_cache import CheckpointCache, hash_archive
+
+
+def make_checkpoint(dirname: str, content: bytes) -> str:
+    checkpoint_dir = os.path.join(dirname, "checkpoint")
+    os.makedirs(os.path.join(checkpoint_dir, "sub"))
+    with open(os.path.join(checkpoint_dir, "model.safetensors"), mode="wb") as f:
+        f.write(content)
+    with open(os.path.join(checkpoint_dir, "sub", "config.json"), mode="wb") as f:
+        f.write(b"{}")
+    return shutil.make_archive(checkpoint_dir, "zip", checkpoint_dir)
+
+
+class Downloader(object):
+    def __init__(self, archive: str) -> None:
+        self.archive = archive
+        self.count = 0
+
+    async def __call__(self, checkpoint_file: str):
+        self.count += 1
+        shutil.copyfile(self.archive, checkpoint_file)
+
+
+def read_checkpoint(checkpoint_dir: str) -> bytes:
+    with open(os.path.join(checkpoint_dir, "model.safetensors"), mode="rb") as f:
+        return f.read()
+
+
+async def test_checkpoint_cache_hit(tmp_path):
+    archive = make_checkpoint(str(tmp_path / "src"), b"0" * 100)
+    checkpoint_hash = hash_archive(archive)
+    download = Downloader(archive)
+    cache = CheckpointCache(str(tmp_path / "cache"))
+
+    dst_dirs = [str(tmp_path / f"task{i}" / "input_checkpoint") for i in range(3)]
+    async with create_task_group() as tg:
+        for dst_dir in dst_dirs:
+            tg.start_soon(cache.get, dst_dir, download, checkpoint_hash)
+
+    assert download.count == 1
+    for dst_dir in dst_dirs:
+        assert read_checkpoint(dst_dir) == b"0" * 100
+        assert os.path.exists(os.path.join(dst_dir, "sub", "config.json"))
+
+    # the relay does not report the hash, the archive is downloaded but not unpacked again
+    assert await cache.get(str(tmp_path / "task3" / "input_checkpoint"), download)
+    assert download.count == 2
+
+    stats = cache.stats
+    assert stats.hits == 3
+    assert stats.misses == 1
+    assert stats.entries == 1
+
+    # removing task dirs does not affect the cache
+    shutil.rmtree(str(tmp_path / "task0"))
+    assert await cache.get(dst_dirs[0], download, checkpoint_hash)
+    assert read_checkpoint(dst_dirs[0]) == b"0" * 100
+
+
+async def test_checkpoint_cache_without_hash(tmp_path):
+    archive = make_checkpoint(str(tmp_path / "src"), b"0" * 100)
+    download = Downloader(archive)
+    cache = CheckpointCache(str(tmp_path / "cache"))
+
+    dst_dirs = [str(tmp_path / f"task{i}" / "input_checkpoint") for i in range(3)]
+    async with create_task_group() as tg:
+        for dst_dir in dst_dirs:
+            tg.start_soon(cache.get, dst_dir, download)
+
+    assert download.count == 3
+    for dst_dir in dst_dirs:
+        assert read_checkpoint(dst_dir) == b"0" * 100
+
+    stats = cache.stats
+    assert stats.hits == 2
+    assert stats.misses == 1
+    assert stats.entries == 1
+    assert os.listdir(str(tmp_path / "cache" / "tmp")) == []
+
+
+async def test_checkpoint_cache_hash_mismatch(tmp_path):
+    archive = make_checkpoint(str(tmp_path / "src"), b"0" * 100)
+    download = Downloader(archive)
+    cache = CheckpointCache(str(tmp_path / "cache"))
+
+    with pytest.raises(ValueError):
+        await cache.get(str(tmp_path / "task0"), download, "0" * 64)
+
+    assert not os.path.exists(str(tmp_path / "task0"))
+    assert os.listdir(str(tmp_path / "cache" / "objects")) == []
+    assert os.listdir(str(tmp_path / "cache" / "tmp")) == []
+
+
+async def test_checkpoint_cache_evict(tmp_path):
+    archives = [
+        make_checkpoint(str(tmp_path / f"src{i}"), bytes([i]) * 100) for i in range(3)
+    ]
+    hashes = [hash_archive(archive) for archive in archives]
+    cache = CheckpointCache(str(tmp_path / "cache"), max_size=250)
+
+    for i, archive in enumerate(archives):
+        await cache.get(str(tmp_path / f"task{i}"), Downloader(archive), hashes[i])
+
+    stats = cache.stats
+    assert stats.evictions == 1
+    assert stats.entries == 2
+    cached = os.listdir(str(tmp_path / "cache" / "objects"))
+    assert sorted(cached) == sorted(hashes[1:])
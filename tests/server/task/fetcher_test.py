@@ -0,0 +1,120 @@
+import secrets
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import pytest
+from anyio import create_task_group, move_on_after, sleep
+from web3 import Web3
+
+from crynux_server import models
+from crynux_server.relay import RelayError
+from crynux_server.task.fetcher import RelayTaskFetcher
+
+
+def make_task(task_id_commitment: bytes) -> models.RelayTask:
+    zero_address = Web3.to_checksum_address("0x" + "00" * 20)
+    return models.RelayTask(
+        sequence=1,
+        task_id_commitment="0x" + task_id_commitment.hex(),
+        creator=zero_address,
+        sampling_seed="0x" + "00" * 32,
+        nonce="0x" + "00" * 32,
+        task_args="{}",
+        status=models.InferenceTaskStatus.Started,
+        task_type=models.TaskType.SD,
+        task_version="2.5.0",
+        timeout=300,
+        min_vram=4,
+        required_gpu="",
+        required_gpu_vram=0,
+        task_fee="1",
+        task_size=1,
+        model_ids=[],
+        score="",
+        qos_score=1,
+        selected_node=zero_address,
+        create_time=datetime.now(),
+        start_time=datetime.now(),
+        score_ready_time=datetime.now(),
+        validated_time=datetime.now(),
+        result_uploaded_time=datetime.now(),
+    )
+
+
+class CountingRelay(object):
+    def __init__(self) -> None:
+        self.tasks: Dict[bytes, models.RelayTask] = {}
+        self.calls = 0
+
+    async def get_tasks(self, task_id_commitments: List[bytes]):
+        self.calls += 1
+        return [self.tasks[t] for t in task_id_commitments if t in self.tasks]
+
+
+async def test_fetch_tasks_in_batch():
+    relay = CountingRelay()
+    task_id_commitments = [secrets.token_bytes(32) for _ in range(5)]
+    for task_id_commitment in task_id_commitments:
+        relay.tasks[task_id_commitment] = make_task(task_id_commitment)
+
+    fetcher = RelayTaskFetcher(relay, batch_window=0.05)  # type: ignore
+    results = {}
+
+    async def get_task(task_id_commitment: bytes):
+        results[task_id_commitment] = await fetcher.get_task(task_id_commitment)
+
+    async with create_task_group() as tg:
+        for task_id_commitment in task_id_commitments:
+            tg.start_soon(get_task, task_id_commitment)
+
+    assert relay.calls == 1
+    for task_id_commitment in task_id_commitments:
+        assert results[task_id_commitment].task_id_commitment == task_id_commitment
+
+    with pytest.raises(RelayError):
+        await fetcher.get_task(secrets.token_bytes(32))
+    assert relay.calls == 2
+
+
+async def test_fetch_tasks_at_once():
+    relay = CountingRelay()
+    task_id_commitments = [secrets.token_bytes(32) for _ in range(3)]
+    for task_id_commitment in task_id_commitments:
+        relay.tasks[task_id_commitment] = make_task(task_id_commitment)
+
+    fetcher = RelayTaskFetcher(relay)  # type: ignore
+
+    # a single request is not delayed
+    start = time.monotonic()
+    await fetcher.get_task(task_id_commitments[0])
+    assert time.monotonic() - start < 0.05
+    assert relay.calls == 1
+
+    # requests made at the same time are still fetched in one batch
+    async with create_task_group() as tg:
+        for task_id_commitment in task_id_commitments:
+            tg.start_soon(fetcher.get_task, task_id_commitment)
+    assert relay.calls == 2
+
+
+async def test_fetch_batch_leader_cancelled():
+    relay = CountingRelay()
+    leader_id, follower_id = secrets.token_bytes(32), secrets.token_bytes(32)
+    relay.tasks[follower_id] = make_task(follower_id)
+
+    fetcher = RelayTaskFetcher(relay, batch_window=0.1)  # type: ignore
+    results = {}
+
+    async def follower():
+        await sleep(0.01)
+        results[follower_id] = await fetcher.get_task(follower_id)
+
+    async with create_task_group() as tg:
+        tg.start_soon(follower)
+        with move_on_after(0.05):
+            await fetcher.get_task(leader_id)
+
+    # the follower fetches its task in a new batch instead of failing
+    assert results[follower_id].task_id_commitment == follower_id
+    assert relay.calls == 1
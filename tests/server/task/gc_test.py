@@ -0,0 +1,101 @@
+import os
+import secrets
+import stat
+import time
+
+from crynux_server import models
+from crynux_server.config import ResultGCConfig
+from crynux_server.task.gc import ResultGC, remove_dir
+from crynux_server.task.state_cache import MemoryInferenceTaskStateCache
+
+
+def make_result(output_dir: str, name: str, size: int, age: float) -> str:
+    dirname = os.path.join(output_dir, name)
+    os.makedirs(dirname)
+    filename = os.path.join(dirname, "0.png")
+    with open(filename, mode="wb") as f:
+        f.write(b"0" * size)
+    mtime = time.time() - age
+    os.utime(filename, (mtime, mtime))
+    os.utime(dirname, (mtime, mtime))
+    return dirname
+
+
+async def dump_state(
+    cache: MemoryInferenceTaskStateCache, status: models.InferenceTaskStatus
+) -> bytes:
+    task_id_commitment = secrets.token_bytes(32)
+    await cache.dump(
+        models.InferenceTaskState(
+            task_id_commitment=task_id_commitment,
+            timeout=900,
+            status=status,
+            task_type=models.TaskType.SD,
+        )
+    )
+    return task_id_commitment
+
+
+async def test_result_gc(tmp_path):
+    output_dir = str(tmp_path)
+    cache = MemoryInferenceTaskStateCache()
+
+    running_id = secrets.token_bytes(32)
+    pending_id = await dump_state(cache, models.InferenceTaskStatus.ScoreReady)
+    # the runner of the unfinished task is gone, like crashed before the restart
+    stale_id = await dump_state(cache, models.InferenceTaskStatus.ScoreReady)
+    old_id = await dump_state(cache, models.InferenceTaskStatus.EndSuccess)
+    new_id = await dump_state(cache, models.InferenceTaskStatus.EndAborted)
+    # error reported tasks have no result files to clean up, their dirs are collected by GC
+    error_id = await dump_state(cache, models.InferenceTaskStatus.ErrorReported)
+
+    running_dir = make_result(output_dir, "0x" + running_id.hex(), 100, 7200)
+    pending_dir = make_result(output_dir, "0x" + pending_id.hex(), 100, 3000)
+    stale_dir = make_result(output_dir, "0x" + stale_id.hex(), 100, 7200)
+    old_dir = make_result(output_dir, "0x" + old_id.hex(), 100, 7200)
+    new_dir = make_result(output_dir, "0x" + new_id.hex(), 100, 600)
+    orphan_dir = make_result(output_dir, "initial", 100, 7200)
+    error_dir = make_result(output_dir, "0x" + error_id.hex(), 100, 7200)
+
+    gc = ResultGC(
+        output_dir=output_dir,
+        state_cache=cache,
+        is_running=lambda task_id_commitment: task_id_commitment == running_id,
+        config=ResultGCConfig(interval=1, retention=3600, max_size=1000),
+    )
+    freed = await gc.collect()
+    assert freed == 400
+    assert os.path.exists(running_dir)
+    assert os.path.exists(pending_dir)
+    assert not os.path.exists(stale_dir)
+    assert os.path.exists(new_dir)
+    assert not os.path.exists(old_dir)
+    assert not os.path.exists(orphan_dir)
+    assert not os.path.exists(error_dir)
+
+    # exceed the quota, the finished result is removed before retention
+    gc = ResultGC(
+        output_dir=output_dir,
+        state_cache=cache,
+        is_running=lambda task_id_commitment: task_id_commitment == running_id,
+        config=ResultGCConfig(interval=1, retention=3600, max_size=250),
+    )
+    await gc.collect()
+    assert os.path.exists(running_dir)
+    assert os.path.exists(pending_dir)
+    assert not os.path.exists(new_dir)
+
+    stats = gc.stats
+    assert stats.runs == 1
+    assert stats.removed == 1
+    assert stats.total_bytes == 200
+
+
+def test_remove_read_only_dir(tmp_path):
+    dirname = make_result(str(tmp_path), "task", 10, 0)
+    # files linked from the checkpoint cache are read-only
+    os.chmod(os.path.join(dirname, "0.png"), stat.S_IRUSR)
+    os.chmod(dirname, stat.S_IRUSR | stat.S_IXUSR)
+
+    remove_dir(dirname)
+    assert not os.path.exists(dirname)
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+
+import pytest
+from anyio import create_task_group, sleep
+
+from crynux_server.models import TaskType, WorkerResultFile
+from crynux_server.task import HashEngine
+from crynux_server.task.hashing import IncrementalHasher
+
+
+@pytest.fixture
+def resp_files(tmp_path):
+    files = []
+    for i in range(8):
+        filename = os.path.join(tmp_path, f"{i}.json")
+        with open(filename, mode="w", encoding="utf-8") as f:
+            json.dump({"index": i, "text": "crynux" * (i + 1)}, f)
+        files.append(filename)
+    return files
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+async def test_hash_files_in_order(mode, resp_files):
+    engine = HashEngine(mode=mode, max_workers=3)
+    hashes = await engine.hash_files(TaskType.LLM, resp_files)
+
+    for filename, h in zip(resp_files, hashes):
+        with open(filename, mode="rb") as f:
+            assert h == hashlib.sha256(f.read()).digest()
+
+    stats = engine.stats
+    assert stats.mode == mode
+    assert stats.num_batches == 1
+    assert stats.num_files == len(resp_files)
+    assert stats.total_time > 0
+    assert stats.max_file_time > 0
+
+
+async def test_incremental_hasher(tmp_path):
+    engine = HashEngine(max_workers=2)
+    hasher = IncrementalHasher(engine, TaskType.LLM, str(tmp_path), poll_interval=0.05)
+
+    files = [os.path.join(tmp_path, f"{i}.json") for i in range(3)]
+
+    def write(filename: str, content: str):
+        with open(filename, mode="w", encoding="utf-8") as f:
+            f.write(content)
+
+    async with create_task_group() as tg:
+        tg.start_soon(hasher.watch)
+        for i, filename in enumerate(files):
+            write(filename, json.dumps({"index": i}))
+            await sleep(0.3)
+        tg.cancel_scope.cancel()
+
+    assert sorted(hasher.hashed_files) == files
+    assert engine.stats.num_batches == 0
+
+    # file changed after hashing should be hashed again
+    write(files[1], json.dumps({"index": 1, "changed": True}))
+    hashes = await hasher.finish(files)
+    for filename, h in zip(files, hashes):
+        with open(filename, mode="rb") as f:
+            assert h == hashlib.sha256(f.read()).digest()
+    stats = engine.stats
+    assert stats.num_batches == 1
+    assert stats.num_files == 4
+
+
+async def test_worker_hashes(tmp_path, resp_files):
+    engine = HashEngine(max_workers=2, verify_worker_hashes=0.25)
+    hasher = IncrementalHasher(engine, TaskType.LLM, str(tmp_path))
+    expected = []
+    for filename in resp_files:
+        with open(filename, mode="rb") as f:
+            expected.append(hashlib.sha256(f.read()).digest())
+    hasher.worker_files = [
+        WorkerResultFile(
+            path=os.path.basename(filename), size=os.path.getsize(filename), hash=h.hex()
+        )
+        for filename, h in zip(resp_files, expected)
+    ]
+    assert await hasher.finish(resp_files) == expected
+    stats = engine.stats
+    assert stats.num_worker_files == 8
+    assert stats.num_verified_files == 2
+    assert stats.num_files == 2
+    assert stats.num_worker_mismatches == 0
+
+    # all files are hashed by the node when a worker hash is wrong
+    engine = HashEngine(max_workers=2, verify_worker_hashes=1)
+    hasher = IncrementalHasher(engine, TaskType.LLM, str(tmp_path))
+    hasher.worker_files = [
+        WorkerResultFile(
+            path=os.path.basename(filename), size=os.path.getsize(filename), hash="0x" + h.hex()
+        )
+        for filename, h in zip(resp_files, expected)
+    ]
+    hasher.worker_files[3].hash = "00" * 32
+    assert await hasher.finish(resp_files) == expected
+    stats = engine.stats
+    assert stats.num_verified_files == 8
+    assert stats.num_worker_mismatches == 1
+    assert stats.num_files == 16
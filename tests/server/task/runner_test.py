@@ -0,0 +1,178 @@
+import json
+import os
+import secrets
+from types import SimpleNamespace
+
+from anyio import create_task_group, fail_after, sleep
+from web3 import Web3
+
+from crynux_server import models
+from crynux_server.task import (InferenceTaskRunner,
+                                MemoryInferenceTaskStateCache,
+                                MockInferenceTaskRunner)
+from crynux_server.task.hashing import get_gpt_resp_hash
+from crynux_server.task.manifest import (load_result_manifest,
+                                         make_result_manifest,
+                                         write_result_manifest)
+
+
+class UploadMockInferenceTaskRunner(MockInferenceTaskRunner):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.uploaded = False
+
+    async def upload_result(self):
+        self.uploaded = True
+
+
+async def test_runner_status_from_events():
+    cache = MemoryInferenceTaskStateCache()
+    task_id_commitment = secrets.token_bytes(32)
+    node = Web3.to_checksum_address("0x577887519278199ce8F8D80bAcc70fc32b48daD4")
+
+    runner = UploadMockInferenceTaskRunner(
+        task_id_commitment=task_id_commitment,
+        state_cache=cache,
+        contracts=object(),  # type: ignore
+    )
+
+    args = {
+        "id": 1,
+        "task_id_commitment": "0x" + task_id_commitment.hex(),
+        "selected_node": node,
+    }
+    events = [
+        models.TaskScoreReady.model_validate({**args, "score": "0x01020304"}),
+        models.TaskValidated.model_validate(args),
+        models.TaskEndSuccess.model_validate(args),
+    ]
+
+    # the relay is polled every 60 seconds, so the task can only finish in time by events
+    with fail_after(5):
+        async with create_task_group() as tg:
+            tg.start_soon(runner.run, 60)
+            for event in events:
+                runner.process_event(event)
+
+    assert runner.uploaded
+    state = await cache.load(task_id_commitment)
+    assert state.status == models.InferenceTaskStatus.EndSuccess
+
+
+class PrefetchRelay(object):
+    def __init__(self, task: models.RelayTask) -> None:
+        self.task = task
+        self.get_task_count = 0
+        self.get_checkpoint_count = 0
+
+    async def get_task(self, task_id_commitment: bytes):
+        self.get_task_count += 1
+        await sleep(0.1)
+        return self.task.model_copy()
+
+    async def get_checkpoint(self, task_id_commitment: bytes, checkpoint_dir: str):
+        self.get_checkpoint_count += 1
+        await sleep(0.1)
+
+
+async def test_runner_prefetch(tmp_path):
+    task_id_commitment = secrets.token_bytes(32)
+    task = await MockInferenceTaskRunner(
+        task_id_commitment=task_id_commitment,
+        state_cache=MemoryInferenceTaskStateCache(),
+        contracts=object(),  # type: ignore
+    ).get_task()
+    task.task_type = models.TaskType.SD_FT_LORA
+    task.task_args = json.dumps({"checkpoint": "remote"})
+    task.model_ids = ["base:crynux-ai/stable-diffusion-v1-5"]
+
+    relay = PrefetchRelay(task)
+    config = SimpleNamespace(task_config=SimpleNamespace(output_dir=str(tmp_path)))
+    runner = InferenceTaskRunner(
+        task_id_commitment=task_id_commitment,
+        state_cache=MemoryInferenceTaskStateCache(),
+        contracts=object(),  # type: ignore
+        relay=relay,  # type: ignore
+        config=config,  # type: ignore
+    )
+
+    async with create_task_group() as tg:
+        tg.start_soon(runner.prefetch)
+        await sleep(0.05)
+        prepared = await runner.prepare()
+
+    assert relay.get_task_count == 1
+    assert relay.get_checkpoint_count == 1
+    checkpoint_dir = os.path.join(
+        tmp_path, runner.task_id_commitment.hex(), "input_checkpoint"
+    )
+    assert json.loads(prepared.task.task_args)["checkpoint"] == checkpoint_dir
+    assert prepared.models[0].id == "crynux-ai/stable-diffusion-v1-5"
+
+    assert (await runner.prepare()) is prepared
+    assert relay.get_task_count == 1
+
+
+class SubmitRelay(object):
+    def __init__(self) -> None:
+        self.scores = []
+
+    async def submit_task_score(self, task_id_commitment: bytes, score: bytes):
+        self.scores.append(score)
+
+
+async def test_runner_recover_results(tmp_path):
+    task_id_commitment = secrets.token_bytes(32)
+    relay = SubmitRelay()
+    config = SimpleNamespace(task_config=SimpleNamespace(output_dir=str(tmp_path), result_shm=None))
+    runner = InferenceTaskRunner(
+        task_id_commitment=task_id_commitment,
+        state_cache=MemoryInferenceTaskStateCache(),
+        contracts=object(),  # type: ignore
+        relay=relay,  # type: ignore
+        config=config,  # type: ignore
+    )
+    runner.state = models.InferenceTaskState(
+        task_id_commitment=task_id_commitment,
+        timeout=0,
+        status=models.InferenceTaskStatus.Started,
+        task_type=models.TaskType.LLM,
+    )
+
+    # results are written by the worker before the node restarts
+    task_dir = os.path.join(tmp_path, runner.task_id_commitment.hex())
+    os.makedirs(task_dir)
+    files = []
+    for i in range(2):
+        filename = os.path.join(task_dir, f"{i}.json")
+        with open(filename, mode="w") as f:
+            json.dump({"choices": [i]}, f)
+        files.append(filename)
+    manifest = make_result_manifest(
+        task_id_commitment, models.TaskType.LLM, task_dir, files
+    )
+    write_result_manifest(task_dir, manifest)
+
+    with fail_after(5):
+        await runner.execute_task()
+
+    hashes = [get_gpt_resp_hash(f) for f in files]
+    assert runner.state.files == files
+    assert runner.state.score == b"".join(hashes)
+    assert relay.scores == [b"".join(hashes)]
+
+    # changed results are not recovered
+    with open(files[0], mode="a") as f:
+        f.write(" ")
+    assert load_result_manifest(task_dir, task_id_commitment) is None
+
+
+async def test_mock_runner_task_id_commitment():
+    task_id_commitment = secrets.token_bytes(32)
+    runner = MockInferenceTaskRunner(
+        task_id_commitment=task_id_commitment,
+        state_cache=MemoryInferenceTaskStateCache(),
+        contracts=object(),  # type: ignore
+    )
+    task = await runner.get_task()
+    assert task.task_id_commitment == task_id_commitment
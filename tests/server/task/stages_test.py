@@ -0,0 +1,78 @@
+from anyio import Event, create_task_group, move_on_after, sleep
+
+from crynux_server.config import StagesConfig
+from crynux_server.task import StageScheduler
+from crynux_server.worker_manager import task_priority
+
+
+async def test_stage_capacity():
+    scheduler = StageScheduler(StagesConfig(execute=1, upload=2))
+    finish = Event()
+
+    async def run(name):
+        async with scheduler.stage(name):
+            await finish.wait()
+
+    async with create_task_group() as tg:
+        for _ in range(3):
+            tg.start_soon(run, "execute")
+            tg.start_soon(run, "upload")
+        await sleep(0.1)
+
+        metrics = scheduler.metrics()
+        assert metrics["execute"].running == 1
+        assert metrics["execute"].waiting == 2
+        assert metrics["upload"].running == 2
+        assert metrics["upload"].waiting == 1
+        assert metrics["hash"].running == 0
+
+        finish.set()
+
+    metrics = scheduler.metrics()
+    assert metrics["execute"].running == 0
+    assert metrics["execute"].waiting == 0
+
+
+async def test_stage_priority():
+    scheduler = StageScheduler(StagesConfig(execute=1))
+    finish = Event()
+    order = []
+
+    async def run(name, priority):
+        async with scheduler.stage("execute", priority):
+            order.append(name)
+            await finish.wait()
+
+    async with create_task_group() as tg:
+        tg.start_soon(run, "running", task_priority("inference", 500))
+        await sleep(0.05)
+        tg.start_soon(run, "download", task_priority("download"))
+        tg.start_soon(run, "late", task_priority("inference", 300))
+        tg.start_soon(run, "early", task_priority("inference", 100))
+        await sleep(0.05)
+        assert scheduler.metrics()["execute"].waiting == 3
+        finish.set()
+
+    # waiting tasks enter by their priorities instead of the arrival order
+    assert order == ["running", "early", "late", "download"]
+    assert scheduler.metrics()["execute"].running == 0
+
+
+async def test_stage_cancel_waiting():
+    scheduler = StageScheduler(StagesConfig(execute=1))
+    finish = Event()
+
+    async def run():
+        async with scheduler.stage("execute"):
+            await finish.wait()
+
+    async with create_task_group() as tg:
+        tg.start_soon(run)
+        await sleep(0.05)
+        with move_on_after(0.05):
+            await run()
+        assert scheduler.metrics()["execute"].waiting == 0
+        finish.set()
+
+    metrics = scheduler.metrics()
+    assert metrics["execute"].running == 0
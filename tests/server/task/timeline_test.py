@@ -0,0 +1,91 @@
+import secrets
+
+import pytest
+
+from crynux_server import db, models
+from crynux_server.config import DBConfig
+from crynux_server.task import MockInferenceTaskRunner
+from crynux_server.task.state_cache import (DbInferenceTaskStateCache,
+                                            MemoryInferenceTaskStateCache)
+from crynux_server.task.timeline import (get_span_stats, get_timeline_spans,
+                                         make_task_timeline)
+
+
+def make_state(marks):
+    return models.InferenceTaskState(
+        task_id_commitment=secrets.token_bytes(32),
+        timeout=900,
+        status=models.InferenceTaskStatus.EndSuccess,
+        task_type=models.TaskType.SD,
+        timeline=marks,
+    )
+
+
+def test_timeline_spans():
+    marks = {
+        "event_received": 100,
+        "queued": 101,
+        "admitted": 103,
+        "dispatched": 104,
+        "worker_finished": 110,
+        "upload_start": 112,
+    }
+    spans = get_timeline_spans(marks)
+    assert spans == {"queue_wait": 2, "worker": 6}
+
+    state = make_state(marks)
+    timeline = make_task_timeline(state)
+    assert timeline.task_id_commitment == "0x" + state.task_id_commitment.hex()
+    assert timeline.spans == spans
+
+
+def test_span_stats():
+    states = [
+        make_state({"dispatched": 0, "worker_finished": i}) for i in range(1, 101)
+    ]
+    states.append(make_state({"queued": 0}))
+    stats = get_span_stats(states)
+    assert list(stats.keys()) == ["worker"]
+    worker = stats["worker"]
+    assert worker.count == 100
+    assert worker.mean == 50.5
+    assert worker.p50 == 50
+    assert worker.p90 == 90
+    assert worker.p99 == 99
+    assert worker.max == 100
+
+
+@pytest.fixture
+async def init_db(tmp_path):
+    await db.init(DBConfig(driver="sqlite", filename=str(tmp_path / "server.db")))
+    yield
+    await db.close()
+
+
+async def test_db_state_cache_timeline(init_db):
+    cache = DbInferenceTaskStateCache()
+    state = make_state({})
+    await cache.dump(state)
+    assert (await cache.load(state.task_id_commitment)).timeline == {}
+
+    state.timeline["queued"] = 1.5
+    state.timeline["admitted"] = 2.5
+    await cache.dump(state)
+    assert (await cache.load(state.task_id_commitment)).timeline == state.timeline
+    states = await cache.find()
+    assert len(states) == 1
+    assert states[0].timeline == state.timeline
+
+
+async def test_runner_marks_before_state():
+    state_cache = MemoryInferenceTaskStateCache()
+    runner = MockInferenceTaskRunner(
+        task_id_commitment=secrets.token_bytes(32),
+        state_cache=state_cache,
+        contracts=object(),  # type: ignore
+    )
+    runner.mark("event_received")
+    runner.mark("queued")
+    await runner.sync_state()
+    runner.mark("admitted")
+    assert set(runner.state.timeline.keys()) == {"event_received", "queued", "admitted"}
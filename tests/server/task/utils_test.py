@@ -0,0 +1,63 @@
+import os
+from types import SimpleNamespace
+
+from crynux_server import models
+from crynux_server.config import ResultShmConfig
+from crynux_server.task.utils import collect_inference_results, get_task_dir
+
+
+def test_get_task_dir(tmp_path):
+    output_dir = str(tmp_path / "results")
+    shm_dir = str(tmp_path / "shm")
+    task_config = SimpleNamespace(output_dir=output_dir, result_shm=None)
+    task_id = bytes.fromhex("ab" * 32)
+
+    assert get_task_dir(task_config, models.TaskType.SD, task_id) == os.path.join(  # type: ignore
+        output_dir, task_id.hex()
+    )
+
+    task_config.result_shm = ResultShmConfig(dir=shm_dir, max_size=100)
+    shm_task_dir = os.path.join(shm_dir, task_id.hex())
+    assert get_task_dir(task_config, models.TaskType.SD, task_id) == shm_task_dir  # type: ignore
+    assert get_task_dir(task_config, models.TaskType.LLM, task_id) == shm_task_dir  # type: ignore
+    # checkpoints of fine-tune tasks are too large for the shared memory
+    assert get_task_dir(task_config, models.TaskType.SD_FT_LORA, task_id) == os.path.join(  # type: ignore
+        output_dir, task_id.hex()
+    )
+
+    # new tasks write to the output dir when the shared memory dir is full
+    os.makedirs(shm_task_dir)
+    with open(os.path.join(shm_task_dir, "0.png"), mode="wb") as f:
+        f.write(b"0" * 100)
+    other_id = bytes.fromhex("cd" * 32)
+    assert get_task_dir(task_config, models.TaskType.SD, other_id) == os.path.join(  # type: ignore
+        output_dir, other_id.hex()
+    )
+    # the task already in the shared memory dir keeps it
+    assert get_task_dir(task_config, models.TaskType.SD, task_id) == shm_task_dir  # type: ignore
+
+
+def test_collect_worker_results(tmp_path):
+    task_dir = str(tmp_path)
+    for i in range(3):
+        with open(os.path.join(task_dir, f"{i}.png"), mode="wb") as f:
+            f.write(b"0" * (i + 1))
+    files = [os.path.join(task_dir, f"{i}.png") for i in range(3)]
+    worker_files = [
+        models.WorkerResultFile(path=f"{i}.png", size=i + 1, hash="00") for i in [2, 0, 1]
+    ]
+
+    # the order of the worker is used
+    res, _ = collect_inference_results(models.TaskType.SD, task_dir, worker_files)
+    assert res == [files[2], files[0], files[1]]
+
+    # the result dir is scanned when a result file is changed
+    worker_files[0].size = 10
+    res, _ = collect_inference_results(models.TaskType.SD, task_dir, worker_files)
+    assert res == files
+
+    # or a file is not a result file
+    worker_files[0].size = 3
+    worker_files[1].path = "../0.png"
+    res, _ = collect_inference_results(models.TaskType.SD, task_dir, worker_files)
+    assert res == files
@@ -0,0 +1,186 @@
+import time
+from typing import List, Optional
+from unittest.mock import patch
+
+import pytest
+from anyio import create_task_group, fail_after, sleep
+
+from crynux_server import db, models
+from crynux_server.config import DBConfig
+from crynux_server.worker_manager import (DbTaskQueueStore,
+                                          MemoryTaskQueueStore, TaskCancelled,
+                                          WorkerDisconnected)
+from crynux_server.worker_manager.exchange import TaskExchange
+
+
+def make_inference_input(task_id: str, model_ids: Optional[List[str]] = None):
+    if model_ids is None:
+        model_ids = []
+    return models.TaskInput(
+        task=models.InferenceTaskInput(
+            task_name="inference",
+            task_type=models.TaskType.SD,
+            task_id=task_id,
+            models=[models.ModelConfig.from_model_id(model_id) for model_id in model_ids],
+            task_args="",
+            output_dir="",
+        )
+    )
+
+
+def make_download_input(task_id: str):
+    return models.TaskInput(
+        task=models.DownloadTaskInput(
+            task_name="download",
+            task_type=models.TaskType.SD,
+            task_id=task_id,
+            model=models.ModelConfig(id="crynux-ai/sdxl-turbo", type="base"),
+        )
+    )
+
+
+async def test_exchange_priority():
+    exchange = TaskExchange()
+
+    await exchange.send_task(make_download_input("download"))
+    await exchange.send_task(make_inference_input("late"), deadline=300)
+    await exchange.send_task(make_inference_input("early"), deadline=100)
+    await exchange.send_task(make_inference_input("early_rich"), deadline=100, fee=10)
+    await exchange.send_task(make_inference_input("no_deadline"))
+    assert len(exchange) == 5
+
+    task_ids = []
+    for _ in range(5):
+        task_input, _ = await exchange.get_task()
+        task_ids.append(task_input.task.task_id)
+    assert task_ids == ["early_rich", "early", "late", "no_deadline", "download"]
+
+
+async def test_exchange_model_affinity():
+    exchange = TaskExchange()
+    sd15 = "base:crynux-ai/stable-diffusion-v1-5+fp16"
+    sdxl = "base:crynux-ai/sdxl-turbo+fp16"
+    lora = "lora:crynux-ai/lora"
+
+    got = {}
+
+    async def get_task(worker_id: int, loaded_models):
+        task_input, _ = await exchange.get_task(worker_id, loaded_models)
+        got[task_input.task.task_id] = worker_id
+
+    with fail_after(2):
+        async with create_task_group() as tg:
+            tg.start_soon(get_task, 1, {sd15})
+            tg.start_soon(get_task, 2, {sdxl, lora})
+            await sleep(0.1)
+            await exchange.send_task(make_inference_input("sdxl", [sdxl, lora]))
+            await exchange.send_task(make_inference_input("sd15", [sd15, lora]))
+    assert got == {"sdxl": 2, "sd15": 1}
+
+    # no worker loads the models, the worker got the least tasks gets the task
+    got.clear()
+    with fail_after(2):
+        async with create_task_group() as tg:
+            tg.start_soon(get_task, 3, set())
+            tg.start_soon(get_task, 1, {sd15})
+            await sleep(0.1)
+            await exchange.send_task(make_inference_input("new", [sdxl]))
+            await sleep(0.1)
+            await exchange.send_task(make_download_input("download"))
+    assert got == {"new": 3, "download": 1}
+
+
+async def test_exchange_remove_waiting_worker():
+    exchange = TaskExchange()
+
+    async def remove_worker():
+        await sleep(0.1)
+        await exchange.remove_worker(1)
+
+    with fail_after(2):
+        async with create_task_group() as tg:
+            tg.start_soon(remove_worker)
+            with pytest.raises(WorkerDisconnected):
+                await exchange.get_task(1)
+
+    # tasks are not taken by the removed worker
+    await exchange.send_task(make_inference_input("0"))
+    with fail_after(1):
+        task_input, _ = await exchange.get_task(2)
+    assert task_input.task.task_id == "0"
+
+
+@pytest.fixture(params=["memory", "db"])
+async def queue_store(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryTaskQueueStore()
+    else:
+        await db.init(DBConfig(driver="sqlite", filename=str(tmp_path / "server.db")))
+        yield DbTaskQueueStore()
+        await db.close()
+
+
+async def test_exchange_recover(queue_store):
+    exchange = TaskExchange(queue_store)
+    done = await exchange.send_task(make_inference_input("done"), deadline=100)
+    await exchange.send_task(make_inference_input("expired"), deadline=200)
+    await exchange.send_task(make_inference_input("running"), deadline=1000)
+    await exchange.send_task(make_inference_input("queued"), deadline=time.time() + 600)
+    await exchange.send_task(make_download_input("download"))
+
+    for _ in range(3):
+        await exchange.get_task()
+    done.set_result(None)
+    await done.get()
+    await sleep(0)
+    stats = exchange.stats()
+    assert stats.queued == 2
+    assert stats.dispatched == 2
+    assert stats.oldest_queued_age is not None
+    await exchange.flush()
+
+    # the node restarts, finished and expired tasks are not dispatched again
+    exchange = TaskExchange(queue_store)
+    with patch("time.time", return_value=500):
+        assert await exchange.recover() == 3
+    assert exchange.stats().unclaimed == 3
+    await exchange.flush()
+    assert [task.task_id for task in await queue_store.load()] == [
+        "running",
+        "queued",
+        "download",
+    ]
+
+    # recovered tasks are dispatched again in their saved priority order
+    assert len(exchange) == 3
+    task_input, recovered = await exchange.get_task()
+    assert task_input.task.task_id == "running"
+    stats = exchange.stats()
+    assert stats.recovered == 3
+    assert stats.queued == 2
+    assert stats.dispatched == 1
+
+    # task runners get the recovered futures by sending the tasks again
+    running = await exchange.send_task(make_inference_input("running"), deadline=1000)
+    assert running is recovered
+    fut = await exchange.send_task(make_inference_input("queued"), deadline=time.time() + 600)
+    assert len(exchange) == 2
+    assert exchange.stats().unclaimed == 1
+
+    # the download task is not claimed in the grace period and should be cancelled
+    with patch("time.time", return_value=500):
+        assert exchange.drop_unclaimed(600) == []
+    assert exchange.drop_unclaimed(600) == ["download"]
+    assert exchange.stats().unclaimed == 0
+    assert await exchange.remove_task("download")
+    await sleep(0)
+    await exchange.flush()
+    assert [task.task_id for task in await queue_store.load()] == ["running", "queued"]
+
+    running.set_result(None)
+    await exchange.cancel_tasks()
+    with pytest.raises(TaskCancelled):
+        await fut.get()
+    await sleep(0)
+    await exchange.flush()
+    assert len(await queue_store.load()) == 0
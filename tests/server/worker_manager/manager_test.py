@@ -0,0 +1,428 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from anyio import create_task_group, fail_after, sleep
+
+from crynux_server import models
+from crynux_server.config import WorkerPoolConfig, WorkerSupervisorConfig
+from crynux_server.worker_manager import (TaskCancelled, WorkerDisconnected,
+                                          WorkerManager)
+
+from .exchange_test import make_inference_input
+
+
+def make_worker_manager(tmp_path, gpus, standby=0, supervisor=None, standby_gpus=()):
+    task_config = SimpleNamespace(
+        worker_pool=WorkerPoolConfig(
+            gpus=gpus, standby=standby, standby_gpus=list(standby_gpus)
+        ),
+        worker_supervisor=supervisor,
+        worker_patch_url="",
+        hf_cache_dir="",
+        external_cache_dir="",
+        output_dir="",
+        script_dir="",
+        worker_pid_file=str(tmp_path / "crynux_worker.pid"),
+        preloaded_models=None,
+        proxy=None,
+    )
+    config = SimpleNamespace(
+        task_config=task_config,
+        server_port=7412,
+        log=SimpleNamespace(dir="logs", level="INFO"),
+    )
+    return WorkerManager(config)  # type: ignore
+
+
+def test_worker_envs(tmp_path):
+    manager = make_worker_manager(tmp_path, ["0", "1"])
+    assert manager.num_workers == 2
+
+    slots = {info.slot: info for info in manager.workers()}
+    envs0 = manager._worker_envs(manager._slots[0])
+    envs1 = manager._worker_envs(manager._slots[1])
+    assert envs0["CUDA_VISIBLE_DEVICES"] == slots[0].gpu == "0"
+    assert envs1["CUDA_VISIBLE_DEVICES"] == slots[1].gpu == "1"
+    assert envs0["cw_node_url"].endswith("/manager/v1/worker/")
+    assert envs1["cw_node_url"].endswith("/manager/v1/worker/?slot=1")
+    assert envs0["cw_pid_file"] != envs1["cw_pid_file"]
+
+
+async def test_worker_routing(tmp_path):
+    manager = make_worker_manager(tmp_path, ["0", "1"])
+    worker0 = await manager.connect("2.5.0", slot=0)
+    worker1 = await manager.connect("2.5.0", slot=1)
+    assert manager.version == "2.5.0"
+
+    futs = [
+        await manager.send_task(make_inference_input(str(i)), deadline=i)
+        for i in range(3)
+    ]
+
+    with fail_after(1):
+        input0, _ = await manager.get_task(worker0)
+        input1, _ = await manager.get_task(worker1)
+    assert input0.task.task_id == "0"
+    assert input1.task.task_id == "1"
+
+    # worker 0 gets the next task only after its running task is done
+    task_ids = []
+
+    async def get_next_task():
+        task_input, _ = await manager.get_task(worker0)
+        task_ids.append(task_input.task.task_id)
+
+    async with create_task_group() as tg:
+        tg.start_soon(get_next_task)
+        await sleep(0.1)
+        assert task_ids == []
+        with manager.task_future(worker0, "0") as fut:
+            fut.set_result(None)
+        with fail_after(1):
+            while len(task_ids) == 0:
+                await sleep(0.01)
+    assert task_ids == ["2"]
+
+    # disconnecting worker 1 only cancels its own task
+    await manager.disconnect(worker1)
+    with pytest.raises(TaskCancelled):
+        await futs[1].get()
+    assert not futs[2].done()
+    slots = {info.slot: info for info in manager.workers()}
+    assert slots[0].running_tasks == ["2"]
+    assert slots[1].worker_id == 0
+    assert await manager.is_connected()
+
+
+async def test_worker_model_stats(tmp_path):
+    manager = make_worker_manager(tmp_path, [])
+    sd15 = models.ModelConfig.from_model_id("base:crynux-ai/stable-diffusion-v1-5+fp16")
+    worker_id = await manager.connect("2.5.0", loaded_models=[sd15])
+
+    model_ids = [sd15.to_model_id(), sd15.to_model_id(), "base:crynux-ai/sdxl-turbo"]
+    for i, model_id in enumerate(model_ids):
+        await manager.send_task(make_inference_input(str(i), [model_id]))
+        with fail_after(1):
+            await manager.get_task(worker_id)
+        with manager.task_future(worker_id, str(i)) as fut:
+            fut.set_result(None)
+        await sleep(0)
+
+    info = manager.workers()[0]
+    assert info.cache_hits == 2
+    assert info.cache_misses == 1
+    assert info.loaded_models == ["base:crynux-ai/sdxl-turbo"]
+
+    await manager.update_loaded_models(worker_id, [sd15])
+    assert manager.workers()[0].loaded_models == [sd15.to_model_id()]
+
+
+async def test_worker_dispatch(tmp_path):
+    manager = make_worker_manager(tmp_path, [])
+    assert manager.dispatch_stats() is None
+    worker_id = await manager.connect("2.5.0")
+
+    await manager.send_task(make_inference_input("0"))
+    with fail_after(1):
+        _, fut = await manager.get_task(worker_id)
+    manager.task_dispatched(fut)
+    stats = manager.dispatch_stats()
+    assert stats is not None
+    assert stats.count == 1
+    assert 0 <= stats.p50 <= stats.max < 1
+
+    # the waiting producer of the old connection stops when the slot is taken by a new connection
+    with manager.task_future(worker_id, "0") as fut:
+        fut.set_result(None)
+
+    async def reconnect():
+        await sleep(0.1)
+        await manager.connect("2.5.0")
+
+    with fail_after(1):
+        async with create_task_group() as tg:
+            tg.start_soon(reconnect)
+            with pytest.raises(WorkerDisconnected):
+                await manager.get_task(worker_id)
+
+
+async def test_worker_standby(tmp_path):
+    manager = make_worker_manager(tmp_path, ["0"], standby=1)
+    assert manager.num_workers == 1
+    slots = manager.workers()
+    assert [(info.slot, info.gpu, info.standby) for info in slots] == [
+        (0, "0", False),
+        (1, "0", True),
+    ]
+
+    active = await manager.connect("2.5.0", slot=0)
+    standby = await manager.connect("2.5.0", slot=1)
+    # the task is past its deadline, so it is cancelled rather than requeued when its worker disconnects
+    fut = await manager.send_task(make_inference_input("0"), deadline=0)
+
+    got = {}
+
+    async def get_task(worker_id: int):
+        task_input, _ = await manager.get_task(worker_id)
+        got[task_input.task.task_id] = worker_id
+
+    with fail_after(1):
+        async with create_task_group() as tg:
+            tg.start_soon(get_task, standby)
+            await get_task(active)
+            # the standby worker gets no task
+            assert got == {"0": active}
+
+            # the standby worker takes the place of the disconnected worker at once
+            await manager.send_task(make_inference_input("1"))
+            await sleep(0.1)
+            assert "1" not in got
+            await manager.disconnect(active)
+    assert got["1"] == standby
+    with pytest.raises(TaskCancelled):
+        await fut.get()
+    assert [info.standby for info in manager.workers()] == [True, False]
+    assert manager.num_workers == 1
+
+    # the restarted worker becomes the standby worker
+    restarted = await manager.connect("2.5.0", slot=0)
+    assert [info.standby for info in manager.workers()] == [True, False]
+    await manager.disconnect(restarted)
+    assert [info.standby for info in manager.workers()] == [True, False]
+
+
+async def test_worker_standby_gpus(tmp_path):
+    manager = make_worker_manager(tmp_path, ["0", "1"], standby=1, standby_gpus=["2"])
+    assert manager.num_workers == 2
+    slots = manager.workers()
+    assert [(info.slot, info.gpu, info.standby) for info in slots] == [
+        (0, "0", False),
+        (1, "1", False),
+        (2, "2", True),
+    ]
+
+    workers = [await manager.connect("2.5.0", slot=i) for i in range(3)]
+    # the standby worker on its own GPU replaces any disconnected worker
+    await manager.disconnect(workers[1])
+    assert [info.standby for info in manager.workers()] == [False, True, False]
+
+    # the restarted worker becomes the standby worker, and its GPU is not used by active workers
+    workers[1] = await manager.connect("2.5.0", slot=1)
+    await manager.disconnect(workers[0])
+    assert [info.standby for info in manager.workers()] == [True, False, False]
+    assert manager.num_workers == 2
+
+
+async def test_worker_requeue(tmp_path):
+    manager = make_worker_manager(tmp_path, ["0", "1"])
+    worker0 = await manager.connect("2.5.0", slot=0)
+    worker1 = await manager.connect("2.5.0", slot=1)
+
+    fut = await manager.send_task(make_inference_input("0"), deadline=time.time() + 100)
+    with fail_after(1):
+        await manager.get_task(worker0)
+
+    # the task of the disconnected worker is sent to the other worker
+    send_time = fut.send_time
+    await manager.disconnect(worker0)
+    assert not fut.done()
+    assert fut.send_time > send_time
+    with fail_after(1):
+        task_input, requeued = await manager.get_task(worker1)
+    assert task_input.task.task_id == "0"
+    assert requeued is fut
+
+    # each task is requeued at most max_requeue times
+    await manager.disconnect(worker1)
+    with pytest.raises(TaskCancelled):
+        await fut.get()
+
+
+class FakeProcess(object):
+    def __init__(self, pid: int) -> None:
+        self.pid = pid
+        self.exit_code = None
+
+    def poll(self):
+        return self.exit_code
+
+
+async def test_worker_supervisor(tmp_path):
+    config = WorkerSupervisorConfig(
+        min_delay=0.1, max_delay=0.2, crash_loop_exits=3, crash_loop_window=60
+    )
+    manager = make_worker_manager(tmp_path, [], supervisor=config)
+
+    def start_worker(slot):
+        slot.process = FakeProcess(slot.restarts + 1)
+
+    def stop_worker(slot):
+        slot.process = None
+
+    manager._start_worker = start_worker  # type: ignore
+    manager._stop_worker = stop_worker  # type: ignore
+    with manager.start():
+        worker_id = await manager.connect("2.5.0")
+        fut = await manager.send_task(make_inference_input("0"))
+
+        # the worker is restarted after the backoff delay
+        manager._slots[0].process.exit_code = 1  # type: ignore
+        await manager.check_workers()
+        info = manager.workers()[0]
+        assert info.restarts == 0
+        assert info.last_exit_code == 1
+        await sleep(0.15)
+        await manager.check_workers()
+        assert manager.workers()[0].restarts == 1
+        assert manager.is_worker_process_alive()
+
+        # exits in the crash loop window
+        for _ in range(2):
+            manager._slots[0].process.exit_code = 2  # type: ignore
+            await manager.check_workers()
+            await sleep(0.25)
+            await manager.check_workers()
+        info = manager.workers()[0]
+        assert info.crash_loop
+        assert info.restarts == 2
+        assert info.last_exit_code == 2
+
+        # queued tasks are cancelled when all workers are in crash loops
+        with pytest.raises(TaskCancelled):
+            await fut.get()
+
+        # a manual restart lets the supervisor restart the worker again
+        manager.restart_worker(0)
+        info = manager.workers()[0]
+        assert not info.crash_loop
+        assert info.restarts == 3
+        await manager.disconnect(worker_id)
+
+
+async def test_worker_task_progress(tmp_path):
+    manager = make_worker_manager(tmp_path, [])
+    worker_id = await manager.connect("2.5.0")
+    await manager.send_task(make_inference_input("0"), deadline=time.time() + 30)
+    with fail_after(1):
+        await manager.get_task(worker_id)
+
+    # progress of unknown tasks is ignored
+    manager.update_progress(
+        worker_id,
+        models.TaskProgress(
+            type="progress", task_id_commitment="1", step=1, total=10, elapsed=1
+        ),
+    )
+    assert manager.get_task_progress("1") is None
+
+    manager.update_progress(
+        worker_id,
+        models.TaskProgress(
+            type="progress", task_id_commitment="0", step=10, total=40, elapsed=5
+        ),
+    )
+    progress = manager.get_task_progress("0")
+    assert progress is not None
+    assert progress.rate == 2
+    assert progress.eta == 15
+    assert not progress.deadline_miss
+
+    manager.update_progress(
+        worker_id,
+        models.TaskProgress(
+            type="progress", task_id_commitment="0", step=20, total=40, elapsed=40
+        ),
+    )
+    progress = manager.get_task_progress("0")
+    assert progress is not None
+    assert progress.eta == 40
+    assert progress.deadline_miss
+    assert [p.task_id_commitment for p in manager.task_progress()] == ["0"]
+
+    with manager.task_future(worker_id, "0") as fut:
+        fut.set_result(None)
+    assert manager.get_task_progress("0") is None
+
+
+async def test_worker_cancel_task(tmp_path):
+    manager = make_worker_manager(tmp_path, [])
+    assert manager.cancel_stats() is None
+    worker_id = await manager.connect("2.5.0", cancellable=True)
+
+    # queued tasks are removed from the exchange
+    fut0 = await manager.send_task(make_inference_input("0"))
+    await manager.cancel_task("0")
+    with pytest.raises(TaskCancelled):
+        await fut0.get()
+
+    fut1 = await manager.send_task(make_inference_input("1"))
+    with fail_after(1):
+        await manager.get_task(worker_id)
+    await manager.cancel_task("1")
+    with pytest.raises(TaskCancelled):
+        await fut1.get()
+    with fail_after(1):
+        assert await manager.cancel_requests(worker_id).receive() == "1"
+    assert manager.workers()[0].cancelling_tasks == ["1"]
+
+    # the worker gets no new task until it stops the cancelled task
+    await manager.send_task(make_inference_input("2"))
+    task_ids = []
+
+    async def get_next_task():
+        task_input, _ = await manager.get_task(worker_id)
+        task_ids.append(task_input.task.task_id)
+
+    async with create_task_group() as tg:
+        tg.start_soon(get_next_task)
+        await sleep(0.1)
+        assert task_ids == []
+        assert manager.finish_cancelled(worker_id, "1")
+        with fail_after(1):
+            while len(task_ids) == 0:
+                await sleep(0.01)
+    assert task_ids == ["2"]
+    assert not manager.finish_cancelled(worker_id, "2")
+
+    stats = manager.cancel_stats()
+    assert stats is not None
+    assert stats.count == 1
+    assert 0.1 <= stats.max < 1
+
+
+async def test_legacy_worker_cancel_task(tmp_path):
+    manager = make_worker_manager(tmp_path, [])
+    worker_id = await manager.connect("2.4.0")
+
+    fut = await manager.send_task(make_inference_input("0"))
+    with fail_after(1):
+        await manager.get_task(worker_id)
+    await manager.cancel_task("0")
+    with pytest.raises(TaskCancelled):
+        await fut.get()
+    await sleep(0)
+    assert manager.workers()[0].running_tasks == []
+    assert manager.workers()[0].cancelling_tasks == ["0"]
+
+    # the legacy worker keeps running the cancelled task, it gets no new task until the result arrives
+    await manager.send_task(make_inference_input("1"))
+    task_ids = []
+
+    async def get_next_task():
+        task_input, _ = await manager.get_task(worker_id)
+        task_ids.append(task_input.task.task_id)
+
+    async with create_task_group() as tg:
+        tg.start_soon(get_next_task)
+        await sleep(0.1)
+        assert task_ids == []
+        assert manager.finish_cancelled(worker_id, "0")
+        with fail_after(1):
+            while len(task_ids) == 0:
+                await sleep(0.01)
+    assert task_ids == ["1"]
+
+    # results of tasks not running on the worker are ignored
+    with manager.task_future(worker_id, "0") as task_future:
+        assert task_future is None
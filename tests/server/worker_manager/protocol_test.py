@@ -0,0 +1,76 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from crynux_server.server.depends import _get_worker_manager
+from crynux_server.server.v1.worker import router
+from crynux_server.worker_manager.protocol import (get_codec,
+                                                   negotiate_protocol,
+                                                   supported_protocols)
+
+from .exchange_test import make_inference_input
+from .manager_test import make_worker_manager
+
+
+def test_negotiate_protocol():
+    assert negotiate_protocol(None) is None
+    assert negotiate_protocol(["msgpack/1", "json/1"]) == "msgpack/1"
+    assert negotiate_protocol(["cbor/1", "json/1"]) == "json/1"
+    assert negotiate_protocol(["cbor/1"]) is None
+    assert "msgpack/1" in supported_protocols
+
+
+@pytest.mark.parametrize("protocol", [None, "json/1", "msgpack/1"])
+def test_codec_roundtrip(protocol):
+    codec = get_codec(protocol)
+    msg = make_inference_input("0", ["base:crynux-ai/sdxl-turbo"]).model_dump(mode="json")
+    data = codec.encode(msg)
+    assert isinstance(data, bytes) == codec.binary
+    assert codec.decode(data) == msg
+
+
+def test_worker_msgpack_protocol(tmp_path):
+    manager = make_worker_manager(tmp_path, [])
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[_get_worker_manager] = lambda: manager
+    codec = get_codec("msgpack/1")
+
+    client = TestClient(app)
+    with client.websocket_connect("/worker/") as ws:
+        ws.send_json({"version": "2.5.0", "protocols": ["msgpack/1", "json/1"]})
+        resp = ws.receive_json()
+        assert resp["protocol"] == "msgpack/1"
+
+        task_input = make_inference_input("0")
+        fut = ws.portal.call(manager.send_task, task_input)
+        msg = codec.decode(ws.receive_bytes())
+        assert msg == task_input.model_dump(mode="json")
+
+        # the worker reports the result files it hashed
+        files = [{"path": "0.png", "size": 10, "hash": "ab" * 8}]
+        ws.send_bytes(
+            codec.encode(
+                {
+                    "task_name": "inference",
+                    "task_id_commitment": "0",
+                    "result": {"status": "success", "files": files},
+                }
+            )
+        )
+        res = ws.portal.call(fut.get)
+        assert [f.model_dump() for f in res] == files
+
+
+def test_worker_legacy_protocol(tmp_path):
+    manager = make_worker_manager(tmp_path, [])
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[_get_worker_manager] = lambda: manager
+
+    client = TestClient(app)
+    with client.websocket_connect("/worker/") as ws:
+        ws.send_json({"version": "2.5.0"})
+        assert ws.receive_json() == {"worker_id": 1}
+        # legacy workers still get keepalive frames
+        assert ws.receive_text() == ""